@@ -0,0 +1,50 @@
+'''
+Compares the rate at which frames are read from a file by the player when the
+frames are paced in realtime and when the player is unthrottled.
+
+To run, optionally provide a filename on the command line when running the
+file, otherwise ``dw11222.mp4`` is used.
+'''
+
+import sys
+import time
+from os.path import join, dirname
+from ffpyplayer.player import MediaPlayer
+
+
+def read_frames(filename, ff_opts, max_frames=0):
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    player = MediaPlayer(filename, callback=callback, ff_opts=ff_opts)
+    count = 0
+    ts = time.perf_counter()
+    while not error[0] and (not max_frames or count < max_frames):
+        frame, val = player.get_frame()
+        if val == 'eof':
+            break
+        elif frame is None:
+            time.sleep(0.001)
+        else:
+            count += 1
+    te = time.perf_counter()
+    player.close_player()
+
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+    return count, te - ts
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else \
+        join(dirname(__file__), 'dw11222.mp4')
+
+    for name, opts in [
+            ('paced', {'an': True, 'sync': 'video'}),
+            ('unthrottled', {'unthrottled': True})]:
+        count, elapsed = read_frames(filename, opts, max_frames=600)
+        print('{}: {} frames in {:.2f}s, {:.1f} fps'.format(
+            name, count, elapsed, count / elapsed))
@@ -0,0 +1,349 @@
+'''
+Benchmarks of decoding, conversion, playback, and encoding, used to catch
+performance regressions between releases.
+
+Synthetic videos of each requested size and codec are first written with
+:class:`~ffpyplayer.writer.MediaWriter` into a temporary directory. Then each
+benchmark is run on them, and the results are printed and optionally saved as
+JSON. A previous JSON result can be passed with ``--compare`` to list the
+metrics that got worse by more than ``--threshold``. E.g.::
+
+    python benchmarks.py --output new.json --compare old.json
+
+Run with ``--help`` for all the options.
+'''
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import threading
+import time
+from os.path import join
+
+import ffpyplayer
+from ffpyplayer.pic import Image, ImageLoader, SWScale
+from ffpyplayer.player import MediaPlayer
+from ffpyplayer.player.frame_queue import _benchmark_queues
+from ffpyplayer.tools import get_codecs
+from ffpyplayer.writer import MediaWriter
+
+# metrics where a larger value is better, all the others are times
+higher_is_better = ('fps', 'frames', 'frame_queue', 'packet_queue')
+
+default_pix_fmt_pairs = (
+    ('rgb24', 'yuv420p'), ('yuv420p', 'rgb24'), ('rgb24', 'gray'),
+    ('yuv420p', 'bgra'))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def get_gradient_image(w, h, offset=0):
+    '''Returns a rgb24 image with a horizontal gradient shifted by ``offset``
+    pixels, so that consecutive frames differ.
+    '''
+    row = bytearray((((x + offset) * 255) // w) % 256 for x in range(w) for _ in range(3))
+    return Image(plane_buffers=[row * h], pix_fmt='rgb24', size=(w, h))
+
+
+def make_media(directory, codec, w, h, n_frames, frame_rate=30):
+    '''Writes a video with ``n_frames`` frames using ``codec`` and returns its
+    filename.
+    '''
+    filename = join(directory, '{}_{}x{}.mkv'.format(codec, w, h))
+    writer = MediaWriter(
+        filename, [{
+            'pix_fmt_in': 'rgb24', 'width_in': w, 'height_in': h,
+            'codec': codec, 'frame_rate': (frame_rate, 1)}],
+        fmt='matroska', overwrite=True)
+
+    images = [get_gradient_image(w, h, i * 8) for i in range(8)]
+    for i in range(n_frames):
+        writer.write_frame(img=images[i % len(images)], pts=i / frame_rate, stream=0)
+    writer.close()
+    return filename
+
+
+def bench_image_loader(filename):
+    loader = ImageLoader(filename)
+    count = 0
+    ts = time.perf_counter()
+    while True:
+        img, t = loader.next_frame()
+        if img is None:
+            break
+        count += 1
+    elapsed = time.perf_counter() - ts
+    return {'frames': count, 'fps': count / elapsed}
+
+
+def bench_player(filename, out_fmt='rgb24', thread_lib='SDL'):
+    '''Reads all the frames in unthrottled mode, and times each
+    :meth:`~ffpyplayer.player.MediaPlayer.get_frame` call that returned a frame.
+    '''
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    player = MediaPlayer(
+        filename, callback=callback, thread_lib=thread_lib,
+        ff_opts={'unthrottled': True, 'out_fmt': out_fmt})
+    latencies = []
+    count = 0
+    ts = time.perf_counter()
+    try:
+        while not error[0]:
+            t0 = time.perf_counter()
+            frame, val = player.get_frame(block=True, timeout=5)
+            if val == 'eof':
+                break
+            if frame is not None:
+                latencies.append(time.perf_counter() - t0)
+                count += 1
+        elapsed = time.perf_counter() - ts
+    finally:
+        player.close_player()
+
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+    return {
+        'frames': count, 'fps': count / elapsed,
+        'get_frame_mean': sum(latencies) / max(len(latencies), 1),
+        'get_frame_p50': percentile(latencies, .5),
+        'get_frame_p99': percentile(latencies, .99)}
+
+
+def bench_thread_lib(filename, thread_lib, n_players):
+    '''The total throughput of ``n_players`` players reading the file at once,
+    each from its own thread, so their packet and frame queues are contended.
+    '''
+    results = [None] * n_players
+
+    def run_player(i):
+        results[i] = bench_player(filename, thread_lib=thread_lib)
+
+    threads = [
+        threading.Thread(target=run_player, args=(i, )) for i in range(n_players)]
+    ts = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - ts
+
+    if any(r is None for r in results):
+        raise Exception('A player failed with thread_lib {}'.format(thread_lib))
+    count = sum(r['frames'] for r in results)
+    return {
+        'frames': count, 'fps': count / elapsed,
+        'get_frame_p99': max(r['get_frame_p99'] for r in results)}
+
+
+def bench_queues(thread_lib, n_items):
+    '''The number of items per second passed between two threads through the
+    frame and packet queues, without any decoding.
+    '''
+    return _benchmark_queues(n_items, thread_lib)
+
+
+def wait_for_frame(player, min_pts=None, timeout=10):
+    ts = time.perf_counter()
+    while time.perf_counter() - ts < timeout:
+        frame, val = player.get_frame(block=True, timeout=.1)
+        if frame is not None and (min_pts is None or frame[1] >= min_pts):
+            return time.perf_counter() - ts
+    raise TimeoutError('Timed out waiting for a frame')
+
+
+def bench_open_seek(filename, duration):
+    '''The time from opening the file until the first frame is returned, and
+    from seeking to the middle until a frame from there is returned.
+    '''
+    ts = time.perf_counter()
+    player = MediaPlayer(filename, ff_opts={'unthrottled': True})
+    try:
+        wait_for_frame(player)
+        open_time = time.perf_counter() - ts
+
+        target = duration / 2.
+        ts = time.perf_counter()
+        player.seek(target, relative=False, accurate=False)
+        # a non-accurate seek lands on the previous keyframe
+        wait_for_frame(player, min_pts=target - 1)
+        seek_time = time.perf_counter() - ts
+    finally:
+        player.close_player()
+    return {'open': open_time, 'seek': seek_time}
+
+
+def bench_sws(w, h, pix_fmt_pairs, repeat):
+    results = {}
+    src_rgb = get_gradient_image(w, h)
+    for ifmt, ofmt in pix_fmt_pairs:
+        src = src_rgb
+        if ifmt != 'rgb24':
+            src = SWScale(w, h, 'rgb24', ofmt=ifmt).scale(src_rgb)
+
+        sws = SWScale(w, h, ifmt, ofmt=ofmt)
+        dst = sws.scale(src)
+        ts = time.perf_counter()
+        for _ in range(repeat):
+            sws.scale(src, dst=dst)
+        results['{}_to_{}'.format(ifmt, ofmt)] = (time.perf_counter() - ts) / repeat
+    return results
+
+
+def bench_copy(w, h, repeat):
+    img = get_gradient_image(w, h)
+    results = {}
+    for name in ('to_memoryview', 'to_bytearray'):
+        f = getattr(img, name)
+        ts = time.perf_counter()
+        for _ in range(repeat):
+            f()
+        results[name] = (time.perf_counter() - ts) / repeat
+    return results
+
+
+def bench_encode(directory, codec, w, h, n_frames, frame_rate=30):
+    filename = join(directory, 'encode_{}_{}x{}.mkv'.format(codec, w, h))
+    images = [get_gradient_image(w, h, i * 8) for i in range(8)]
+    writer = MediaWriter(
+        filename, [{
+            'pix_fmt_in': 'rgb24', 'width_in': w, 'height_in': h,
+            'codec': codec, 'frame_rate': (frame_rate, 1)}],
+        fmt='matroska', overwrite=True)
+
+    ts = time.perf_counter()
+    for i in range(n_frames):
+        writer.write_frame(img=images[i % len(images)], pts=i / frame_rate, stream=0)
+    writer.close()
+    elapsed = time.perf_counter() - ts
+    return {'frames': n_frames, 'fps': n_frames / elapsed}
+
+
+def run(sizes, codecs, n_frames, repeat, pix_fmt_pairs, thread_libs, n_players,
+        n_queue_items):
+    results = {}
+    for thread_lib in thread_libs:
+        results['queues/' + thread_lib] = bench_queues(thread_lib, n_queue_items)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for w, h in sizes:
+            size = '{}x{}'.format(w, h)
+            results['sws/{}'.format(size)] = bench_sws(w, h, pix_fmt_pairs, repeat)
+            results['copy/{}'.format(size)] = bench_copy(w, h, repeat)
+
+            for codec in codecs:
+                name = '{}/{}'.format(codec, size)
+                results['encode/' + name] = bench_encode(
+                    directory, codec, w, h, n_frames)
+
+                filename = make_media(directory, codec, w, h, n_frames)
+                results['image_loader/' + name] = bench_image_loader(filename)
+                results['player/' + name] = bench_player(filename)
+                results['open_seek/' + name] = bench_open_seek(
+                    filename, n_frames / 30.)
+                for thread_lib in thread_libs:
+                    results['thread_lib/{}/{}'.format(thread_lib, name)] = \
+                        bench_thread_lib(filename, thread_lib, n_players)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''Returns a list of ``(name, metric, old, new)`` of the metrics that got
+    worse by more than ``threshold`` (a fraction) relative to the baseline.
+    '''
+    regressions = []
+    for name, metrics in results.items():
+        for metric, new in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not old or metric == 'frames':
+                continue
+            if metric in higher_is_better:
+                worse = new < old * (1 - threshold)
+            else:
+                worse = new > old * (1 + threshold)
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def parse_size(size):
+    w, h = size.lower().split('x')
+    return int(w), int(h)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--sizes', default='320x240,1280x720',
+        help='Comma separated list of WxH frame sizes.')
+    parser.add_argument(
+        '--codecs', default='rawvideo,mpeg4,libx264',
+        help='Comma separated list of codecs. Those not available are skipped.')
+    parser.add_argument(
+        '--frames', type=int, default=150,
+        help='The number of frames in each generated video.')
+    parser.add_argument(
+        '--repeat', type=int, default=50,
+        help='How many times to repeat the conversion and copy benchmarks.')
+    parser.add_argument(
+        '--thread-libs', default='SDL,python,native',
+        help='Comma separated list of the player thread_lib backends to compare.')
+    parser.add_argument(
+        '--players', type=int, default=4,
+        help='The number of players run at once when comparing the thread_lib '
+             'backends.')
+    parser.add_argument(
+        '--queue-items', type=int, default=200000,
+        help='The number of items passed through the queues in the queue '
+             'benchmark of each thread_lib backend.')
+    parser.add_argument('--output', help='The JSON file to write the results to.')
+    parser.add_argument('--compare', help='A previous JSON result to compare to.')
+    parser.add_argument(
+        '--threshold', type=float, default=.1,
+        help='The fraction by which a metric may get worse before being reported.')
+    args = parser.parse_args()
+
+    available = get_codecs(encode=True, video=True)
+    codecs = [c for c in args.codecs.split(',') if c in available]
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+
+    thread_libs = [t for t in args.thread_libs.split(',') if t]
+    results = run(
+        sizes, codecs, args.frames, args.repeat, default_pix_fmt_pairs, thread_libs,
+        args.players, args.queue_items)
+    for name, metrics in results.items():
+        print('{}: {}'.format(name, ', '.join(
+            '{}={:.6g}'.format(k, v) for k, v in metrics.items())))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'version': ffpyplayer.__version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'config': {
+                    'sizes': sizes, 'codecs': codecs, 'frames': args.frames,
+                    'repeat': args.repeat, 'thread_libs': thread_libs,
+                    'players': args.players, 'queue_items': args.queue_items},
+                'results': results}, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print('Regression: {} {}: {:.6g} -> {:.6g}'.format(name, metric, old, new))
+        if regressions:
+            sys.exit(1)
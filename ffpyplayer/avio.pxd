@@ -0,0 +1,46 @@
+include 'includes/ffmpeg.pxi'
+
+from cpython.buffer cimport Py_buffer
+
+
+cdef struct BufferReader:
+    const uint8_t *data
+    int64_t size
+    int64_t pos
+
+
+cdef class AVIOSource(object):
+    cdef AVIOContext *ctx
+    cdef int buffer_size
+    # set when reading from a contiguous buffer, which doesn't need the GIL
+    cdef int is_buffer
+    cdef Py_buffer view
+    cdef BufferReader reader
+    # the file-like object otherwise
+    cdef object fh
+    cdef object readinto
+    cdef int seekable
+    cdef int attached
+    cdef object error
+
+    cdef int attach(AVIOSource self, AVFormatContext *fmt_ctx) except 1
+    cdef int raise_error(AVIOSource self) except 1
+
+
+cdef class AVIOSink(object):
+    cdef AVIOContext *ctx
+    cdef int buffer_size
+    # either the file-like object, or the callback called with the data
+    cdef object fh
+    cdef object callback
+    cdef int seekable
+    cdef int attached
+    cdef object error
+
+    cdef int attach(AVIOSink self, AVFormatContext *fmt_ctx) except 1
+    cdef int raise_error(AVIOSink self) except 1
+
+
+cdef int is_avio_source(object src)
+cdef AVIOSource get_avio_source(object src)
+cdef AVIOSink get_avio_sink(object dst)
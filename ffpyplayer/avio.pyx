@@ -0,0 +1,381 @@
+'''
+FFmpeg custom IO
+================
+
+Allows FFmpeg to read media from Python file-like objects and memory buffers,
+and to write media to file-like objects or callbacks, rather than only to and
+from filenames or urls. See :class:`AVIOSource` and :class:`AVIOSink`.
+'''
+
+__all__ = ('AVIOSource', 'AVIOSink')
+
+include "includes/inline_funcs.pxi"
+
+cdef extern from "string.h" nogil:
+    void *memcpy(void *, const void *, size_t)
+
+cdef extern from "errno.h" nogil:
+    int EIO
+
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE, \
+    PyObject_CheckBuffer
+
+import ffpyplayer.tools  # required to init ffmpeg
+from os import PathLike
+
+
+cdef int read_buffer(void *opaque, uint8_t *buf, int buf_size) noexcept nogil:
+    cdef BufferReader *reader = <BufferReader *>opaque
+    cdef int64_t n = reader.size - reader.pos
+    if n <= 0:
+        return AVERROR_EOF
+    if n > buf_size:
+        n = buf_size
+
+    memcpy(buf, reader.data + reader.pos, n)
+    reader.pos += n
+    return <int>n
+
+
+cdef int64_t seek_buffer(void *opaque, int64_t offset, int whence) noexcept nogil:
+    cdef BufferReader *reader = <BufferReader *>opaque
+    cdef int64_t pos
+    if whence & AVSEEK_SIZE:
+        return reader.size
+
+    whence &= ~AVSEEK_FORCE
+    if whence == 0:  # SEEK_SET
+        pos = offset
+    elif whence == 1:  # SEEK_CUR
+        pos = reader.pos + offset
+    elif whence == 2:  # SEEK_END
+        pos = reader.size + offset
+    else:
+        return AVERROR(EINVAL)
+
+    if pos < 0 or pos > reader.size:
+        return AVERROR(EINVAL)
+    reader.pos = pos
+    return pos
+
+
+cdef int read_file(void *opaque, uint8_t *buf, int buf_size) noexcept with gil:
+    cdef AVIOSource self = <AVIOSource>opaque
+    cdef bytes data
+    cdef int n
+    try:
+        if self.readinto is not None:
+            n = self.readinto(<uint8_t[:buf_size]>buf) or 0
+        else:
+            data = bytes(self.fh.read(buf_size))
+            n = min(len(data), buf_size)
+            memcpy(buf, <const char *>data, n)
+    except BaseException as e:
+        self.error = e
+        return AVERROR(EIO)
+
+    if not n:
+        return AVERROR_EOF
+    return n
+
+
+cdef int64_t seek_fh(object fh, int64_t offset, int whence) except? -1:
+    if whence & AVSEEK_SIZE:
+        pos = fh.tell()
+        fh.seek(0, 2)
+        size = fh.tell()
+        fh.seek(pos, 0)
+        return size
+
+    whence &= ~AVSEEK_FORCE
+    if whence not in (0, 1, 2):
+        return AVERROR(EINVAL)
+    fh.seek(offset, whence)
+    return fh.tell()
+
+
+cdef int64_t seek_file(void *opaque, int64_t offset, int whence) noexcept with gil:
+    cdef AVIOSource self = <AVIOSource>opaque
+    try:
+        return seek_fh(self.fh, offset, whence)
+    except BaseException as e:
+        self.error = e
+        return AVERROR(EIO)
+
+
+cdef int write_sink(void *opaque, uint8_t *buf, int buf_size) noexcept with gil:
+    cdef AVIOSink self = <AVIOSink>opaque
+    cdef bytes data = (<char *>buf)[:buf_size]
+    try:
+        if self.callback is not None:
+            self.callback(data)
+            return buf_size
+
+        view = memoryview(data)
+        while view:
+            n = self.fh.write(view)
+            if n is None:  # buffered files write everything
+                break
+            view = view[n:]
+    except BaseException as e:
+        self.error = e
+        return AVERROR(EIO)
+    return buf_size
+
+
+cdef int64_t seek_sink(void *opaque, int64_t offset, int whence) noexcept with gil:
+    cdef AVIOSink self = <AVIOSink>opaque
+    try:
+        return seek_fh(self.fh, offset, whence)
+    except BaseException as e:
+        self.error = e
+        return AVERROR(EIO)
+
+
+cdef class AVIOSource(object):
+    '''Reads the media from a Python object rather than from a file or url.
+
+    It can be passed in place of the filename to
+    :class:`~ffpyplayer.player.MediaPlayer` and :class:`~ffpyplayer.pic.ImageLoader`.
+    Any object that is not a ``str`` or path is automatically wrapped in a
+    :class:`AVIOSource` by them, so this only needs to be created directly to
+    change the ``buffer_size``. A source can only be read by one of them.
+
+    :Parameters:
+
+        `src`: object
+            Either an object that supports the buffer protocol and holds the
+            whole media, e.g. ``bytearray``, ``memoryview``, or ``mmap``, or a
+            readable binary file-like object.
+
+            Buffers are read without the GIL, and the object may not be resized
+            while it's used. Because ``bytes`` are accepted as filenames elsewhere,
+            wrap a ``bytes`` object in a ``memoryview`` to read from it.
+
+            File-like objects are read with their ``readinto`` method if available,
+            otherwise ``read``. If they are seekable (``seekable()`` returns True,
+            or if missing, they have a ``seek`` method), the media can be seeked.
+            Reading them requires the GIL.
+        `buffer_size`: int
+            The size of the buffer FFmpeg reads into. Defaults to 64 KiB.
+
+    For example:
+
+    .. code-block:: python
+
+        >>> import io
+        >>> from ffpyplayer.player import MediaPlayer
+        >>> with open('video.mp4', 'rb') as fh:
+        ...     data = fh.read()
+        >>> player = MediaPlayer(memoryview(data))
+        >>> player = MediaPlayer(io.BytesIO(data))
+    '''
+
+    def __cinit__(self, src, int buffer_size=65536):
+        cdef unsigned char *buffer = NULL
+        cdef void *opaque
+        cdef int64_t (*seek)(void *, int64_t, int) noexcept
+        self.ctx = NULL
+        self.is_buffer = 0
+        self.attached = 0
+        self.error = None
+        self.fh = self.readinto = None
+
+        if buffer_size <= 0:
+            raise ValueError('buffer_size must be positive')
+        self.buffer_size = buffer_size
+
+        if PyObject_CheckBuffer(src):
+            PyObject_GetBuffer(src, &self.view, PyBUF_SIMPLE)
+            self.is_buffer = 1
+            self.reader.data = <const uint8_t *>self.view.buf
+            self.reader.size = self.view.len
+            self.reader.pos = 0
+            self.seekable = 1
+            opaque = &self.reader
+        else:
+            if not hasattr(src, 'read'):
+                raise TypeError(
+                    '{} is neither a buffer nor a file-like object'.format(src))
+            self.fh = src
+            self.readinto = getattr(src, 'readinto', None)
+            if hasattr(src, 'seekable'):
+                self.seekable = bool(src.seekable())
+            else:
+                self.seekable = hasattr(src, 'seek')
+            opaque = <void *>self
+
+        buffer = <unsigned char *>av_malloc(buffer_size)
+        if buffer == NULL:
+            raise MemoryError()
+
+        if self.is_buffer:
+            self.ctx = avio_alloc_context(
+                buffer, buffer_size, 0, opaque, read_buffer, NULL, seek_buffer)
+        else:
+            if self.seekable:
+                seek = seek_file
+            else:
+                seek = NULL
+            self.ctx = avio_alloc_context(
+                buffer, buffer_size, 0, opaque, read_file, NULL, seek)
+        if self.ctx == NULL:
+            av_free(buffer)
+            raise MemoryError()
+        self.ctx.seekable = self.seekable
+
+    def __dealloc__(self):
+        if self.ctx != NULL:
+            # FFmpeg may have replaced the buffer
+            av_freep(&self.ctx.buffer)
+            avio_context_free(&self.ctx)
+        if self.is_buffer:
+            PyBuffer_Release(&self.view)
+            self.is_buffer = 0
+
+    cdef int attach(AVIOSource self, AVFormatContext *fmt_ctx) except 1:
+        '''Sets the context to read from the source. It must be called before
+        avformat_open_input, and the source must outlive the context.
+        '''
+        if self.attached:
+            raise ValueError('The source has already been used')
+        self.attached = 1
+        fmt_ctx.pb = self.ctx
+        # so FFmpeg never closes it, even if the input fails to open
+        fmt_ctx.flags |= AVFMT_FLAG_CUSTOM_IO
+        return 0
+
+    cdef int raise_error(AVIOSource self) except 1:
+        '''Raises the exception raised by the file-like object, if any.
+        '''
+        cdef object error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+        return 0
+
+
+cdef int is_avio_source(object src):
+    '''Whether ``src`` should be read with a :class:`AVIOSource` rather than
+    opened by name.
+    '''
+    return not isinstance(src, (str, bytes, PathLike))
+
+
+cdef AVIOSource get_avio_source(object src):
+    if isinstance(src, AVIOSource):
+        return src
+    return AVIOSource(src)
+
+
+cdef class AVIOSink(object):
+    '''Writes the media to a Python object rather than to a file or url.
+
+    It can be passed in place of the filename to :class:`~ffpyplayer.writer.MediaWriter`,
+    which automatically wraps any object that is not a ``str`` or path in a
+    :class:`AVIOSink`, so this only needs to be created directly to change the
+    ``buffer_size``. A sink can only be written by one writer.
+
+    :Parameters:
+
+        `dst`: object
+            Either a writable binary file-like object, or a callable that is
+            called with a ``bytes`` object for each block of data written.
+
+            File-like objects are written with their ``write`` method. If they
+            are seekable (``seekable()`` returns True, or if missing, they have a
+            ``seek`` method), the muxer may seek back to update e.g. the header
+            once all the frames were written. Callables are never seekable, so the
+            format must be streamable, e.g. ``mpegts``, ``matroska``, or a
+            fragmented ``mp4``.
+
+            Writing requires the GIL, and it happens from the thread that writes
+            the packets.
+        `buffer_size`: int
+            The size of the buffer into which FFmpeg writes. The data is only
+            passed on once the buffer holds at least this much data, or when
+            the writer is closed, so that ``dst`` receives a few large writes
+            rather than one for each packet. Defaults to 64 KiB.
+
+    For example, to stream a fragmented mp4:
+
+    .. code-block:: python
+
+        >>> from ffpyplayer.writer import MediaWriter
+        >>> chunks = []
+        >>> writer = MediaWriter(chunks.append, [out_opts], fmt='mp4')
+    '''
+
+    def __cinit__(self, dst, int buffer_size=65536):
+        cdef unsigned char *buffer = NULL
+        cdef int64_t (*seek)(void *, int64_t, int) noexcept
+        self.ctx = NULL
+        self.attached = 0
+        self.error = None
+        self.fh = self.callback = None
+
+        if buffer_size <= 0:
+            raise ValueError('buffer_size must be positive')
+        self.buffer_size = buffer_size
+
+        if hasattr(dst, 'write'):
+            self.fh = dst
+            if hasattr(dst, 'seekable'):
+                self.seekable = bool(dst.seekable())
+            else:
+                self.seekable = hasattr(dst, 'seek')
+        elif callable(dst):
+            self.callback = dst
+            self.seekable = 0
+        else:
+            raise TypeError(
+                '{} is neither a file-like object nor callable'.format(dst))
+
+        buffer = <unsigned char *>av_malloc(buffer_size)
+        if buffer == NULL:
+            raise MemoryError()
+
+        if self.seekable:
+            seek = seek_sink
+        else:
+            seek = NULL
+        self.ctx = avio_alloc_context(
+            buffer, buffer_size, 1, <void *>self, NULL, write_sink, seek)
+        if self.ctx == NULL:
+            av_free(buffer)
+            raise MemoryError()
+        self.ctx.seekable = self.seekable
+        # muxers flush after each packet unless this much is buffered
+        self.ctx.min_packet_size = buffer_size
+
+    def __dealloc__(self):
+        if self.ctx != NULL:
+            av_freep(&self.ctx.buffer)
+            avio_context_free(&self.ctx)
+
+    cdef int attach(AVIOSink self, AVFormatContext *fmt_ctx) except 1:
+        '''Sets the context to write to the sink. The sink must outlive the
+        context, and the context must be flushed before it's freed.
+        '''
+        if self.attached:
+            raise ValueError('The sink has already been used')
+        self.attached = 1
+        fmt_ctx.pb = self.ctx
+        fmt_ctx.flags |= AVFMT_FLAG_CUSTOM_IO
+        return 0
+
+    cdef int raise_error(AVIOSink self) except 1:
+        '''Raises the exception raised by the file-like object or callback,
+        if any.
+        '''
+        cdef object error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+        return 0
+
+
+cdef AVIOSink get_avio_sink(object dst):
+    if isinstance(dst, AVIOSink):
+        return dst
+    return AVIOSink(dst)
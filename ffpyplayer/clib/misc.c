@@ -1,6 +1,13 @@
 
 #include "misc.h"
 
+#if defined(_WIN32)
+#include <winsock2.h>
+#pragma comment(lib, "ws2_32.lib")
+#else
+#include <unistd.h>
+#endif
+
 #define FLAGS (o->type == AV_OPT_TYPE_FLAGS) ? AV_DICT_APPEND : 0
 void print_all_libs_info(int flags, int level)
 {
@@ -184,3 +191,25 @@ int get_plane_sizes(int size[4], int required_plane[4], enum AVPixelFormat pix_f
 
     return total_size;
 }
+
+/* Writes a byte to the file descriptor (a socket on Windows) to wake up whoever
+ * waits on its other end. Returns a negative value on failure, e.g. when the
+ * fd is non-blocking and full, in which case the reader has pending data anyway. */
+int notify_fd(int fd)
+{
+#if defined(_WIN32)
+    return send((SOCKET)fd, "f", 1, 0);
+#else
+    return write(fd, "f", 1);
+#endif
+}
+
+/* Atomically increments the value and returns its previous value. */
+int64_t atomic_fetch_inc64(int64_t *val)
+{
+#if defined(_MSC_VER)
+    return InterlockedExchangeAdd64((volatile LONG64 *)val, 1);
+#else
+    return __atomic_fetch_add(val, 1, __ATOMIC_RELAXED);
+#endif
+}
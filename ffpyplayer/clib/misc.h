@@ -59,4 +59,8 @@ int opt_default(const char *opt, const char *arg,
 int get_plane_sizes(int size[4], int required_plane[4], enum AVPixelFormat pix_fmt,
     int height, const int linesizes[4]);
 
+int notify_fd(int fd);
+
+int64_t atomic_fetch_inc64(int64_t *val);
+
 #endif
@@ -0,0 +1,392 @@
+
+#ifndef _MT_NATIVE_H
+#define _MT_NATIVE_H
+
+/*
+ * Mutexes, conditions, and threads built directly on the OS threads, used by
+ * the Native_MT backend of ffpyplayer.threading. Unlike the SDL and python
+ * backends they need no library initialization and never take the GIL.
+ * Timed waits are measured on a monotonic clock where available.
+ *
+ * All functions return 0 on success and a negative value on failure, except
+ * native_cond_wait_timeout which returns NATIVE_MUTEX_TIMEDOUT on a timeout.
+ *
+ * It also provides sequentially consistent atomic loads, stores and additions
+ * of ints and loads and stores of int64s, used by the single producer single
+ * consumer queues to share their counters without locking, and acquire/release
+ * loads, stores and fences of int64s, used by the seqlocks of the trace spans.
+ */
+
+#include <stdlib.h>
+#include <stdint.h>
+
+#define NATIVE_MUTEX_TIMEDOUT 1
+
+typedef int (*native_thread_func)(void *);
+
+#ifdef _MSC_VER
+
+#include <intrin.h>
+
+static __inline int native_atomic_load(int *value)
+{
+    return _InterlockedCompareExchange((volatile long *)value, 0, 0);
+}
+
+static __inline void native_atomic_store(int *value, int new_value)
+{
+    _InterlockedExchange((volatile long *)value, new_value);
+}
+
+/* returns the new value */
+static __inline int native_atomic_add(int *value, int delta)
+{
+    return _InterlockedExchangeAdd((volatile long *)value, delta) + delta;
+}
+
+static __inline int64_t native_atomic_load64(int64_t *value)
+{
+    return _InterlockedCompareExchange64((volatile __int64 *)value, 0, 0);
+}
+
+static __inline void native_atomic_store64(int64_t *value, int64_t new_value)
+{
+    _InterlockedExchange64((volatile __int64 *)value, new_value);
+}
+
+/* the interlocked functions are full barriers */
+static __inline int64_t native_atomic_load64_acquire(int64_t *value)
+{
+    return _InterlockedCompareExchange64((volatile __int64 *)value, 0, 0);
+}
+
+static __inline void native_atomic_store64_release(int64_t *value, int64_t new_value)
+{
+    _InterlockedExchange64((volatile __int64 *)value, new_value);
+}
+
+static __inline void native_atomic_fence(void)
+{
+    volatile long barrier = 0;
+    _InterlockedExchange(&barrier, 0);
+}
+
+#define native_atomic_fence_acquire native_atomic_fence
+#define native_atomic_fence_release native_atomic_fence
+
+#else
+
+static inline int native_atomic_load(int *value)
+{
+    return __atomic_load_n(value, __ATOMIC_SEQ_CST);
+}
+
+static inline void native_atomic_store(int *value, int new_value)
+{
+    __atomic_store_n(value, new_value, __ATOMIC_SEQ_CST);
+}
+
+/* returns the new value */
+static inline int native_atomic_add(int *value, int delta)
+{
+    return __atomic_add_fetch(value, delta, __ATOMIC_SEQ_CST);
+}
+
+static inline int64_t native_atomic_load64(int64_t *value)
+{
+    return __atomic_load_n(value, __ATOMIC_SEQ_CST);
+}
+
+static inline void native_atomic_store64(int64_t *value, int64_t new_value)
+{
+    __atomic_store_n(value, new_value, __ATOMIC_SEQ_CST);
+}
+
+static inline int64_t native_atomic_load64_acquire(int64_t *value)
+{
+    return __atomic_load_n(value, __ATOMIC_ACQUIRE);
+}
+
+static inline void native_atomic_store64_release(int64_t *value, int64_t new_value)
+{
+    __atomic_store_n(value, new_value, __ATOMIC_RELEASE);
+}
+
+static inline void native_atomic_fence_acquire(void)
+{
+    __atomic_thread_fence(__ATOMIC_ACQUIRE);
+}
+
+static inline void native_atomic_fence_release(void)
+{
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+}
+
+#endif
+
+#ifdef _WIN32
+
+#include <windows.h>
+#include <process.h>
+
+typedef struct native_mutex {
+    SRWLOCK lock;
+} native_mutex;
+
+typedef struct native_cond {
+    CONDITION_VARIABLE cond;
+} native_cond;
+
+typedef struct native_thread {
+    HANDLE handle;
+    native_thread_func func;
+    void *arg;
+    int status;
+} native_thread;
+
+static native_mutex *native_mutex_create(void)
+{
+    native_mutex *mutex = (native_mutex *)malloc(sizeof(native_mutex));
+    if (mutex)
+        InitializeSRWLock(&mutex->lock);
+    return mutex;
+}
+
+static void native_mutex_destroy(native_mutex *mutex)
+{
+    free(mutex);
+}
+
+static int native_mutex_lock(native_mutex *mutex)
+{
+    AcquireSRWLockExclusive(&mutex->lock);
+    return 0;
+}
+
+static int native_mutex_unlock(native_mutex *mutex)
+{
+    ReleaseSRWLockExclusive(&mutex->lock);
+    return 0;
+}
+
+static native_cond *native_cond_create(void)
+{
+    native_cond *cond = (native_cond *)malloc(sizeof(native_cond));
+    if (cond)
+        InitializeConditionVariable(&cond->cond);
+    return cond;
+}
+
+static void native_cond_destroy(native_cond *cond)
+{
+    free(cond);
+}
+
+static int native_cond_signal(native_cond *cond)
+{
+    WakeConditionVariable(&cond->cond);
+    return 0;
+}
+
+static int native_cond_broadcast(native_cond *cond)
+{
+    WakeAllConditionVariable(&cond->cond);
+    return 0;
+}
+
+/* the timeout of SleepConditionVariableSRW is already measured monotonically */
+static int native_cond_wait_timeout(native_cond *cond, native_mutex *mutex, uint32_t ms)
+{
+    if (SleepConditionVariableSRW(&cond->cond, &mutex->lock, ms, 0))
+        return 0;
+    return GetLastError() == ERROR_TIMEOUT ? NATIVE_MUTEX_TIMEDOUT : -1;
+}
+
+static int native_cond_wait(native_cond *cond, native_mutex *mutex)
+{
+    return SleepConditionVariableSRW(&cond->cond, &mutex->lock, INFINITE, 0) ? 0 : -1;
+}
+
+static unsigned __stdcall native_thread_start(void *data)
+{
+    native_thread *thread = (native_thread *)data;
+    thread->status = thread->func(thread->arg);
+    return 0;
+}
+
+static native_thread *native_thread_create(native_thread_func func, void *arg)
+{
+    native_thread *thread = (native_thread *)malloc(sizeof(native_thread));
+    if (!thread)
+        return NULL;
+    thread->func = func;
+    thread->arg = arg;
+    thread->status = 0;
+    thread->handle = (HANDLE)_beginthreadex(NULL, 0, native_thread_start, thread, 0, NULL);
+    if (!thread->handle) {
+        free(thread);
+        return NULL;
+    }
+    return thread;
+}
+
+static int native_thread_wait(native_thread *thread, int *status)
+{
+    WaitForSingleObject(thread->handle, INFINITE);
+    CloseHandle(thread->handle);
+    if (status)
+        *status = thread->status;
+    free(thread);
+    return 0;
+}
+
+#else
+
+#include <pthread.h>
+#include <time.h>
+#include <errno.h>
+
+typedef struct native_mutex {
+    pthread_mutex_t mutex;
+} native_mutex;
+
+typedef struct native_cond {
+    pthread_cond_t cond;
+} native_cond;
+
+typedef struct native_thread {
+    pthread_t thread;
+    native_thread_func func;
+    void *arg;
+    int status;
+} native_thread;
+
+static native_mutex *native_mutex_create(void)
+{
+    native_mutex *mutex = (native_mutex *)malloc(sizeof(native_mutex));
+    if (mutex && pthread_mutex_init(&mutex->mutex, NULL)) {
+        free(mutex);
+        return NULL;
+    }
+    return mutex;
+}
+
+static void native_mutex_destroy(native_mutex *mutex)
+{
+    pthread_mutex_destroy(&mutex->mutex);
+    free(mutex);
+}
+
+static int native_mutex_lock(native_mutex *mutex)
+{
+    return pthread_mutex_lock(&mutex->mutex) ? -1 : 0;
+}
+
+static int native_mutex_unlock(native_mutex *mutex)
+{
+    return pthread_mutex_unlock(&mutex->mutex) ? -1 : 0;
+}
+
+static native_cond *native_cond_create(void)
+{
+    pthread_condattr_t attr;
+    native_cond *cond = (native_cond *)malloc(sizeof(native_cond));
+    if (!cond)
+        return NULL;
+
+    if (pthread_condattr_init(&attr)) {
+        free(cond);
+        return NULL;
+    }
+#ifndef __APPLE__
+    /* macOS has no pthread_condattr_setclock, but waits with a relative timeout */
+    pthread_condattr_setclock(&attr, CLOCK_MONOTONIC);
+#endif
+    if (pthread_cond_init(&cond->cond, &attr)) {
+        pthread_condattr_destroy(&attr);
+        free(cond);
+        return NULL;
+    }
+    pthread_condattr_destroy(&attr);
+    return cond;
+}
+
+static void native_cond_destroy(native_cond *cond)
+{
+    pthread_cond_destroy(&cond->cond);
+    free(cond);
+}
+
+static int native_cond_signal(native_cond *cond)
+{
+    return pthread_cond_signal(&cond->cond) ? -1 : 0;
+}
+
+static int native_cond_broadcast(native_cond *cond)
+{
+    return pthread_cond_broadcast(&cond->cond) ? -1 : 0;
+}
+
+static int native_cond_wait(native_cond *cond, native_mutex *mutex)
+{
+    return pthread_cond_wait(&cond->cond, &mutex->mutex) ? -1 : 0;
+}
+
+static int native_cond_wait_timeout(native_cond *cond, native_mutex *mutex, uint32_t ms)
+{
+    struct timespec ts;
+    int ret;
+
+#ifdef __APPLE__
+    ts.tv_sec = ms / 1000;
+    ts.tv_nsec = (long)(ms % 1000) * 1000000;
+    ret = pthread_cond_timedwait_relative_np(&cond->cond, &mutex->mutex, &ts);
+#else
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    ts.tv_sec += ms / 1000;
+    ts.tv_nsec += (long)(ms % 1000) * 1000000;
+    if (ts.tv_nsec >= 1000000000) {
+        ts.tv_sec += 1;
+        ts.tv_nsec -= 1000000000;
+    }
+    ret = pthread_cond_timedwait(&cond->cond, &mutex->mutex, &ts);
+#endif
+    if (ret == ETIMEDOUT)
+        return NATIVE_MUTEX_TIMEDOUT;
+    return ret ? -1 : 0;
+}
+
+static void *native_thread_start(void *data)
+{
+    native_thread *thread = (native_thread *)data;
+    thread->status = thread->func(thread->arg);
+    return NULL;
+}
+
+static native_thread *native_thread_create(native_thread_func func, void *arg)
+{
+    native_thread *thread = (native_thread *)malloc(sizeof(native_thread));
+    if (!thread)
+        return NULL;
+    thread->func = func;
+    thread->arg = arg;
+    thread->status = 0;
+    if (pthread_create(&thread->thread, NULL, native_thread_start, thread)) {
+        free(thread);
+        return NULL;
+    }
+    return thread;
+}
+
+static int native_thread_wait(native_thread *thread, int *status)
+{
+    int ret = pthread_join(thread->thread, NULL) ? -1 : 0;
+    if (status)
+        *status = thread->status;
+    free(thread);
+    return ret;
+}
+
+#endif
+
+#endif
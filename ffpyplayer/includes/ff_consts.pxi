@@ -11,6 +11,10 @@ DEF MAX_QUEUE_SIZE = (15 * 1024 * 1024)
 DEF MIN_FRAMES = 25
 DEF EXTERNAL_CLOCK_MIN_FRAMES = 2
 DEF EXTERNAL_CLOCK_MAX_FRAMES = 10
+' The read thread is woken when needed, this only bounds how long it sleeps, in ms. '
+DEF READ_THREAD_TIMEOUT = 500
+' How long the read thread sleeps between polls of a demuxer that has no packet yet, in ms. '
+DEF READ_THREAD_POLL = 10
 
 'no AV sync correction is done if below the minimum AV sync threshold '
 DEF AV_SYNC_THRESHOLD_MIN = 0.04
@@ -42,7 +46,12 @@ DEF SAMPLE_ARRAY_SIZE = (8 * 65536)
 DEF VIDEO_PICTURE_QUEUE_SIZE = 3
 DEF SUBPICTURE_QUEUE_SIZE = 16
 DEF SAMPLE_QUEUE_SIZE = 9
-DEF FRAME_QUEUE_SIZE = max(SAMPLE_QUEUE_SIZE, max(VIDEO_PICTURE_QUEUE_SIZE, SUBPICTURE_QUEUE_SIZE))
+'the largest frame queue depth that may be requested with the video/audio_queue_size options'
+DEF FRAME_QUEUE_SIZE = 64
+'the largest number of additional named video outputs that may be requested'
+DEF MAX_OUTPUTS = 8
+'the number of packets in each segment of the packet queue ring'
+DEF PACKET_SEGMENT_SIZE = 64
 
 
 DEF FF_LOCK_CREATE = 0
@@ -35,7 +35,8 @@ cdef:
             AVMEDIA_TYPE_ATTACHMENT,    #///< Opaque data information usually sparse
             AVMEDIA_TYPE_NB,
         struct AVBufferRef:
-            pass
+            uint8_t *data
+            size_t size
         int av_compare_ts(int64_t, AVRational, int64_t, AVRational)
         const char* av_get_media_type_string(AVMediaType)
         const int av_log2(unsigned int)
@@ -46,15 +47,41 @@ cdef:
         int avio_open2(AVIOContext **, const char *, int, const AVIOInterruptCB *,
                        AVDictionary **)
         int avio_close(AVIOContext *)
+        int AVSEEK_SIZE
+        int AVSEEK_FORCE
         struct AVIOContext:
+            unsigned char *buffer
             int error
             int eof_reached
+            int seekable
+            int min_packet_size
+        AVIOContext *avio_alloc_context(
+            unsigned char *, int, int, void *,
+            int (*)(void *, uint8_t *, int) noexcept,
+            int (*)(void *, uint8_t *, int) noexcept,
+            int64_t (*)(void *, int64_t, int) noexcept)
+        void avio_context_free(AVIOContext **)
+        void avio_flush(AVIOContext *)
         struct AVIOInterruptCB:
             int (*callback)(void*)
             void *opaque
         int avio_feof(AVIOContext *)
         int64_t avio_tell(AVIOContext *)
 
+    extern from "libavutil/buffer.h" nogil:
+        struct AVBufferPool:
+            pass
+        AVBufferRef *av_buffer_alloc(size_t)
+        AVBufferRef *av_buffer_create(
+            uint8_t *, size_t, void (*)(void *, uint8_t *) noexcept nogil, void *, int)
+        AVBufferRef *av_buffer_ref(const AVBufferRef *)
+        void av_buffer_unref(AVBufferRef **)
+        AVBufferPool *av_buffer_pool_init2(
+            size_t, void *, AVBufferRef* (*)(void *, size_t) noexcept nogil,
+            void (*)(void *) noexcept nogil)
+        void av_buffer_pool_uninit(AVBufferPool **)
+        AVBufferRef *av_buffer_pool_get(AVBufferPool *)
+
     extern from "libavutil/fifo.h" nogil:
         struct AVFifoBuffer:
             uint8_t *buffer
@@ -81,9 +108,24 @@ cdef:
         int64_t av_rescale_q(int64_t, AVRational, AVRational)
 
     extern from "libavutil/pixdesc.h" nogil:
+        int AV_PIX_FMT_FLAG_BE
+        int AV_PIX_FMT_FLAG_PAL
+        int AV_PIX_FMT_FLAG_BITSTREAM
+        int AV_PIX_FMT_FLAG_HWACCEL
+        int AV_PIX_FMT_FLAG_FLOAT
+        struct AVComponentDescriptor:
+            int plane
+            int step
+            int offset
+            int shift
+            int depth
         struct AVPixFmtDescriptor:
             const char *name
             uint8_t nb_components
+            uint8_t log2_chroma_w
+            uint8_t log2_chroma_h
+            uint64_t flags
+            AVComponentDescriptor comp[4]
         const char *av_get_pix_fmt_name(AVPixelFormat)
         AVPixelFormat av_get_pix_fmt(const char *)
         const AVPixFmtDescriptor *av_pix_fmt_desc_next(const AVPixFmtDescriptor *)
@@ -99,6 +141,9 @@ cdef:
                                    const int *linesizes)
         int av_image_fill_arrays(uint8_t **, int *, const uint8_t *,
                                  AVPixelFormat, int, int, int)
+        int av_image_get_buffer_size(AVPixelFormat, int, int, int)
+        int av_image_copy_to_buffer(uint8_t *, int, const uint8_t * const *,
+                                    const int *, AVPixelFormat, int, int, int)
 
     extern from "libavutil/dict.h" nogil:
         int AV_DICT_MATCH_CASE
@@ -109,6 +154,7 @@ cdef:
             char *key
             char *value
         void av_dict_free(AVDictionary **)
+        int av_dict_copy(AVDictionary **, const AVDictionary *, int)
         AVDictionaryEntry * av_dict_get(AVDictionary *, const char *,
                                         const AVDictionaryEntry *, int)
 
@@ -129,6 +175,7 @@ cdef:
         int av_get_cpu_flags()
         int av_parse_cpu_caps(unsigned *, const char *)
         void av_force_cpu_flags(int)
+        int av_cpu_count()
 
     extern from * nogil:
         void av_free(void *)
@@ -187,12 +234,14 @@ cdef:
         enum AVPictureType:
             AV_PICTURE_TYPE_NONE
         char av_get_picture_type_char(AVPictureType)
+        int av_frame_ref(AVFrame *, const AVFrame *)
         void av_frame_unref(AVFrame *)
         void av_frame_free(AVFrame **)
         void av_frame_move_ref(AVFrame *, AVFrame *)
         AVFrame* av_frame_clone(const AVFrame *)
         int av_frame_copy_props(AVFrame *, const AVFrame *)
         int av_frame_get_buffer(AVFrame *, int)
+        int av_frame_is_writable(AVFrame *)
         unsigned av_int_list_length_for_size(unsigned, const void *, uint64_t)
         int av_opt_set_bin(void *, const char *, const uint8_t *, int, int)
 
@@ -209,15 +258,39 @@ cdef:
         int64_t AV_TIME_BASE
         AVRational AV_TIME_BASE_Q
 
+        enum AVClassCategory:
+            AV_CLASS_CATEGORY_NA,
+            AV_CLASS_CATEGORY_INPUT,
+            AV_CLASS_CATEGORY_OUTPUT,
+            AV_CLASS_CATEGORY_MUXER,
+            AV_CLASS_CATEGORY_DEMUXER,
+            AV_CLASS_CATEGORY_ENCODER,
+            AV_CLASS_CATEGORY_DECODER,
+            AV_CLASS_CATEGORY_FILTER,
+            AV_CLASS_CATEGORY_BITSTREAM_FILTER,
+            AV_CLASS_CATEGORY_SWSCALER,
+            AV_CLASS_CATEGORY_SWRESAMPLER,
+            AV_CLASS_CATEGORY_DEVICE_VIDEO_OUTPUT,
+            AV_CLASS_CATEGORY_DEVICE_VIDEO_INPUT,
+            AV_CLASS_CATEGORY_DEVICE_AUDIO_OUTPUT,
+            AV_CLASS_CATEGORY_DEVICE_AUDIO_INPUT,
+            AV_CLASS_CATEGORY_DEVICE_OUTPUT,
+            AV_CLASS_CATEGORY_DEVICE_INPUT,
+            AV_CLASS_CATEGORY_NB
+
         struct AVClass:
-            pass
+            const char *class_name
+            AVClassCategory category
+            AVClassCategory (*get_category)(void *ctx) noexcept nogil
 
     extern from "libavformat/avformat.h" nogil:
         int AVSEEK_FLAG_BYTE
+        int AVSEEK_FLAG_BACKWARD
         int AVFMT_NOBINSEARCH
         int AVFMT_NOGENSEARCH
         int AVFMT_NO_BYTE_SEEK
         int AVFMT_FLAG_GENPTS
+        int AVFMT_FLAG_CUSTOM_IO
         int AVFMT_TS_DISCONT
         int AV_DISPOSITION_ATTACHED_PIC
         int AVFMT_GLOBALHEADER
@@ -295,6 +368,7 @@ cdef:
         void avformat_close_input(AVFormatContext **)
         int avformat_find_stream_info(AVFormatContext *, AVDictionary **)
         int avformat_seek_file(AVFormatContext *, int, int64_t, int64_t, int64_t, int)
+        int av_seek_frame(AVFormatContext *, int, int64_t, int)
         int av_find_best_stream(AVFormatContext *, AVMediaType, int, int, AVCodec **, int)
         void av_dump_format(AVFormatContext *, int, const char *, int)
         int av_read_pause(AVFormatContext *)
@@ -339,6 +413,9 @@ cdef:
         int sws_scale(SwsContext *, const uint8_t *const [], const int[], int, int,
                       uint8_t *const [], const int[])
         void sws_freeContext(SwsContext *)
+        SwsContext *sws_alloc_context()
+        int sws_init_context(SwsContext *, SwsFilter *, SwsFilter *)
+        int sws_scale_frame(SwsContext *, AVFrame *, const AVFrame *)
 
     extern from "libavutil/frame.h" nogil:
         enum AVFrameSideDataType:
@@ -370,6 +447,7 @@ cdef:
         void av_packet_move_ref(AVPacket *, AVPacket *)
         AVPacket *av_packet_alloc()
         void av_packet_free(AVPacket **)
+        void av_packet_rescale_ts(AVPacket *, AVRational, AVRational)
 
     extern from "libavcodec/avfft.h" nogil:
         enum RDFTransformType:
@@ -401,6 +479,8 @@ cdef:
         int AV_CODEC_CAP_DR1
         int AV_CODEC_FLAG_GLOBAL_HEADER
         int AV_PKT_FLAG_KEY
+        int AV_PKT_FLAG_DISCARD
+        int AV_PKT_FLAG_DISPOSABLE
         int AV_CODEC_CAP_DELAY
         struct AVCodec:
             const char *name
@@ -423,6 +503,8 @@ cdef:
             AVMediaType codec_type
             int workaround_bugs
             int lowres
+            AVDiscard skip_frame
+            AVDiscard skip_loop_filter
             int error_concealment
             int flags
             int flags2
@@ -436,6 +518,7 @@ cdef:
         struct AVCodecParameters:
             AVCodecID codec_id
             AVMediaType codec_type
+            uint32_t codec_tag
             AVRational sample_aspect_ratio
             int sample_rate
             int channels
@@ -490,6 +573,7 @@ cdef:
         int av_codec_get_max_lowres(const AVCodec *)
         void av_codec_set_lowres(AVCodecContext *, int)
         int avcodec_parameters_from_context(AVCodecParameters *, const AVCodecContext *)
+        int avcodec_parameters_copy(AVCodecParameters *, const AVCodecParameters *)
         int av_dup_packet(AVPacket *)
         void av_packet_unref(AVPacket *)
         void avsubtitle_free(AVSubtitle *)
@@ -521,6 +605,8 @@ cdef:
         int avcodec_open2(AVCodecContext *, const AVCodec *, AVDictionary **)
         enum AVDiscard:
             AVDISCARD_DEFAULT,
+            AVDISCARD_NONREF,
+            AVDISCARD_NONKEY,
             AVDISCARD_ALL
         int av_copy_packet(AVPacket *, AVPacket *)
         struct AVCodecDescriptor:
@@ -598,6 +684,8 @@ cdef:
             const char *, const char *, SwsContext *, AVDictionary **, AVDictionary **,
             AVDictionary **, AVDictionary **, AVDictionary **)
         int get_plane_sizes(int *, int *, AVPixelFormat, int, const int *)
+        int notify_fd(int)
+        int64_t atomic_fetch_inc64(int64_t *)
 
 cdef enum:
     AV_SYNC_AUDIO_MASTER, # default choice
@@ -22,6 +22,7 @@ cdef extern from "SDL.h" nogil:
     SDL_cond *SDL_CreateCond()
     void SDL_DestroyCond(SDL_cond *)
     int SDL_CondSignal(SDL_cond *)
+    int SDL_CondBroadcast(SDL_cond *)
     int SDL_CondWait(SDL_cond *, SDL_mutex *)
 
     void SDL_Quit()
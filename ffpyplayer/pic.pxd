@@ -1,8 +1,37 @@
 include 'includes/ffmpeg.pxi'
 
+from ffpyplayer.avio cimport AVIOSource
+
+
+cdef int frame_pool_get_buffer(AVFrame *frame, int align) noexcept nogil
+cdef SwsContext *get_sws_context(
+    SwsContext *ctx, int iw, int ih, AVPixelFormat ifmt, int ow, int oh,
+    AVPixelFormat ofmt, int flags, int threads) noexcept nogil
+cdef int scale_frame(SwsContext *sws_ctx, const AVFrame *src, AVFrame *dst, int threads,
+                     int flip) noexcept nogil
+
+cdef struct Decimator:
+    int every_nth  # keep only every nth frame, if larger than 1
+    double period  # keep at most one frame per period seconds, if positive
+    int64_t count  # the number of frames seen since the reset
+    double next_pts  # the earliest pts of the next kept frame, or NaN
+
+cdef void decimator_init(Decimator *d, int every_nth, double target_fps) noexcept nogil
+cdef void decimator_reset(Decimator *d) noexcept nogil
+cdef int decimator_keep(Decimator *d, double pts) noexcept nogil
+
+
+cdef class _ScalerContext(object):
+    cdef SwsContext *sws_ctx
+    cdef tuple key
+    cdef size_t size
+    cdef int threads
+
 
 cdef class SWScale(object):
+    cdef _ScalerContext scaler
     cdef SwsContext *sws_ctx
+    cdef int threads
     cdef bytes dst_pix_fmt
     cdef str dst_pix_fmt_s
     cdef int dst_h
@@ -28,6 +57,22 @@ cdef class Image(object):
     cpdef get_required_buffers(Image self)
     cpdef to_bytearray(Image self, keep_align=*)
     cpdef to_memoryview(Image self, keep_align=*)
+    cpdef planes(Image self)
+    cpdef convert(Image self, pix_fmt=*, size=*, Image out=*)
+
+
+cdef class ImagePlane(object):
+    cdef Image image
+    cdef uint8_t *data
+    cdef int ndim
+    cdef int writable
+    cdef Py_ssize_t itemsize
+    cdef Py_ssize_t shape[3]
+    cdef Py_ssize_t strides[3]
+    cdef bytes format
+
+    cdef int init(ImagePlane self, Image image, int plane, const AVPixFmtDescriptor *desc,
+                  int line_bytes, int writable) except 1
 
 
 cdef class ImageLoader(object):
@@ -37,8 +82,31 @@ cdef class ImageLoader(object):
     cdef AVPacket pkt
     cdef AVFrame *frame
     cdef bytes filename
+    cdef AVIOSource source
     cdef char msg[256]
     cdef int eof
+    cdef int keyframes_only
+    cdef Decimator decimator
 
     cpdef next_frame(self)
     cdef inline object eof_frame(self)
+
+
+cdef class FrameReader(object):
+    cdef AVFormatContext *format_ctx
+    cdef AVCodecContext *codec_ctx
+    cdef AVPacket *pkt
+    cdef AVFrame *frame
+    cdef int stream_index
+    cdef AVRational time_base
+    cdef bytes filename
+    cdef object index_filename
+    cdef list frame_pts
+    cdef list keyframe_pts
+    cdef int64_t last_pts
+    cdef Image last_image
+    cdef char msg[256]
+
+    cdef int decode_frame(self) nogil
+    cdef int seek_keyframe(self, int64_t ts) nogil
+    cdef object read_frame_at(self, int64_t target)
@@ -52,22 +52,46 @@ Copy the image:
     >>> img2 = copy.deepcopy(img)
 '''
 
-__all__ = ('Image', 'SWScale', 'get_image_size', 'ImageLoader')
+__all__ = ('Image', 'ImagePlane', 'SWScale', 'get_image_size', 'ImageLoader',
+           'FrameReader', 'set_frame_pool_size', 'get_frame_pool_stats',
+           'clear_frame_pools', 'set_sws_cache_size', 'get_sws_cache_stats',
+           'clear_sws_cache')
 
 include "includes/inline_funcs.pxi"
 
 from cpython.ref cimport PyObject
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_WRITABLE, \
+    PyBUF_C_CONTIGUOUS, PyBUF_FORMAT, PyBUF_ND, PyBUF_STRIDES
 from cython cimport view as cyview
+from ffpyplayer.threading cimport MTThread, MTMutex, Native_MT
+from ffpyplayer.avio cimport is_avio_source, get_avio_source
 
 cdef extern from "string.h" nogil:
     void *memset(void *, int, size_t)
     void *memcpy(void *, const void *, size_t)
 
+cdef extern from "math.h" nogil:
+    double NAN
+    int isnan(double x)
+
 cdef extern from "Python.h":
     PyObject* PyString_FromStringAndSize(const char *, Py_ssize_t)
     void Py_DECREF(PyObject *)
 
+cdef extern from "limits.h" nogil:
+    int64_t INT64_MIN
+
+cdef extern from "errno.h" nogil:
+    int EAGAIN
+    int ENOMEM
+
 import ffpyplayer.tools  # for initialization purposes
+import os
+import json
+from bisect import bisect_right
+from collections import OrderedDict
+
+cdef int AV_EAGAIN = EAGAIN if EAGAIN < 0 else -EAGAIN
 
 def get_image_size(pix_fmt, width, height):
     '''Returns the size in bytes of the buffers of each plane of an image with a
@@ -125,12 +149,696 @@ def get_image_size(pix_fmt, width, height):
     return (size[0], size[1], size[2], size[3])
 
 
+cdef struct FramePoolKey:
+    int pix_fmt
+    int width
+    int height
+    int align
+
+
+cdef struct FramePool:
+    # A AVBufferPool of image buffers of a single size, in a list of the pools
+    FramePoolKey key
+    AVBufferPool *pool
+    size_t size
+    int64_t requests
+    int64_t allocations
+    size_t allocated
+    FramePool *prev
+    FramePool *next
+
+
+# the pools, from least to most recently used. The pools and all the counters
+# are protected by _frame_pool_mutex, so buffers can be taken without the GIL
+cdef FramePool *_frame_pools_first = NULL
+cdef FramePool *_frame_pools_last = NULL
+cdef MTMutex _frame_pool_mutex = MTMutex(Native_MT)
+cdef size_t _frame_pool_max_bytes = 256 * 1024 * 1024
+cdef size_t _frame_pool_bytes = 0
+cdef int64_t _frame_pool_requests = 0
+cdef int64_t _frame_pool_allocations = 0
+cdef int64_t _frame_pool_unpooled = 0
+
+
+cdef void _unlink_frame_pool(FramePool *pool) noexcept nogil:
+    global _frame_pools_first, _frame_pools_last
+    if pool.prev != NULL:
+        pool.prev.next = pool.next
+    else:
+        _frame_pools_first = pool.next
+    if pool.next != NULL:
+        pool.next.prev = pool.prev
+    else:
+        _frame_pools_last = pool.prev
+    pool.prev = pool.next = NULL
+
+
+cdef void _append_frame_pool(FramePool *pool) noexcept nogil:
+    global _frame_pools_first, _frame_pools_last
+    pool.prev = _frame_pools_last
+    pool.next = NULL
+    if _frame_pools_last != NULL:
+        _frame_pools_last.next = pool
+    else:
+        _frame_pools_first = pool
+    _frame_pools_last = pool
+
+
+cdef void _free_frame_pool(FramePool *pool) noexcept nogil:
+    '''Unlinks and frees the pool. Buffers of the pool that are in use are
+    freed when released. Must be called with _frame_pool_mutex locked.
+    '''
+    global _frame_pool_bytes
+    _unlink_frame_pool(pool)
+    _frame_pool_bytes -= pool.allocated
+    av_buffer_pool_uninit(&pool.pool)
+    av_free(pool)
+
+
+cdef void _evict_frame_pools(size_t required, FramePool *keep) noexcept nogil:
+    '''Removes least recently used pools until ``required`` more bytes fit in
+    the budget. Must be called with _frame_pool_mutex locked.
+    '''
+    cdef FramePool *pool = _frame_pools_first
+    cdef FramePool *next_pool
+    while pool != NULL and _frame_pool_bytes + required > _frame_pool_max_bytes:
+        next_pool = pool.next
+        if pool != keep:
+            _free_frame_pool(pool)
+        pool = next_pool
+
+
+cdef AVBufferRef *_frame_pool_alloc(void *opaque, size_t size) noexcept nogil:
+    # called by av_buffer_pool_get, so _frame_pool_mutex is locked
+    global _frame_pool_bytes, _frame_pool_allocations
+    cdef FramePool *pool = <FramePool *>opaque
+    cdef AVBufferRef *buf
+
+    if _frame_pool_bytes + size > _frame_pool_max_bytes:
+        _evict_frame_pools(size, pool)
+        if _frame_pool_bytes + size > _frame_pool_max_bytes:
+            return NULL
+
+    buf = av_buffer_alloc(size)
+    if buf != NULL:
+        pool.allocations += 1
+        pool.allocated += size
+        _frame_pool_allocations += 1
+        _frame_pool_bytes += size
+    return buf
+
+
+cdef AVBufferRef *_frame_pool_get(FramePoolKey *key, size_t size) noexcept nogil:
+    '''Returns a buffer from the pool of the key, or NULL if pooling is disabled
+    or it doesn't fit in the budget. Must be called with _frame_pool_mutex locked.
+    '''
+    global _frame_pool_requests
+    cdef FramePool *pool = _frame_pools_first
+    cdef AVBufferRef *buf
+
+    if not _frame_pool_max_bytes:
+        return NULL
+
+    while pool != NULL:
+        if (pool.key.pix_fmt == key.pix_fmt and pool.key.width == key.width and
+                pool.key.height == key.height and pool.key.align == key.align):
+            break
+        pool = pool.next
+
+    if pool == NULL:
+        pool = <FramePool *>av_mallocz(sizeof(FramePool))
+        if pool == NULL:
+            return NULL
+        pool.key = key[0]
+        pool.size = size
+        pool.pool = av_buffer_pool_init2(size, pool, &_frame_pool_alloc, NULL)
+        if pool.pool == NULL:
+            av_free(pool)
+            return NULL
+    else:
+        _unlink_frame_pool(pool)
+    _append_frame_pool(pool)
+
+    pool.requests += 1
+    _frame_pool_requests += 1
+    buf = av_buffer_pool_get(pool.pool)
+    # don't keep a pool that never got a buffer within the budget
+    if buf == NULL and not pool.allocated:
+        _free_frame_pool(pool)
+    return buf
+
+
+cdef int frame_pool_get_buffer(AVFrame *frame, int align) noexcept nogil:
+    '''Like ``av_frame_get_buffer`` for video frames, but takes the buffer from
+    the pool of buffers of the frame's format, size and alignment, to which it
+    is returned when all its references are released. Falls back to
+    ``av_frame_get_buffer`` if the pool budget is exhausted or pooling is
+    disabled.
+    '''
+    global _frame_pool_unpooled
+    cdef AVBufferRef *buf
+    cdef FramePoolKey key
+    cdef AVPixelFormat fmt = <AVPixelFormat>frame.format
+    cdef int ret
+    cdef int size = av_image_get_buffer_size(fmt, frame.width, frame.height, align)
+    if size < 0:
+        return size
+
+    key.pix_fmt = <int>fmt
+    key.width = frame.width
+    key.height = frame.height
+    key.align = align
+
+    _frame_pool_mutex.lock()
+    buf = _frame_pool_get(&key, size)
+    if buf == NULL:
+        _frame_pool_unpooled += 1
+    _frame_pool_mutex.unlock()
+    if buf == NULL:
+        return av_frame_get_buffer(frame, align)
+
+    ret = av_image_fill_arrays(
+        frame.data, frame.linesize, buf.data, fmt, frame.width, frame.height, align)
+    if ret < 0:
+        av_buffer_unref(&buf)
+        return ret
+    frame.buf[0] = buf
+    frame.extended_data = frame.data
+    return 0
+
+
+def set_frame_pool_size(size_t max_bytes):
+    '''Sets the maximum number of bytes that may be allocated for all the
+    image buffer pools.
+
+    The buffers of images created by :class:`Image`, the converted frames of the
+    player (when not using filters), and the converted frames of the
+    :class:`~ffpyplayer.writer.MediaWriter` are taken from pools of buffers keyed
+    by pixel format, size, and alignment. Buffers are returned to their pool when
+    the last :class:`Image` or frame referencing them is released, so images of
+    the same format and size can be created repeatedly without allocations.
+
+    When a new buffer would exceed ``max_bytes``, the least recently used pools
+    are removed, and if it still doesn't fit, the buffer is allocated without a
+    pool. Defaults to 256 MiB.
+
+    :Parameters:
+
+        `max_bytes`: int
+            The maximum number of bytes. If zero, pooling is disabled and the
+            existing pools are removed.
+    '''
+    global _frame_pool_max_bytes
+    with nogil:
+        _frame_pool_mutex.lock()
+        _frame_pool_max_bytes = max_bytes
+        _evict_frame_pools(0, NULL)
+        _frame_pool_mutex.unlock()
+
+
+def clear_frame_pools():
+    '''Removes all the image buffer pools, freeing their unused buffers. Buffers
+    still in use are freed when released. See :func:`set_frame_pool_size`.
+    '''
+    with nogil:
+        _frame_pool_mutex.lock()
+        while _frame_pools_first != NULL:
+            _free_frame_pool(_frame_pools_first)
+        _frame_pool_mutex.unlock()
+
+
+def get_frame_pool_stats():
+    '''Returns statistics about the image buffer pools, see
+    :func:`set_frame_pool_size`.
+
+    :returns:
+
+        dict: with the keys ``max_bytes``, the maximum size of the pools;
+        ``allocated_bytes``, the bytes currently allocated by the pools (including
+        buffers in use); ``requests``, the number of buffers requested from the pools;
+        ``allocations``, how many of those requests had to allocate a new buffer;
+        ``unpooled``, how many buffers were allocated without a pool because the
+        budget was exhausted; and ``pools``, a list of dicts with the
+        ``pix_fmt``, ``size``, ``align``, ``buffer_size``, ``allocated_bytes``,
+        ``requests``, and ``allocations`` of each pool.
+    '''
+    cdef FramePool *pool
+    cdef list pools = []
+    cdef dict stats
+
+    # safe with the GIL, because the mutex is never held while taking the GIL
+    _frame_pool_mutex.lock()
+    pool = _frame_pools_first
+    while pool != NULL:
+        pools.append({
+            'pix_fmt': tcode(av_get_pix_fmt_name(<AVPixelFormat>pool.key.pix_fmt)),
+            'size': (pool.key.width, pool.key.height), 'align': pool.key.align,
+            'buffer_size': pool.size, 'allocated_bytes': pool.allocated,
+            'requests': pool.requests, 'allocations': pool.allocations})
+        pool = pool.next
+
+    stats = {
+        'max_bytes': _frame_pool_max_bytes, 'allocated_bytes': _frame_pool_bytes,
+        'requests': _frame_pool_requests, 'allocations': _frame_pool_allocations,
+        'unpooled': _frame_pool_unpooled, 'pools': pools}
+    _frame_pool_mutex.unlock()
+    return stats
+
+
+cdef inline int _sws_opt_differs(SwsContext *ctx, const char *name, int64_t value) noexcept nogil:
+    cdef int64_t current
+    return av_opt_get_int(ctx, name, 0, &current) < 0 or current != value
+
+
+cdef SwsContext *get_sws_context(
+        SwsContext *ctx, int iw, int ih, AVPixelFormat ifmt, int ow, int oh,
+        AVPixelFormat ofmt, int flags, int threads) noexcept nogil:
+    '''Like ``sws_getCachedContext``, except that it also sets the number of threads
+    used by :func:`scale_frame` to scale slices of the output in parallel. ``threads``
+    of zero lets swscale pick the number of threads. Returns NULL on failure.
+    '''
+    if threads == 1:
+        return sws_getCachedContext(ctx, iw, ih, ifmt, ow, oh, ofmt, flags, NULL, NULL, NULL)
+
+    if ctx != NULL:
+        if (_sws_opt_differs(ctx, b"srcw", iw) or _sws_opt_differs(ctx, b"srch", ih) or
+            _sws_opt_differs(ctx, b"src_format", ifmt) or
+            _sws_opt_differs(ctx, b"dstw", ow) or _sws_opt_differs(ctx, b"dsth", oh) or
+            _sws_opt_differs(ctx, b"dst_format", ofmt) or
+            _sws_opt_differs(ctx, b"sws_flags", flags) or
+            _sws_opt_differs(ctx, b"threads", threads)):
+            sws_freeContext(ctx)
+        else:
+            return ctx
+
+    ctx = sws_alloc_context()
+    if ctx == NULL:
+        return NULL
+    if (av_opt_set_int(ctx, b"srcw", iw, 0) < 0 or av_opt_set_int(ctx, b"srch", ih, 0) < 0 or
+        av_opt_set_int(ctx, b"src_format", ifmt, 0) < 0 or
+        av_opt_set_int(ctx, b"dstw", ow, 0) < 0 or av_opt_set_int(ctx, b"dsth", oh, 0) < 0 or
+        av_opt_set_int(ctx, b"dst_format", ofmt, 0) < 0 or
+        av_opt_set_int(ctx, b"sws_flags", flags, 0) < 0 or
+        av_opt_set_int(ctx, b"threads", threads, 0) < 0 or
+        sws_init_context(ctx, NULL, NULL) < 0):
+        sws_freeContext(ctx)
+        return NULL
+    return ctx
+
+
+cdef void _unowned_buffer_free(void *opaque, uint8_t *data) noexcept nogil:
+    pass
+
+
+cdef int _ref_frame_data(AVFrame *dst, const AVFrame *src, int flip) noexcept nogil:
+    '''Makes ``dst`` reference the image of ``src``, without copying it even when
+    ``src`` is not reference counted, optionally flipped vertically.
+    '''
+    cdef int i
+    dst.format = src.format
+    dst.width = src.width
+    dst.height = src.height
+    for i in range(4):
+        dst.data[i] = src.data[i]
+        dst.linesize[i] = src.linesize[i]
+        if flip:
+            dst.data[i] += dst.linesize[i] * (src.height - 1)
+            dst.linesize[i] = -dst.linesize[i]
+    dst.extended_data = dst.data
+
+    if src.buf[0] != NULL:
+        dst.buf[0] = av_buffer_ref(src.buf[0])
+    else:
+        # swscale references the frames, which would otherwise copy them
+        dst.buf[0] = av_buffer_create(src.data[0], 1, &_unowned_buffer_free, NULL, 0)
+    if dst.buf[0] == NULL:
+        return AVERROR(ENOMEM)
+    return 0
+
+
+cdef int scale_frame(SwsContext *sws_ctx, const AVFrame *src, AVFrame *dst, int threads,
+                     int flip) noexcept nogil:
+    '''Scales ``src`` into ``dst``, which must already have its buffers. ``threads``
+    is the value ``sws_ctx`` was created with in :func:`get_sws_context`. When it's
+    not 1, horizontal slices of the output are scaled in parallel on the swscale
+    thread pool. Flipping only works for formats whose planes have the same height.
+
+    Returns a negative error code on failure.
+    '''
+    cdef const uint8_t *data[4]
+    cdef int linesize[4]
+    cdef AVFrame *src_ref
+    cdef AVFrame *dst_ref
+    cdef int i, ret
+
+    if threads == 1:
+        for i in range(4):
+            data[i] = src.data[i]
+            linesize[i] = src.linesize[i]
+            if flip:
+                data[i] += linesize[i] * (src.height - 1)
+                linesize[i] = -linesize[i]
+        return sws_scale(sws_ctx, data, linesize, 0, src.height, dst.data, dst.linesize)
+
+    src_ref = av_frame_alloc()
+    dst_ref = av_frame_alloc()
+    if src_ref == NULL or dst_ref == NULL:
+        ret = AVERROR(ENOMEM)
+    else:
+        ret = _ref_frame_data(src_ref, src, flip)
+        if ret >= 0:
+            ret = _ref_frame_data(dst_ref, dst, 0)
+        if ret >= 0:
+            ret = sws_scale_frame(sws_ctx, dst_ref, src_ref)
+    av_frame_free(&src_ref)
+    av_frame_free(&dst_ref)
+    return ret
+
+
+cdef void decimator_init(Decimator *d, int every_nth, double target_fps) noexcept nogil:
+    '''Sets up ``d`` to keep every ``every_nth`` frame and at most ``target_fps``
+    frames per second. Either is ignored if it's not larger than 1 and 0,
+    respectively.
+    '''
+    d.every_nth = every_nth
+    d.period = 1. / target_fps if target_fps > 0 else 0.
+    decimator_reset(d)
+
+
+cdef void decimator_reset(Decimator *d) noexcept nogil:
+    '''Restarts the decimation, e.g. after a seek.
+    '''
+    d.count = 0
+    d.next_pts = NAN
+
+
+cdef int decimator_keep(Decimator *d, double pts) noexcept nogil:
+    '''Returns whether the next frame, whose pts is ``pts`` seconds (or NaN if
+    unknown), should be kept. It must be called once for each decoded frame, in
+    order.
+
+    With a target fps, a frame is kept if it's at least a period after the
+    last kept frame, so the kept frames are never closer than the period even if
+    the source frame rate varies. Frames without a pts are never dropped by it.
+    '''
+    d.count += 1
+    if d.every_nth > 1 and (d.count - 1) % d.every_nth:
+        return 0
+
+    if d.period <= 0 or isnan(pts):
+        return 1
+    # allow for rounding of the pts in the stream's time base
+    if not isnan(d.next_pts) and pts + 1e-6 < d.next_pts:
+        return 0
+    d.next_pts = pts + d.period
+    return 1
+
+
+cdef class _ScalerContext(object):
+    '''A SwsContext that is returned to the scaler cache when no longer used,
+    see :func:`set_sws_cache_size`.
+    '''
+
+    def __dealloc__(self):
+        if self.sws_ctx != NULL:
+            sws_freeContext(self.sws_ctx)
+
+
+# the unused scaler contexts keyed by (iw, ih, ifmt, ow, oh, ofmt, flags, threads), least
+# recently used first. Each value is a list, because a context can only be used
+# for one conversion at a time
+cdef object _sws_cache = OrderedDict()
+cdef size_t _sws_cache_max_bytes = 64 * 1024 * 1024
+cdef size_t _sws_cache_bytes = 0
+cdef int64_t _sws_cache_hits = 0
+cdef int64_t _sws_cache_misses = 0
+cdef int64_t _sws_cache_evictions = 0
+
+
+cdef inline size_t _sws_context_size(int iw, int ih, int ow, int oh, int threads) nogil:
+    # swscale doesn't report its memory use, so estimate it from the filter
+    # tables and line buffers, which grow with the image dimensions, and each
+    # slice thread has its own copy of them
+    if threads <= 0:
+        threads = av_cpu_count()
+    return threads * (65536 + 256 * <size_t>max(iw, ow) + 64 * <size_t>max(ih, oh))
+
+
+cdef int _evict_sws_cache() except -1:
+    '''Removes the least recently used contexts until the cache fits its budget.
+    '''
+    global _sws_cache_bytes, _sws_cache_evictions
+    cdef _ScalerContext scaler
+    while _sws_cache and _sws_cache_bytes > _sws_cache_max_bytes:
+        key, scalers = next(iter(_sws_cache.items()))
+        scaler = scalers.pop(0)
+        if not scalers:
+            del _sws_cache[key]
+        _sws_cache_bytes -= scaler.size
+        _sws_cache_evictions += 1
+    return 0
+
+
+cdef _ScalerContext _sws_cache_get(
+        int iw, int ih, AVPixelFormat ifmt, int ow, int oh, AVPixelFormat ofmt, int flags,
+        int threads):
+    '''Takes a matching context from the cache, or creates one if none is cached.
+    It must be given back with :func:`_sws_cache_put` once it's not used anymore.
+    '''
+    global _sws_cache_bytes, _sws_cache_hits, _sws_cache_misses
+    cdef _ScalerContext scaler
+    cdef tuple key = (iw, ih, <int>ifmt, ow, oh, <int>ofmt, flags, threads)
+
+    scalers = _sws_cache.get(key)
+    if scalers:
+        scaler = scalers.pop()
+        if not scalers:
+            del _sws_cache[key]
+        _sws_cache_bytes -= scaler.size
+        _sws_cache_hits += 1
+        return scaler
+
+    scaler = _ScalerContext.__new__(_ScalerContext)
+    scaler.sws_ctx = get_sws_context(NULL, iw, ih, ifmt, ow, oh, ofmt, flags, threads)
+    if scaler.sws_ctx == NULL:
+        raise Exception('Cannot initialize the conversion context.')
+    scaler.key = key
+    scaler.size = _sws_context_size(iw, ih, ow, oh, threads)
+    scaler.threads = threads
+    _sws_cache_misses += 1
+    return scaler
+
+
+cdef int _sws_cache_put(_ScalerContext scaler) except -1:
+    '''Returns a context taken with :func:`_sws_cache_get` to the cache.
+    '''
+    global _sws_cache_bytes
+    # the cache may have been cleared already during interpreter shutdown
+    if _sws_cache is None or scaler.size > _sws_cache_max_bytes:
+        return 0
+
+    scalers = _sws_cache.get(scaler.key)
+    if scalers is None:
+        _sws_cache[scaler.key] = scalers = []
+    else:
+        _sws_cache.move_to_end(scaler.key)
+    scalers.append(scaler)
+    _sws_cache_bytes += scaler.size
+    return _evict_sws_cache()
+
+
+def set_sws_cache_size(size_t max_bytes):
+    '''Sets the maximum number of bytes used by the cache of scaler contexts.
+
+    Creating a scaler context for a conversion computes filter tables which is
+    slow compared to a conversion of a small image. :class:`SWScale` and
+    :meth:`Image.convert` therefore take their context from a process wide cache
+    keyed by the source and output size and pixel format, and return it when done.
+
+    The memory used by a context is estimated from the image dimensions. When
+    the cache exceeds ``max_bytes``, the least recently used contexts are freed.
+    Defaults to 64 MiB.
+
+    :Parameters:
+
+        `max_bytes`: int
+            The maximum number of bytes. If zero, contexts are not cached.
+    '''
+    global _sws_cache_max_bytes
+    _sws_cache_max_bytes = max_bytes
+    _evict_sws_cache()
+
+
+def clear_sws_cache():
+    '''Frees all the cached scaler contexts, see :func:`set_sws_cache_size`.
+    '''
+    global _sws_cache_bytes
+    _sws_cache.clear()
+    _sws_cache_bytes = 0
+
+
+def get_sws_cache_stats():
+    '''Returns statistics about the scaler context cache, see
+    :func:`set_sws_cache_size`.
+
+    :returns:
+
+        dict: with the keys ``max_bytes``, the maximum size of the cache;
+        ``cached_bytes``, the estimated size of the cached contexts;
+        ``contexts``, the number of cached contexts; ``hits`` and ``misses``, the
+        number of times a context was taken from the cache or had to be created;
+        and ``evictions``, the number of contexts freed to stay within the budget.
+    '''
+    return {
+        'max_bytes': _sws_cache_max_bytes, 'cached_bytes': _sws_cache_bytes,
+        'contexts': sum(len(scalers) for scalers in _sws_cache.values()),
+        'hits': _sws_cache_hits, 'misses': _sws_cache_misses,
+        'evictions': _sws_cache_evictions}
+
+
+def _fill_frame_batch(next_frame, int n, out=None, pts=None, pix_fmt=None):
+    '''Calls ``next_frame()`` up to ``n`` times and writes the image data of each
+    ``(Image, pts)`` frame it returns into the consecutive slots of ``out``. It
+    stops early when ``next_frame`` returns None or a None image.
+
+    The frames are copied, or scaled when ``pix_fmt`` differs from their pixel
+    format, directly into their slot of ``out``.
+
+    See :meth:`ImageLoader.get_frames` for the meaning of the parameters and the
+    return value.
+    '''
+    cdef Py_buffer out_buf
+    cdef Py_buffer pts_buf
+    cdef int has_out = 0, has_pts = 0, count = 0, res = 0
+    cdef int frame_size = 0, size, w = 0, h = 0
+    cdef AVPixelFormat fmt, frame_fmt = AV_PIX_FMT_NONE, out_fmt = AV_PIX_FMT_NONE
+    cdef AVFrame *dst_frame = NULL
+    cdef _ScalerContext scaler = None
+    cdef SwsContext *sws_ctx = NULL
+    cdef Image img
+    cdef uint8_t *dst
+    cdef char msg[256]
+    cdef bytes pts_fmt
+    cdef list times = []
+
+    if n <= 0:
+        raise ValueError('The number of frames must be positive')
+    if pix_fmt:
+        out_fmt = av_get_pix_fmt(pix_fmt.encode('utf8'))
+        if out_fmt == AV_PIX_FMT_NONE:
+            raise Exception('Pixel format %s not found.' % pix_fmt)
+
+    if pts is not None:
+        PyObject_GetBuffer(pts, &pts_buf, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS | PyBUF_FORMAT)
+        has_pts = 1
+
+    try:
+        if has_pts:
+            pts_fmt = pts_buf.format
+        if has_pts and (pts_buf.itemsize != sizeof(double) or pts_fmt[-1:] != b'd' or
+                        pts_buf.len < n * <Py_ssize_t>sizeof(double)):
+            raise ValueError('pts must be a buffer of at least {} doubles'.format(n))
+
+        while count < n:
+            frame = next_frame()
+            if frame is None or frame[0] is None:
+                break
+            img, t = frame
+
+            fmt = <AVPixelFormat>img.frame.format
+            if not count:
+                w, h, frame_fmt = img.frame.width, img.frame.height, fmt
+                if out_fmt == AV_PIX_FMT_NONE:
+                    out_fmt = fmt
+                frame_size = av_image_get_buffer_size(out_fmt, w, h, 1)
+                if frame_size < 0:
+                    raise Exception('Failed to get image size: ' +
+                                    tcode(emsg(frame_size, msg, sizeof(msg))))
+
+                if out is None:
+                    out = bytearray(n * <Py_ssize_t>frame_size)
+                PyObject_GetBuffer(out, &out_buf, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS)
+                has_out = 1
+                if out_buf.len < n * <Py_ssize_t>frame_size:
+                    raise ValueError('out must have at least {} bytes'.format(
+                        n * <Py_ssize_t>frame_size))
+
+                if <int>out_fmt != <int>fmt:
+                    # the slots of out are the buffers of the scaled frame
+                    dst_frame = av_frame_alloc()
+                    if dst_frame == NULL:
+                        raise MemoryError
+                    dst_frame.format = out_fmt
+                    dst_frame.width = w
+                    dst_frame.height = h
+                    scaler = _sws_cache_get(w, h, fmt, w, h, out_fmt, SWS_BICUBIC, 1)
+                    sws_ctx = scaler.sws_ctx
+            elif img.frame.width != w or img.frame.height != h or fmt != frame_fmt:
+                raise ValueError(
+                    'All the frames of a batch must have the same size and pixel format')
+
+            dst = <uint8_t *>out_buf.buf + count * <Py_ssize_t>frame_size
+            with nogil:
+                if sws_ctx != NULL:
+                    res = av_image_fill_arrays(
+                        dst_frame.data, dst_frame.linesize, dst, out_fmt, w, h, 1)
+                    if res >= 0:
+                        res = scale_frame(sws_ctx, img.frame, dst_frame, 1, 0)
+                else:
+                    res = av_image_copy_to_buffer(
+                        dst, frame_size, <const uint8_t * const *>img.frame.data,
+                        img.frame.linesize, fmt, w, h, 1)
+            if res < 0:
+                raise Exception('Failed to copy image: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+            if has_pts:
+                (<double *>pts_buf.buf)[count] = t
+            else:
+                times.append(t)
+            count += 1
+    finally:
+        av_frame_free(&dst_frame)
+        if scaler is not None:
+            _sws_cache_put(scaler)
+        if has_out:
+            PyBuffer_Release(&out_buf)
+        if has_pts:
+            PyBuffer_Release(&pts_buf)
+
+    return count, out, pts if has_pts else times
+
+
+cdef struct _ScaleJob:
+    SwsContext *sws_ctx
+    AVFrame **src
+    AVFrame **dst
+    int count
+    int ret
+
+
+cdef int _scale_job(_ScaleJob *job) noexcept nogil:
+    cdef int i, ret
+    for i in range(job.count):
+        ret = scale_frame(job.sws_ctx, job.src[i], job.dst[i], 1, 0)
+        if ret < 0:
+            job.ret = ret
+            break
+    return 0
+
+
+cdef int _scale_job_enter(void *job) except? 1 with gil:
+    with nogil:
+        return _scale_job(<_ScaleJob *>job)
+
+
 cdef class SWScale(object):
     '''Converts Images from one format and size to another format and size.
 
     The class accepts an Image of a given pixel format and size and converts it
     to another Image with a different pixel format and size. Each SWScale instance
     converts only images with parameters specified when creating the instance.
+    The scaler context is shared with other instances through a cache, see
+    :func:`set_sws_cache_size`.
 
     :Parameters:
 
@@ -149,6 +857,12 @@ cdef class SWScale(object):
             The pixel format of the output image. Can be one of
             :attr:`ffpyplayer.tools.pix_fmts`. If empty, the source pixel format
             will be used. Defaults to empty string.
+        `threads`: int
+            The number of threads used to scale an image. When not 1, :meth:`scale`
+            splits the output image into horizontal slices that are scaled in
+            parallel with the GIL released, and :meth:`scale_many` converts that
+            many images in parallel. If zero, the number of CPUs is used.
+            Defaults to 1.
 
     :
 
@@ -202,7 +916,8 @@ cdef class SWScale(object):
 
     '''
 
-    def __cinit__(self, int iw, int ih, ifmt, int ow=-1, int oh=-1, ofmt='', **kargs):
+    def __cinit__(self, int iw, int ih, ifmt, int ow=-1, int oh=-1, ofmt='', int threads=1,
+                  **kargs):
         cdef AVPixelFormat src_pix_fmt, dst_pix_fmt
         self.dst_pix_fmt = ifmt.encode('utf8')
         self.dst_pix_fmt_s = ifmt
@@ -234,14 +949,16 @@ cdef class SWScale(object):
         self.src_w = iw
         self.src_h = ih
 
-        self.sws_ctx = sws_getCachedContext(NULL, iw, ih, src_pix_fmt, ow, oh,
-                                            dst_pix_fmt, SWS_BICUBIC, NULL, NULL, NULL)
-        if self.sws_ctx == NULL:
-            raise Exception('Cannot initialize the conversion context.')
+        if threads < 0:
+            raise ValueError('threads must be zero or positive')
+        self.threads = threads
+        self.scaler = _sws_cache_get(
+            iw, ih, src_pix_fmt, ow, oh, dst_pix_fmt, SWS_BICUBIC, threads)
+        self.sws_ctx = self.scaler.sws_ctx
 
     def __dealloc__(self):
-        if self.sws_ctx != NULL:
-            sws_freeContext(self.sws_ctx)
+        if self.scaler is not None:
+            _sws_cache_put(self.scaler)
 
     def scale(self, Image src, Image dst=None, int _flip=False):
         '''Scales a image into another image format and/or size as specified by the
@@ -269,25 +986,110 @@ cdef class SWScale(object):
                 The output image. If ``dst`` was not None ``dst`` will be returned,
                 otherwise a new image containing the converted image will be returned.
         '''
-        if (<AVPixelFormat>src.frame.format != self.src_pix_fmt or
-            self.src_w != src.frame.width or self.src_h != src.frame.height):
-            raise Exception("Source image doesn't match the specified input parameters.")
+        cdef int res
+        cdef char msg[256]
+        _check_scale_src(self, src)
         if not dst:
             dst = Image.__new__(Image, pix_fmt=self.dst_pix_fmt_s,
                                 size=(self.dst_w, self.dst_h))
         with nogil:
-            if _flip:
-                for i in range(4):
-                    (<uint8_t * *>src.frame.data)[i] += src.frame.linesize[i] * (src.frame.height - 1)
-                    src.frame.linesize[i] = -src.frame.linesize[i]
-            sws_scale(self.sws_ctx, <const uint8_t *const *>src.frame.data, src.frame.linesize,
-                          0, src.frame.height, dst.frame.data, dst.frame.linesize)
-            if _flip:
-                for i in range(4):
-                    src.frame.linesize[i] = -src.frame.linesize[i]
-                    (<uint8_t * *>src.frame.data)[i] -= src.frame.linesize[i] * (src.frame.height - 1)
+            res = scale_frame(self.sws_ctx, src.frame, dst.frame, self.threads, _flip)
+        if res < 0:
+            raise Exception('Failed to scale image: ' + tcode(emsg(res, msg, sizeof(msg))))
         return dst
 
+    def scale_many(self, src_list, dst_list=None):
+        '''Scales many images, like :meth:`scale`, by converting whole images in
+        parallel on ``threads`` native threads with the GIL released.
+
+        :Parameters:
+
+            `src_list`: list of :class:`Image`
+                The source images, as for :meth:`scale`.
+            `dst_list`: list of :class:`Image` or None
+                If specified, a list of the same length as ``src_list`` with the
+                images to convert into, as for :meth:`scale`. Otherwise, new
+                images are created. Defaults to None.
+
+        :returns:
+
+            list of :class:`Image`:
+                The output images, ``dst_list`` if it was provided.
+        '''
+        cdef int i, k, res = 0, n = len(src_list), n_workers = self.threads
+        cdef AVFrame **frames = NULL
+        cdef _ScaleJob *jobs = NULL
+        cdef list scalers = [], threads = []
+        cdef _ScalerContext scaler
+        cdef MTThread thread
+        cdef Image img
+        cdef char msg[256]
+
+        if dst_list is None:
+            dst_list = [Image.__new__(Image, pix_fmt=self.dst_pix_fmt_s,
+                                      size=(self.dst_w, self.dst_h)) for _ in range(n)]
+        elif len(dst_list) != n:
+            raise ValueError('src_list and dst_list must have the same length')
+        for img in src_list:
+            _check_scale_src(self, img)
+        if not n_workers:
+            n_workers = av_cpu_count()
+        n_workers = max(min(n_workers, n), 1)
+
+        frames = <AVFrame **>av_malloc(2 * n * sizeof(AVFrame *))
+        jobs = <_ScaleJob *>av_mallocz(n_workers * sizeof(_ScaleJob))
+        if frames == NULL or jobs == NULL:
+            av_free(frames)
+            av_free(jobs)
+            raise MemoryError()
+
+        try:
+            for i in range(n):
+                frames[i] = (<Image>src_list[i]).frame
+                frames[n + i] = (<Image>dst_list[i]).frame
+
+            # each worker converts a contiguous run of the images with its own context
+            for k in range(n_workers):
+                scaler = _sws_cache_get(
+                    self.src_w, self.src_h, self.src_pix_fmt, self.dst_w, self.dst_h,
+                    av_get_pix_fmt(self.dst_pix_fmt), SWS_BICUBIC, 1)
+                scalers.append(scaler)
+                jobs[k].sws_ctx = scaler.sws_ctx
+                jobs[k].src = frames + k * n // n_workers
+                jobs[k].dst = frames + n + k * n // n_workers
+                jobs[k].count = (k + 1) * n // n_workers - k * n // n_workers
+
+            if n_workers == 1:
+                with nogil:
+                    _scale_job(jobs)
+            else:
+                for k in range(n_workers):
+                    thread = MTThread.__new__(MTThread, Native_MT)
+                    thread.create_thread(_scale_job_enter, "scale_many", &jobs[k])
+                    threads.append(thread)
+        finally:
+            for thread in threads:
+                with nogil:
+                    thread.wait_thread(NULL)
+            for scaler in scalers:
+                _sws_cache_put(scaler)
+            for k in range(n_workers):
+                if jobs[k].ret < 0:
+                    res = jobs[k].ret
+            av_free(frames)
+            av_free(jobs)
+
+        if res < 0:
+            raise Exception('Failed to scale image: ' + tcode(emsg(res, msg, sizeof(msg))))
+        return dst_list
+
+
+cdef int _check_scale_src(SWScale sws, Image src) except 1:
+    if (<AVPixelFormat>src.frame.format != sws.src_pix_fmt or
+        sws.src_w != src.frame.width or sws.src_h != src.frame.height):
+        raise Exception("Source image doesn't match the specified input parameters.")
+    return 0
+
 
 cdef int raise_exec(object ecls) nogil except 1:
     with gil:
@@ -435,7 +1237,7 @@ cdef class Image(object):
                 self.frame.data[i] = plane
         else:
             with nogil:
-                res = av_frame_get_buffer(self.frame, 32)
+                res = frame_pool_get_buffer(self.frame, 32)
             if res < 0:
                 raise Exception('Could not allocate avframe buffer of size %dx%d: %s'\
                                 % (w, h, tcode(emsg(res, msg, sizeof(msg)))))
@@ -471,7 +1273,7 @@ cdef class Image(object):
         if av_frame_copy_props(frame, self.frame) < 0:
             av_frame_free(&frame)
             raise Exception('Cannot copy frame properties.')
-        if av_frame_get_buffer(frame, 32) < 0:
+        if frame_pool_get_buffer(frame, 32) < 0:
             av_frame_free(&frame)
             raise Exception('Cannot allocate frame buffers.')
 
@@ -894,16 +1696,284 @@ cdef class Image(object):
                           <AVPixelFormat>self.frame.format, self.frame.width, self.frame.height)
         return planes
 
+    cpdef planes(Image self):
+        '''Returns the planes of the image as :class:`ImagePlane` buffer-protocol
+        objects that point directly to the image data.
+
+        Unlike :meth:`to_memoryview`, the data is never copied, even when the lines
+        are padded, e.g. for decoded frames. Instead, each plane is a 2D or 3D
+        buffer whose strides skip the padding. The planes keep this image alive,
+        so they can safely outlive any reference to it.
+
+        :Returns:
+
+            4-element list:
+                A list of :class:`ImagePlane` for each plane of this
+                image's pixel format. Unused planes are set to None.
+
+        Get a numpy array of an RGB image:
+
+        .. code-block:: python
+
+            >>> img = Image(pix_fmt='rgb24', size=(100, 10))
+            >>> img.get_linesizes(keep_align=True)
+            (320, 0, 0, 0)
+            >>> arr = np.asarray(img.planes()[0])
+            >>> arr.shape, arr.strides
+            ((10, 100, 3), (320, 3, 1))
+        '''
+        cdef list planes = [None, None, None, None]
+        cdef ImagePlane plane
+        cdef const AVPixFmtDescriptor *desc
+        cdef int i, res, writable
+        cdef int ls[4]
+        cdef char msg[256]
+
+        desc = av_pix_fmt_desc_get(<AVPixelFormat>self.frame.format)
+        if desc == NULL or desc.flags & AV_PIX_FMT_FLAG_HWACCEL:
+            raise Exception('The planes of the pixel format cannot be accessed')
+
+        res = av_image_fill_linesizes(ls, <AVPixelFormat>self.frame.format, self.frame.width)
+        if res < 0:
+            raise Exception('Failed to initialize linesizes: ' +
+                            tcode(emsg(res, msg, sizeof(msg))))
+
+        writable = self.frame.buf[0] == NULL or av_frame_is_writable(self.frame)
+        for i in range(4):
+            if self.frame.data[i] == NULL:
+                continue
+            if not ls[i] and not (i == 1 and desc.flags & AV_PIX_FMT_FLAG_PAL):
+                continue
+            planes[i] = plane = ImagePlane.__new__(ImagePlane)
+            plane.init(self, i, desc, ls[i], writable)
+        return planes
+
+    cpdef convert(Image self, pix_fmt=None, size=None, Image out=None):
+        '''Converts the image to another pixel format and/or size.
+
+        Unlike :class:`SWScale`, the conversion parameters don't have to be known
+        ahead of time. The scaler context is taken from a process wide cache, see
+        :func:`set_sws_cache_size`, so converting many images of a few formats
+        and sizes doesn't rebuild the scaler.
+
+        :Parameters:
+
+            `pix_fmt`: str or None
+                The pixel format of the output image. Can be one of
+                :attr:`ffpyplayer.tools.pix_fmts`. If None, the pixel format of
+                this image is used. Defaults to None.
+            `size`: 2-tuple or None
+                The ``(width, height)`` of the output image. If None, the size of
+                this image is used. Defaults to None.
+            `out`: :class:`Image` or None
+                If specified, the image is converted into ``out``, which must have
+                the requested pixel format and size. Otherwise, a new image is
+                created. Defaults to None.
+
+        :returns:
+
+            :class:`Image`:
+                The output image, ``out`` if it was provided.
+
+        .. code-block:: python
+
+            >>> img = Image(pix_fmt='rgb24', size=(500, 100))
+            >>> img2 = img.convert('yuv420p', size=(250, 50))
+            >>> img2.get_pixel_format(), img2.get_size()
+            ('yuv420p', (250, 50))
+            >>> img.convert('yuv420p', size=(250, 50), out=img2)
+            <ffpyplayer.pic.Image object at 0x02B44440>
+        '''
+        cdef AVPixelFormat fmt = <AVPixelFormat>self.frame.format
+        cdef int res, w = self.frame.width, h = self.frame.height
+        cdef _ScalerContext scaler
+        cdef char msg[256]
+
+        if pix_fmt:
+            fmt = av_get_pix_fmt(pix_fmt.encode('utf8'))
+            if fmt == AV_PIX_FMT_NONE:
+                raise Exception('Pixel format %s not found.' % pix_fmt)
+        if size:
+            w, h = size
+
+        if out is None:
+            out = Image.__new__(Image, pix_fmt=tcode(av_get_pix_fmt_name(fmt)),
+                                size=(w, h))
+        elif (<AVPixelFormat>out.frame.format != fmt or out.frame.width != w or
+              out.frame.height != h):
+            raise Exception("The output image doesn't match the requested format and size.")
+
+        scaler = _sws_cache_get(
+            self.frame.width, self.frame.height, <AVPixelFormat>self.frame.format,
+            w, h, fmt, SWS_BICUBIC, 1)
+        try:
+            with nogil:
+                res = scale_frame(scaler.sws_ctx, self.frame, out.frame, 1, 0)
+        finally:
+            _sws_cache_put(scaler)
+        if res < 0:
+            raise Exception('Failed to convert image: ' + tcode(emsg(res, msg, sizeof(msg))))
+        return out
+
+
+cdef class ImagePlane(object):
+    '''A buffer-protocol object that exposes one plane of an :class:`Image`
+    without copying it. It is created by :meth:`Image.planes`.
+
+    The buffer has the actual strides of the plane, i.e. its first stride is
+    the (possibly padded) linesize of the plane. Its shape is ``(h, w)`` when
+    the plane has a single component per pixel (e.g. ``gray`` or each plane of
+    ``yuv420p``) and ``(h, w, c)`` when the plane has ``c`` interleaved
+    components (e.g. ``rgb24``, or the UV plane of ``nv12``). The item type is
+    an unsigned integer (or float) large enough for a component.
+
+    Planes whose pixels cannot be described this way, e.g. bitstream formats,
+    are exposed as ``(h, linesize bytes)`` uint8 buffers, and the palette of
+    paletted formats as a ``(256, 4)`` uint8 buffer.
+
+    The plane holds a reference to the :class:`Image`, so the underlying data
+    remains valid while the plane, or any view of it, is alive. The buffer is
+    read-only if the image data is shared with other images.
+
+    For example:
+
+    .. code-block:: python
+
+        >>> img = Image(pix_fmt='rgb24', size=(640, 480))
+        >>> arr = np.asarray(img.planes()[0])
+        >>> arr.shape, arr.strides
+        ((480, 640, 3), (1920, 3, 1))
+    '''
+
+    cdef int init(ImagePlane self, Image image, int plane, const AVPixFmtDescriptor *desc,
+                  int line_bytes, int writable) except 1:
+        cdef AVFrame *frame = image.frame
+        cdef int rows = frame.height, cols = frame.width
+        cdef int c, ncomp = 0, step = 0, depth = 0
+        cdef Py_ssize_t itemsize = 0
+
+        self.image = image
+        self.writable = writable
+        self.data = frame.data[plane]
+        self.format = b'B'
+        self.itemsize = 1
+        self.ndim = 2
+
+        if desc.flags & AV_PIX_FMT_FLAG_PAL and plane == 1:
+            self.shape[0], self.shape[1] = 256, 4
+            self.strides[0], self.strides[1] = 4, 1
+            return 0
+
+        if plane == 1 or plane == 2:
+            rows = -((-rows) >> desc.log2_chroma_h)
+            cols = -((-cols) >> desc.log2_chroma_w)
+
+        for c in range(desc.nb_components):
+            if desc.comp[c].plane != plane:
+                continue
+            if not ncomp:
+                step = desc.comp[c].step
+            ncomp += 1
+            depth = FFMAX(depth, desc.comp[c].depth)
+        if ncomp and step % ncomp == 0:
+            itemsize = step // ncomp
+
+        self.shape[0] = rows
+        self.strides[0] = frame.linesize[plane]
+        if (desc.flags & AV_PIX_FMT_FLAG_BITSTREAM or not step or
+                line_bytes != cols * step):
+            self.shape[1] = line_bytes
+            self.strides[1] = 1
+        elif itemsize not in (1, 2, 4) or depth > 8 * itemsize:
+            # e.g. packed components with padding bytes, such as rgb0 or yuyv422
+            self.ndim = 3
+            self.shape[1], self.shape[2] = cols, step
+            self.strides[1], self.strides[2] = step, 1
+        else:
+            self.itemsize = itemsize
+            if desc.flags & AV_PIX_FMT_FLAG_FLOAT:
+                self.format = b'e' if itemsize == 2 else b'f'
+            else:
+                self.format = {1: b'B', 2: b'H', 4: b'I'}[itemsize]
+            if itemsize > 1:
+                self.format = (b'>' if desc.flags & AV_PIX_FMT_FLAG_BE else b'<') + self.format
+
+            self.shape[1] = cols
+            self.strides[1] = step
+            if ncomp > 1:
+                self.ndim = 3
+                self.shape[2] = ncomp
+                self.strides[2] = itemsize
+        return 0
+
+    def __getbuffer__(ImagePlane self, Py_buffer *buffer, int flags):
+        cdef int i
+        cdef Py_ssize_t size = self.itemsize
+
+        if flags & PyBUF_WRITABLE and not self.writable:
+            raise BufferError('The image data is shared and cannot be written')
+        if not (flags & PyBUF_STRIDES):
+            for i in range(self.ndim - 1, -1, -1):
+                if self.strides[i] != size:
+                    raise BufferError('The plane is not contiguous, strides are required')
+                size *= self.shape[i]
+
+        size = self.itemsize
+        for i in range(self.ndim):
+            size *= self.shape[i]
+
+        buffer.buf = self.data
+        buffer.obj = self
+        buffer.len = size
+        buffer.readonly = not self.writable
+        buffer.itemsize = self.itemsize
+        buffer.ndim = self.ndim
+        if flags & PyBUF_FORMAT:
+            buffer.format = <char *>self.format
+        else:
+            buffer.format = NULL
+        if flags & PyBUF_ND:
+            buffer.shape = self.shape
+        else:
+            buffer.shape = NULL
+        if flags & PyBUF_STRIDES:
+            buffer.strides = self.strides
+        else:
+            buffer.strides = NULL
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+
+    def __releasebuffer__(ImagePlane self, Py_buffer *buffer):
+        pass
+
 
 cdef class ImageLoader(object):
     '''Class that reads one or more images from a file and returns them.
 
     :Parameters:
 
-        `filename`: string type
+        `filename`: string type, file-like, or buffer
             The full path to the image file. The string will first be encoded
             using utf8 before passing to FFmpeg.
 
+            It can also be a file-like object or buffer holding the image, which
+            is then read using a :class:`~ffpyplayer.avio.AVIOSource`.
+        `keyframes_only`: bool
+            If True, only the keyframes are decoded and returned. The other
+            packets are dropped before they reach the decoder, so e.g. making
+            thumbnails of a long video is much faster. Defaults to False.
+        `every_nth`: int
+            If larger than 1, only every ``every_nth`` decoded frame is returned,
+            starting with the first. Defaults to 1.
+        `target_fps`: float
+            If positive, at most this many frames are returned for each second of
+            the media, keeping each frame that is at least ``1 / target_fps``
+            seconds after the previously kept one. Defaults to 0.
+
+        The frames that are skipped are still decoded (unless ``keyframes_only``
+        is True), because later frames depend on them, but they are never
+        converted to an :class:`Image`.
+
     For example, reading a simple png using the iterator syntax:
 
     .. code-block:: python
@@ -958,15 +2028,26 @@ cdef class ImageLoader(object):
         (None, 0)
     '''
 
-    def __cinit__(self, filename, **kwargs):
+    def __cinit__(self, filename, keyframes_only=False, int every_nth=1,
+                  double target_fps=0, **kwargs):
 
         cdef AVDictionary *opts = NULL
         cdef const AVDictionaryEntry *t = NULL
         cdef int ret = 0
         cdef char *fname
 
-        fname = self.filename = filename.encode('utf8')
         self.format_ctx = NULL
+        self.keyframes_only = bool(keyframes_only)
+        decimator_init(&self.decimator, every_nth, target_fps)
+        if is_avio_source(filename):
+            self.source = get_avio_source(filename)
+            fname = self.filename = b''
+            self.format_ctx = avformat_alloc_context()
+            if self.format_ctx == NULL:
+                raise MemoryError()
+            self.source.attach(self.format_ctx)
+        else:
+            fname = self.filename = filename.encode('utf8')
         self.codec = NULL
         self.codec_ctx = avcodec_alloc_context3(NULL)
         if self.codec_ctx == NULL:
@@ -979,6 +2060,8 @@ cdef class ImageLoader(object):
         with nogil:
             ret = avformat_open_input(&self.format_ctx, fname, NULL, NULL)
         if ret < 0:
+            if self.source is not None:
+                self.source.raise_error()
             raise Exception("Failed to open input file {}: {}".format(filename,
                             tcode(emsg(ret, self.msg, sizeof(self.msg)))))
 
@@ -991,6 +2074,8 @@ cdef class ImageLoader(object):
         if self.codec is NULL:
             raise Exception("Failed to find supported codec for file {}"
                             .format(filename))
+        if self.keyframes_only:
+            self.codec_ctx.skip_frame = AVDISCARD_NONKEY
 
         with nogil:
             ret = avcodec_open2(self.codec_ctx, self.codec, &opts)
@@ -1040,40 +2125,51 @@ cdef class ImageLoader(object):
         cdef Image image
         cdef double t = 0
 
-        if self.eof:
-            return self.eof_frame()
-
-        with nogil:
-            ret = av_read_frame(self.format_ctx, &self.pkt)
-        if ret < 0:
-            if ret == AVERROR_EOF:
-                self.eof = 1
-                self.pkt.data = NULL
+        while True:
+            if self.eof:
                 return self.eof_frame()
-            raise Exception("Failed to read frame: {}",
-                            tcode(emsg(ret, self.msg, sizeof(self.msg))))
 
-        with nogil:
-            self.frame = av_frame_alloc()
-        if self.frame is NULL:
-            raise MemoryError("Failed to alloc frame")
+            with nogil:
+                ret = av_read_frame(self.format_ctx, &self.pkt)
+            if ret < 0:
+                if ret == AVERROR_EOF:
+                    self.eof = 1
+                    self.pkt.data = NULL
+                    return self.eof_frame()
+                raise Exception("Failed to read frame: {}",
+                                tcode(emsg(ret, self.msg, sizeof(self.msg))))
+
+            if self.keyframes_only and not self.pkt.flags & AV_PKT_FLAG_KEY:
+                av_packet_unref(&self.pkt)
+                continue
 
-        with nogil:
-            ret = avcodec_send_packet(self.codec_ctx, &self.pkt)
-            if ret >= 0:
-                ret = avcodec_receive_frame(self.codec_ctx, self.frame)
-        if ret < 0:
-            if ret == AVERROR_EOF:
-                self.eof = 1
-                self.pkt.data = NULL
-                return self.eof_frame()
-            raise Exception("Failed to decode image from file")
+            with nogil:
+                self.frame = av_frame_alloc()
+            if self.frame is NULL:
+                raise MemoryError("Failed to alloc frame")
 
-        self.frame.pts = self.frame.best_effort_timestamp
-        if self.frame.pts == AV_NOPTS_VALUE:
-            t = 0.
-        else:
-            t = av_q2d(self.format_ctx.streams[0].time_base) * self.frame.pts
+            with nogil:
+                ret = avcodec_send_packet(self.codec_ctx, &self.pkt)
+                if ret >= 0:
+                    ret = avcodec_receive_frame(self.codec_ctx, self.frame)
+            if ret < 0:
+                if ret == AVERROR_EOF:
+                    self.eof = 1
+                    self.pkt.data = NULL
+                    return self.eof_frame()
+                raise Exception("Failed to decode image from file")
+
+            self.frame.pts = self.frame.best_effort_timestamp
+            if self.frame.pts == AV_NOPTS_VALUE:
+                t = 0.
+            else:
+                t = av_q2d(self.format_ctx.streams[0].time_base) * self.frame.pts
+
+            if decimator_keep(
+                    &self.decimator, NAN if self.frame.pts == AV_NOPTS_VALUE else t):
+                break
+            av_packet_unref(&self.pkt)
+            av_frame_free(&self.frame)
 
         image = Image(no_create=True)
         image.cython_init(self.frame)
@@ -1082,35 +2178,474 @@ cdef class ImageLoader(object):
         av_frame_free(&self.frame)
         return image, t
 
+    def get_frames(self, int n, out=None, pts=None, pix_fmt=None):
+        '''Reads the next ``n`` frames and copies their image data into
+        consecutive slots of a single contiguous buffer.
+
+        Each frame is copied once, directly from the decoded frame, with its
+        planes packed without any line padding (i.e. the layout of
+        :meth:`Image.to_bytearray` with all the planes concatenated). For packed
+        formats such as ``rgb24``, ``out`` can therefore be e.g. a numpy array of
+        shape ``(n, h, w, 3)``. When ``pix_fmt`` is given, each frame is instead
+        scaled directly into its slot, without an intermediate image.
+
+        :Parameters:
+
+            `n`: int
+                The maximum number of frames to read.
+            `out`: writable, C-contiguous, buffer-protocol object or None
+                The buffer into which the frames are copied. It must have at least
+                ``n`` times the size of a frame bytes. If None, a bytearray of that
+                size is created.
+            `pts`: writable, C-contiguous, buffer of doubles or None
+                If not None, e.g. a numpy float64 array or ``array('d')`` of at
+                least ``n`` elements, the pts of the frames are written into it.
+            `pix_fmt`: str or None
+                The pixel format of the frames in ``out``. Can be one of
+                :attr:`ffpyplayer.tools.pix_fmts`. If None, the pixel format of
+                the decoded frames is used. Defaults to None.
+
+        :returns:
+            a 3-tuple of ``(count, out, pts)``, where ``count`` is the number of
+            frames read, which is less than ``n`` if the eof was reached. ``out`` is
+            the output buffer or None if no frames were read and it was not
+            provided. ``pts`` is the provided pts buffer or a list of the pts.
+
+        All the frames must have the same size and pixel format.
+        '''
+        return _fill_frame_batch(self.next_frame, n, out, pts, pix_fmt)
+
     cdef inline object eof_frame(self):
         '''Used to flush the remaining frames until no more cached.
         '''
         cdef int ret = 0
         cdef Image image
         cdef double t = 0
-        if self.eof == 2:
-            return None, 0
+        while True:
+            if self.eof == 2:
+                return None, 0
+
+            with nogil:
+                self.frame = av_frame_alloc()
+            if self.frame is NULL:
+                raise MemoryError("Failed to alloc frame")
+
+            with nogil:
+                ret = avcodec_send_packet(self.codec_ctx, &self.pkt)
+                if ret >= 0:
+                    ret = avcodec_receive_frame(self.codec_ctx, self.frame)
+            if ret < 0:
+                self.eof = 2
+                av_frame_free(&self.frame)
+                return None, 0
+
+            self.frame.pts = self.frame.best_effort_timestamp
+            if self.frame.pts == AV_NOPTS_VALUE:
+                t = 0.
+            else:
+                t = av_q2d(self.format_ctx.streams[0].time_base) * self.frame.pts
+            if decimator_keep(
+                    &self.decimator, NAN if self.frame.pts == AV_NOPTS_VALUE else t):
+                break
+            av_frame_free(&self.frame)
+
+        image = Image(no_create=True)
+        image.cython_init(self.frame)
+        av_frame_free(&self.frame)
+        return image, t
+
+
+cdef class FrameReader(object):
+    '''Class that provides frame accurate random access to the frames of a
+    video file.
+
+    Unlike :class:`~ffpyplayer.player.MediaPlayer`, no threads are started and
+    frames are not paced against a clock. Instead, the container is scanned once
+    to build an index of the pts of every frame and of the keyframes of the
+    video stream. The index is saved to a sidecar file so that later readers of
+    the same file can skip the scan. A frame is then read by seeking to the
+    nearest preceding keyframe and decoding forward until the requested frame.
+    Consecutive requests that are ahead of the last returned frame, within the
+    same group of pictures, are decoded forward without seeking.
+
+    :Parameters:
+
+        `filename`: string type
+            The full path to the video file. The string will first be encoded
+            using utf8 before passing to FFmpeg.
+        `index_filename`: string type
+            The path of the sidecar index file. If None, the default, it's
+            ``filename + '.ffindex'``. If the file exists and matches the size and
+            modification time of the video file, the index is loaded from it,
+            otherwise the file is scanned and the index is saved to it.
+        `save_index`: bool
+            Whether to save a newly built index to ``index_filename``.
+            Defaults to True.
+        `stream`: int
+            The index of the video stream to read. If -1, the default, the best
+            video stream is used.
+
+    For example:
+
+    .. code-block:: python
+
+        >>> reader = FrameReader('file.mp4')
+        >>> reader.get_frame_count()
+        6077
+        >>> img, t = reader.get_frame(frame_number=1200)
+        >>> img, t = reader.get_frame(pts=12.5)
+        >>> reader.close()
+    '''
+
+    def __cinit__(self, filename, index_filename=None, save_index=True,
+                  int stream=-1, **kwargs):
+        cdef AVDictionary *opts = NULL
+        cdef const AVDictionaryEntry *t = NULL
+        cdef AVCodec *codec = NULL
+        cdef int ret = 0, i
+        cdef char *fname
+
+        fname = self.filename = filename.encode('utf8')
+        self.format_ctx = NULL
+        self.codec_ctx = NULL
+        self.frame = NULL
+        self.pkt = NULL
+        self.last_pts = AV_NOPTS_VALUE
+        self.last_image = None
+        self.frame_pts = []
+        self.keyframe_pts = []
+        self.index_filename = index_filename
+        if index_filename is None:
+            self.index_filename = filename + '.ffindex'
+
+        self.frame = av_frame_alloc()
+        self.pkt = av_packet_alloc()
+        if self.frame == NULL or self.pkt == NULL:
+            raise MemoryError()
+
+        with nogil:
+            ret = avformat_open_input(&self.format_ctx, fname, NULL, NULL)
+        if ret < 0:
+            raise Exception("Failed to open input file {}: {}".format(filename,
+                            tcode(emsg(ret, self.msg, sizeof(self.msg)))))
 
         with nogil:
-            self.frame = av_frame_alloc()
-        if self.frame is NULL:
-            raise MemoryError("Failed to alloc frame")
+            ret = avformat_find_stream_info(self.format_ctx, NULL)
+        if ret < 0:
+            raise Exception("Failed to find stream info of {}: {}".format(filename,
+                            tcode(emsg(ret, self.msg, sizeof(self.msg)))))
 
+        if stream < 0:
+            stream = av_find_best_stream(
+                self.format_ctx, AVMEDIA_TYPE_VIDEO, -1, -1, NULL, 0)
+            if stream < 0:
+                raise Exception("Failed to find a video stream in {}: {}".format(
+                    filename, tcode(emsg(stream, self.msg, sizeof(self.msg)))))
+        elif stream >= self.format_ctx.nb_streams:
+            raise Exception("Stream {} doesn't exist in {}".format(stream, filename))
+
+        self.stream_index = stream
+        self.time_base = self.format_ctx.streams[stream].time_base
+        for i in range(self.format_ctx.nb_streams):
+            if i != stream:
+                self.format_ctx.streams[i].discard = AVDISCARD_ALL
+
+        self.codec_ctx = avcodec_alloc_context3(NULL)
+        if self.codec_ctx == NULL:
+            raise MemoryError()
+
+        ret = avcodec_parameters_to_context(
+            self.codec_ctx, self.format_ctx.streams[stream].codecpar)
+        if ret < 0:
+            raise Exception("Failed to open input file {}: {}".format(filename,
+                            tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+        self.codec_ctx.pkt_timebase = self.time_base
+
+        codec = avcodec_find_decoder(self.codec_ctx.codec_id)
+        if codec is NULL:
+            raise Exception("Failed to find supported codec for file {}"
+                            .format(filename))
+
+        av_dict_set(&opts, "threads", "auto", 0)
         with nogil:
-            ret = avcodec_send_packet(self.codec_ctx, &self.pkt)
-            if ret >= 0:
-                ret = avcodec_receive_frame(self.codec_ctx, self.frame)
+            ret = avcodec_open2(self.codec_ctx, codec, &opts)
         if ret < 0:
-            self.eof = 2
+            av_dict_free(&opts)
+            raise Exception("Failed to open codec for {}: {}".format(filename,
+                            tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+        t = av_dict_get(opts, "", NULL, AV_DICT_IGNORE_SUFFIX)
+        av_dict_free(&opts)
+        if t != NULL:
+            raise Exception("Option {} not found.".format(t.key))
+
+        if not self.load_index():
+            self.build_index()
+            if save_index and self.index_filename:
+                self.save_index()
+
+    def __dealloc__(self):
+        with nogil:
+            av_packet_free(&self.pkt)
             av_frame_free(&self.frame)
+            avformat_close_input(&self.format_ctx)
+            if self.codec_ctx != NULL:
+                avcodec_free_context(&self.codec_ctx)
+
+    def close(self):
+        '''Closes the file and frees all the resources. The reader cannot be used
+        afterwards.
+        '''
+        self.last_image = None
+        self.last_pts = AV_NOPTS_VALUE
+        self.frame_pts = []
+        self.keyframe_pts = []
+        with nogil:
+            av_packet_free(&self.pkt)
+            av_frame_free(&self.frame)
+            avformat_close_input(&self.format_ctx)
+            if self.codec_ctx != NULL:
+                avcodec_free_context(&self.codec_ctx)
+
+    def _index_key(self):
+        st = os.stat(self.filename)
+        return {
+            'version': 1, 'size': st.st_size, 'mtime': st.st_mtime,
+            'stream': self.stream_index,
+            'time_base': [self.time_base.num, self.time_base.den]}
+
+    def load_index(self):
+        '''Loads the index from ``index_filename``, if it exists and it matches
+        the video file.
+
+        :returns:
+            True if the index was loaded, False otherwise.
+        '''
+        if not self.index_filename or not os.path.exists(self.index_filename):
+            return False
+
+        try:
+            with open(self.index_filename, 'r') as fh:
+                data = json.load(fh)
+        except ValueError:
+            return False
+
+        if data.get('key') != self._index_key():
+            return False
+        self.frame_pts = data['frame_pts']
+        self.keyframe_pts = data['keyframe_pts']
+        return True
+
+    def save_index(self):
+        '''Saves the index to ``index_filename``.
+        '''
+        data = {
+            'key': self._index_key(), 'frame_pts': self.frame_pts,
+            'keyframe_pts': self.keyframe_pts}
+        with open(self.index_filename, 'w') as fh:
+            json.dump(data, fh)
+
+    def build_index(self):
+        '''Scans all the packets of the video stream, without decoding them, and
+        (re)builds the frame and keyframe index. It is automatically called
+        when the index could not be loaded.
+        '''
+        cdef int ret = 0
+        cdef int64_t pts
+        cdef list frame_pts = []
+        cdef list keyframe_pts = []
+
+        if self.format_ctx == NULL:
+            raise Exception('The reader is closed')
+        with nogil:
+            ret = av_seek_frame(self.format_ctx, -1, INT64_MIN, AVSEEK_FLAG_BACKWARD)
+
+        while True:
+            with nogil:
+                ret = av_read_frame(self.format_ctx, self.pkt)
+            if ret == AVERROR_EOF:
+                break
+            if ret < 0:
+                raise Exception("Failed to read frame: {}".format(
+                                tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+
+            if (self.pkt.stream_index == self.stream_index and
+                    not self.pkt.flags & AV_PKT_FLAG_DISCARD):
+                pts = self.pkt.pts
+                if pts == AV_NOPTS_VALUE:
+                    pts = self.pkt.dts
+                if pts != AV_NOPTS_VALUE:
+                    frame_pts.append(pts)
+                    if self.pkt.flags & AV_PKT_FLAG_KEY:
+                        keyframe_pts.append(pts)
+            av_packet_unref(self.pkt)
+
+        frame_pts.sort()
+        keyframe_pts.sort()
+        self.frame_pts = frame_pts
+        self.keyframe_pts = keyframe_pts
+        self.last_pts = AV_NOPTS_VALUE
+        self.last_image = None
+        # force the next read to seek
+        with nogil:
+            av_seek_frame(self.format_ctx, -1, INT64_MIN, AVSEEK_FLAG_BACKWARD)
+            avcodec_flush_buffers(self.codec_ctx)
+
+    def get_frame_count(self):
+        '''Returns the number of frames of the video stream, according to the
+        index.
+        '''
+        return len(self.frame_pts)
+
+    def get_frame_times(self):
+        '''Returns a list of the pts, in seconds, of all the frames of the video
+        stream, in presentation order.
+        '''
+        cdef double tb = av_q2d(self.time_base)
+        return [pts * tb for pts in self.frame_pts]
+
+    def get_keyframe_times(self):
+        '''Returns a list of the pts, in seconds, of all the keyframes of the
+        video stream.
+        '''
+        cdef double tb = av_q2d(self.time_base)
+        return [pts * tb for pts in self.keyframe_pts]
+
+    def get_frame(self, pts=None, frame_number=None):
+        '''Returns the exact frame displayed at a given time or with a given
+        frame number. Exactly one of `pts` or `frame_number` must be provided.
+
+        :Parameters:
+
+            `pts`: float
+                The time, in seconds, in the timebase of the stream (i.e. as
+                returned by :meth:`get_frame_times`). The frame being displayed
+                at that time is returned.
+            `frame_number`: int
+                The zero-based index of the frame, in presentation order.
+
+        :returns:
+            a 2-tuple of `(:class:`Image`, pts)`, where `pts` is the time of the
+            frame in seconds. If the frame could not be decoded, e.g. it is past
+            the end of the stream or the decoder only returns later frames, it
+            returns `(None, 0)`.
+        '''
+        cdef int64_t ts
+        cdef int i
+        if (pts is None) == (frame_number is None):
+            raise ValueError('Exactly one of pts or frame_number must be given')
+        if self.format_ctx == NULL:
+            raise Exception('The reader is closed')
+        if not self.frame_pts:
             return None, 0
 
-        self.frame.pts = self.frame.best_effort_timestamp
-        if self.frame.pts == AV_NOPTS_VALUE:
-            t = 0.
+        if frame_number is not None:
+            if not 0 <= frame_number < len(self.frame_pts):
+                raise IndexError('Frame {} is out of range'.format(frame_number))
+            ts = self.frame_pts[frame_number]
         else:
-            t = av_q2d(self.format_ctx.streams[0].time_base) * self.frame.pts
+            ts = av_rescale_q(<int64_t>(pts * AV_TIME_BASE), AV_TIME_BASE_Q, self.time_base)
+            i = max(bisect_right(self.frame_pts, ts) - 1, 0)
+            ts = self.frame_pts[i]
+
+        return self.read_frame_at(ts)
+
+    cdef int decode_frame(self) nogil:
+        '''Decodes the next frame of the stream into :attr:`frame`. Returns zero
+        on success, AVERROR_EOF when there are no more frames, or a negative
+        error code.
+        '''
+        cdef int ret
+        while True:
+            ret = avcodec_receive_frame(self.codec_ctx, self.frame)
+            if ret != AV_EAGAIN:
+                return ret
+
+            ret = av_read_frame(self.format_ctx, self.pkt)
+            if ret == AVERROR_EOF:
+                ret = avcodec_send_packet(self.codec_ctx, NULL)
+            elif ret < 0:
+                return ret
+            elif self.pkt.stream_index != self.stream_index:
+                av_packet_unref(self.pkt)
+                continue
+            else:
+                ret = avcodec_send_packet(self.codec_ctx, self.pkt)
+                av_packet_unref(self.pkt)
+
+            if ret < 0 and ret != AVERROR_EOF:
+                return ret
+
+    cdef int seek_keyframe(self, int64_t ts) nogil:
+        '''Seeks to the keyframe at or before `ts` and flushes the decoder.
+        '''
+        cdef int ret
+        self.last_pts = AV_NOPTS_VALUE
+        ret = av_seek_frame(self.format_ctx, self.stream_index, ts, AVSEEK_FLAG_BACKWARD)
+        avcodec_flush_buffers(self.codec_ctx)
+        return ret
+
+    cdef object read_frame_at(self, int64_t target):
+        cdef int ret, k, first = 0
+        cdef int64_t pts, ts = INT64_MIN
+        cdef Image image
+
+        if self.last_image is not None and self.last_pts == target:
+            return self.last_image, av_q2d(self.time_base) * target
+
+        k = max(bisect_right(self.keyframe_pts, target) - 1, 0)
+        # only seek if the keyframe preceding the target is past the current
+        # decoding position, otherwise just decode forward
+        if (self.last_pts == AV_NOPTS_VALUE or self.last_pts >= target or
+                self.keyframe_pts and self.keyframe_pts[k] > self.last_pts):
+            if self.keyframe_pts:
+                ts = self.keyframe_pts[k]
+            self.last_image = None
+            with nogil:
+                ret = self.seek_keyframe(ts)
+            if ret < 0:
+                raise Exception("Failed to seek: {}".format(
+                                tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+            first = 1
+
+        while True:
+            with nogil:
+                ret = self.decode_frame()
+            if ret == AVERROR_EOF:
+                self.last_pts = AV_NOPTS_VALUE
+                return None, 0
+            if ret < 0:
+                raise Exception("Failed to decode frame: {}".format(
+                                tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+
+            pts = self.frame.best_effort_timestamp
+            if pts == AV_NOPTS_VALUE:
+                av_frame_unref(self.frame)
+                continue
+            self.last_pts = pts
+
+            # the demuxer landed after the target, go back another keyframe
+            if first and pts > target:
+                av_frame_unref(self.frame)
+                if not k:
+                    # no earlier keyframe, the target frame cannot be decoded
+                    return None, 0
+                k -= 1
+                ts = self.keyframe_pts[k]
+                with nogil:
+                    ret = self.seek_keyframe(ts)
+                if ret < 0:
+                    raise Exception("Failed to seek: {}".format(
+                                    tcode(emsg(ret, self.msg, sizeof(self.msg)))))
+                continue
+            first = 0
+
+            if pts >= target:
+                break
+            av_frame_unref(self.frame)
+
+        self.frame.pts = pts
         image = Image(no_create=True)
         image.cython_init(self.frame)
-        av_frame_free(&self.frame)
-        return image, t
+        av_frame_unref(self.frame)
+        self.last_image = image
+        return image, av_q2d(self.time_base) * pts
@@ -2,9 +2,12 @@
 FFmpeg based media player
 =========================
 
-A FFmpeg based python media player. See :class:`MediaPlayer` for details.
+A FFmpeg based python media player. See :class:`MediaPlayer` for details,
+and :class:`AsyncMediaPlayer` for using it with asyncio. Many players can share
+a :class:`PlayerPool`.
 '''
 
-__all__ = ('MediaPlayer', )
+__all__ = ('MediaPlayer', 'AsyncMediaPlayer', 'PlayerPool')
 
-from ffpyplayer.player.player import MediaPlayer
+from ffpyplayer.player.player import MediaPlayer, AsyncMediaPlayer
+from ffpyplayer.player.pool import PlayerPool
@@ -0,0 +1,32 @@
+include '../includes/ffmpeg.pxi'
+
+from ffpyplayer.threading cimport MTGenerator, MTCond
+
+
+cdef class AudioBuffer(object):
+    cdef:
+        MTCond cond
+        uint8_t *data
+        # the size of data in bytes, a multiple of frame_size
+        int64_t size
+        # the total bytes written and read, the next byte is at data[index % size]
+        int64_t windex
+        int64_t rindex
+        int frame_size
+        int bytes_per_sec
+        # the pts of the sample at windex, or NaN, and its packet queue serial
+        double end_pts
+        int serial
+        # the bytes overwritten before they were read
+        int64_t dropped
+        int abort_request
+
+    cdef int configure(AudioBuffer self, int64_t duration_size, int frame_size,
+                       int bytes_per_sec) nogil except 1
+    cdef int abort(AudioBuffer self) nogil except 1
+    cdef int64_t wait_space(AudioBuffer self, int64_t n, uint32_t timeout) nogil except -1
+    cdef int write(AudioBuffer self, const uint8_t *src, int64_t n, double end_pts,
+                   int serial, int overwrite) nogil except 1
+    cdef int64_t wait_readable(AudioBuffer self, int64_t n, double timeout) nogil except -1
+    cdef int64_t read(AudioBuffer self, uint8_t *dst, int64_t n, double *pts,
+                      double *end_pts, int *serial) nogil except -1
@@ -0,0 +1,181 @@
+#cython: cdivision=True
+
+__all__ = ('AudioBuffer', )
+
+include '../includes/ff_consts.pxi'
+
+cdef extern from "string.h" nogil:
+    void *memcpy(void *, const void *, size_t)
+
+cdef extern from "math.h" nogil:
+    double NAN
+    int isnan(double x)
+
+from ffpyplayer.threading cimport MTGenerator, MTCond
+
+
+cdef class AudioBuffer(object):
+    '''A ring buffer of the interleaved samples of the audio output, written by a
+    single producer, the audio sink thread, and read by a single consumer,
+    :meth:`~ffpyplayer.player.MediaPlayer.get_audio`.
+
+    The producer copies into the free part of the buffer without holding the
+    lock, which is only held to update the indices and when the consumer copies
+    out, so the buffer may be reconfigured safely when the stream changes.
+    '''
+
+    def __cinit__(AudioBuffer self, MTGenerator mt_gen):
+        self.cond = MTCond.__new__(MTCond, mt_gen.mt_src)
+        self.data = NULL
+        self.size = self.windex = self.rindex = self.dropped = 0
+        self.frame_size = self.bytes_per_sec = 0
+        self.end_pts = NAN
+        self.serial = -1
+        self.abort_request = 0
+
+    def __dealloc__(AudioBuffer self):
+        av_freep(&self.data)
+
+    cdef int configure(AudioBuffer self, int64_t size, int frame_size,
+                       int bytes_per_sec) nogil except 1:
+        '''(Re)allocates the buffer to hold ``size`` bytes, rounded down to whole
+        samples, of samples ``frame_size`` bytes each. Unread samples are discarded.
+        It must not be called while the producer is running.
+        '''
+        cdef uint8_t *data
+        size = max(size // frame_size, 1) * frame_size
+        data = <uint8_t *>av_malloc(size)
+        if data == NULL:
+            with gil:
+                raise MemoryError
+
+        self.cond.lock()
+        av_freep(&self.data)
+        self.data = data
+        self.size = size
+        self.frame_size = frame_size
+        self.bytes_per_sec = bytes_per_sec
+        self.windex = self.rindex = 0
+        self.end_pts = NAN
+        self.serial = -1
+        self.abort_request = 0
+        self.cond.cond_broadcast()
+        self.cond.unlock()
+        return 0
+
+    cdef int abort(AudioBuffer self) nogil except 1:
+        '''Wakes up and stops the producer and consumer waiting on the buffer.
+        '''
+        self.cond.lock()
+        self.abort_request = 1
+        self.cond.cond_broadcast()
+        self.cond.unlock()
+        return 0
+
+    cdef int64_t wait_space(AudioBuffer self, int64_t n, uint32_t timeout) nogil except -1:
+        '''Waits up to ``timeout`` ms until there's room for ``n`` bytes, and
+        returns the number of free bytes.
+        '''
+        cdef int64_t free
+        self.cond.lock()
+        free = self.size - (self.windex - self.rindex)
+        if free < n and not self.abort_request:
+            self.cond.cond_wait_timeout(timeout)
+            free = self.size - (self.windex - self.rindex)
+        self.cond.unlock()
+        return free
+
+    cdef int write(AudioBuffer self, const uint8_t *src, int64_t n, double end_pts,
+                   int serial, int overwrite) nogil except 1:
+        '''Appends ``n`` bytes, after which the next sample has ``end_pts``. If
+        ``overwrite``, the oldest samples are dropped to make room, otherwise only
+        the bytes that fit are written. The unread samples from a previous
+        ``serial`` are discarded, e.g. after a seek.
+        '''
+        cdef int64_t windex, free, offset, n1
+        n = min(n, self.size) // self.frame_size * self.frame_size
+
+        self.cond.lock()
+        if serial != self.serial:
+            self.rindex = self.windex
+            self.serial = serial
+        free = self.size - (self.windex - self.rindex)
+        if free < n:
+            if overwrite:
+                self.dropped += n - free
+                self.rindex += n - free
+            else:
+                n = free
+        windex = self.windex
+        self.cond.unlock()
+        if n <= 0:
+            return 0
+
+        # the consumer never reads past windex, so this part is ours
+        offset = windex % self.size
+        n1 = min(n, self.size - offset)
+        memcpy(self.data + offset, src, n1)
+        if n1 < n:
+            memcpy(self.data, src + n1, n - n1)
+
+        self.cond.lock()
+        self.windex += n
+        self.end_pts = end_pts
+        self.cond.cond_signal()
+        self.cond.unlock()
+        return 0
+
+    cdef int64_t wait_readable(AudioBuffer self, int64_t n, double timeout) nogil except -1:
+        '''Waits until at least ``n`` bytes can be read, or until ``timeout``
+        seconds elapsed if it's not negative, and returns the number of readable
+        bytes.
+        '''
+        cdef int64_t deadline = 0, remaining, available
+        if timeout >= 0:
+            deadline = av_gettime_relative() + <int64_t>(timeout * 1000000.)
+
+        self.cond.lock()
+        available = self.windex - self.rindex
+        while available < n and not self.abort_request:
+            if timeout >= 0:
+                remaining = deadline - av_gettime_relative()
+                if remaining <= 0:
+                    break
+                self.cond.cond_wait_timeout(<uint32_t>max(remaining // 1000, 1))
+            else:
+                self.cond.cond_wait_timeout(10)
+            available = self.windex - self.rindex
+        self.cond.unlock()
+        return available
+
+    cdef int64_t read(AudioBuffer self, uint8_t *dst, int64_t n, double *pts,
+                      double *end_pts, int *serial) nogil except -1:
+        '''Copies up to ``n`` bytes, rounded down to whole samples, of the available
+        samples into ``dst`` and returns the number of bytes copied. ``pts`` and
+        ``end_pts`` are set to the time of the first sample and of the sample
+        following the last one, and ``serial`` to their serial.
+        '''
+        cdef int64_t offset, n1, available
+
+        self.cond.lock()
+        if self.frame_size:
+            available = self.windex - self.rindex
+            n = min(n, available) // self.frame_size * self.frame_size
+        else:
+            n = 0
+        pts[0] = end_pts[0] = NAN
+        serial[0] = self.serial
+        if n > 0:
+            if not isnan(self.end_pts):
+                pts[0] = self.end_pts - <double>available / self.bytes_per_sec
+                end_pts[0] = pts[0] + <double>n / self.bytes_per_sec
+
+            offset = self.rindex % self.size
+            n1 = min(n, self.size - offset)
+            memcpy(dst, self.data + offset, n1)
+            if n1 < n:
+                memcpy(dst + n1, self.data, n - n1)
+            self.rindex += n
+            self.cond.cond_signal()
+        self.cond.unlock()
+        return n
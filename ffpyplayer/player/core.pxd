@@ -3,10 +3,13 @@ include '../includes/ffmpeg.pxi'
 
 from ffpyplayer.player.queue cimport FFPacketQueue
 from ffpyplayer.player.frame_queue cimport FrameQueue, Frame
+from ffpyplayer.player.audio_buffer cimport AudioBuffer
 from ffpyplayer.player.decoder cimport Decoder
+from ffpyplayer.player.pool cimport PlayerPool, PoolMember
 from ffpyplayer.threading cimport MTGenerator, MTThread, MTMutex, MTCond
 from ffpyplayer.player.clock cimport Clock
-from ffpyplayer.pic cimport Image
+from ffpyplayer.pic cimport Image, Decimator
+from ffpyplayer.avio cimport AVIOSource
 from cpython.ref cimport PyObject
 
 
@@ -19,6 +22,34 @@ cdef struct AudioParams:
     int bytes_per_sec
 
 
+cdef enum TraceKind:
+    TRACE_DEMUX,
+    TRACE_DECODE,
+    TRACE_FILTER,
+    TRACE_QUEUE,
+    TRACE_REFRESH
+
+
+cdef enum TraceThread:
+    TRACE_MAIN,
+    TRACE_READ,
+    TRACE_VIDEO,
+    TRACE_AUDIO
+
+
+cdef struct TraceSpan:
+    # the index of the span in the ring, written last so partially written spans
+    # can be skipped when reading
+    int64_t seq
+    int64_t start
+    int64_t end
+    TraceKind kind
+    TraceThread thread
+    int stream
+    int serial
+    double pts
+
+
 cdef class VideoState(object):
     cdef:
         MTThread read_tid
@@ -63,6 +94,9 @@ cdef class VideoState(object):
         AVStream *audio_st
         FFPacketQueue audioq
         int audio_hw_buf_size
+        # when audio_sdl is false, the buffer the sink thread writes the audio into
+        AudioBuffer audio_buffer
+        MTThread audio_sink_tid
 
         IF USE_SDL2_MIXER:
             uint8_t chunk_buf[AUDIO_MIN_BUFFER_SIZE]
@@ -102,6 +136,7 @@ cdef class VideoState(object):
             int vfilter_idx
             AVFilterContext *in_video_filter   # the first filter in the video chain
             AVFilterContext *out_video_filter  # the last filter in the video chain
+            AVFilterContext *output_filters[MAX_OUTPUTS]  # the sinks of the additional outputs
             AVFilterContext *in_audio_filter   # the first filter in the audio chain
             AVFilterContext *out_audio_filter  # the last filter in the audio chain
             AVFilterContext *split_audio_filter  # the last filter in the audio chain
@@ -110,6 +145,9 @@ cdef class VideoState(object):
         int last_video_stream, last_audio_stream, last_subtitle_stream
 
         MTCond continue_read_thread
+        # set with continue_read_thread locked when the read thread should not
+        # wait, e.g. because of a seek, until it checks its state again
+        int read_wake_req
         MTGenerator mt_gen
         VideoSettings *player
         int64_t last_time
@@ -117,6 +155,28 @@ cdef class VideoState(object):
         MTCond pause_cond
         double last_clock
         PyObject *self_id
+        # if not None, the pool that schedules the decoders
+        PlayerPool pool
+        PoolMember pool_member
+        # if not None, the input is read from it rather than from input_filename
+        AVIOSource source
+
+        int64_t frames_displayed
+
+        # if not NULL, the ring buffer of trace_size (a power of 2) spans into which
+        # the threads record what they're doing
+        TraceSpan *trace
+        int64_t trace_size
+        int64_t trace_windex
+        int64_t trace_rindex
+        int64_t packets_read
+        int64_t bytes_read
+
+        # selects the decoded video frames that are kept, see VideoSettings
+        Decimator decimator
+        int decimator_serial
+        int64_t frames_skipped
+        int64_t packets_skipped
 
         dict metadata
 
@@ -135,6 +195,10 @@ cdef class VideoState(object):
     cdef void set_out_pix_fmt(self, AVPixelFormat out_fmt)
     cdef int get_master_sync_type(VideoState self) nogil
     cdef double get_master_clock(VideoState self) nogil except? 0.0
+    cdef double get_av_diff(VideoState self) nogil except? 0.0
+    cdef int read_trace_span(VideoState self, int64_t i, TraceSpan *span) nogil
+    cdef void trace_span(VideoState self, TraceKind kind, TraceThread thread, int64_t start,
+                         int stream, int serial, double pts) nogil
     cdef int check_external_clock_speed(VideoState self) nogil except 1
     cdef int stream_seek(VideoState self, int64_t pos, int64_t rel, int seek_by_bytes, int flush) nogil except 1
     cdef int seek_chapter(VideoState self, int incr, int flush) nogil except 1
@@ -143,7 +207,8 @@ cdef class VideoState(object):
     cdef double vp_duration(VideoState self, Frame *vp, Frame *nextvp) nogil except? 0.0
     cdef void update_video_pts(VideoState self, double pts, int64_t pos, int serial) nogil
     cdef int video_refresh(VideoState self, Image next_image, double *pts, double *remaining_time,
-                           int force_refresh) nogil except -1
+                           int force_refresh, AVFrame **outputs) nogil except -1
+    cdef int wait_for_frame(VideoState self, double timeout, int frame_pending) nogil except 1
     cdef int get_video_frame(VideoState self, AVFrame *frame) nogil except 2
     IF CONFIG_AVFILTER:
         cdef int configure_filtergraph(VideoState self, AVFilterGraph *graph, const char *filtergraph,
@@ -160,13 +225,21 @@ cdef class VideoState(object):
     cdef int update_sample_display(VideoState self, int16_t *samples, int samples_size) nogil except 1
     cdef int synchronize_audio(VideoState self, int nb_samples) nogil except -1
     cdef int audio_decode_frame(VideoState self) nogil except? 1
+    cdef int fill_audio_buffer(VideoState self, uint8_t *stream, int len) nogil except 1
     cdef int sdl_audio_callback(VideoState self, uint8_t *stream, int len) nogil except 1
+    cdef int audio_sink_thread(VideoState self) nogil except 1
+    cdef int64_t read_audio(VideoState self, uint8_t *dst, int64_t n, double *pts) nogil except -1
     cdef inline int open_audio_device(VideoState self, SDL_AudioSpec *wanted_spec, SDL_AudioSpec *spec) nogil except 1
     cdef int audio_open(VideoState self, int64_t wanted_channel_layout, int wanted_nb_channels,
                         int wanted_sample_rate, AudioParams *audio_hw_params) nogil except? 1
     cdef int stream_component_open(VideoState self, int stream_index) nogil except 1
     cdef int stream_component_close(VideoState self, int stream_index) nogil except 1
     cdef int read_thread(VideoState self) nogil except 1
+    cdef int wake_read_thread(VideoState self) nogil except 1
+    cdef int set_low_water(VideoState self, AVStream *st, FFPacketQueue queue, int any_packet) nogil
+    cdef int wait_read_thread(VideoState self, int any_packet, uint32_t timeout) nogil except 1
+    cdef int skip_video_packet(VideoState self, AVPacket *pkt) nogil
+    cdef int stream_is_starving(self, AVStream *st, int stream_id, FFPacketQueue queue) nogil
     cdef int stream_has_enough_packets(self, AVStream *st, int stream_id, FFPacketQueue queue) nogil
     cdef inline int failed(VideoState self, int ret, AVFormatContext *ic, AVPacket **pkt) nogil except 1
     cdef int stream_select_program(VideoState self, int requested_program) nogil except 1
@@ -175,6 +248,13 @@ cdef class VideoState(object):
     cdef int decode_interrupt_cb(VideoState self) nogil
 
 
+cdef struct OutputSettings:
+    # the size and format of an additional video output, see ``set_size``
+    int width
+    int height
+    AVPixelFormat pix_fmt
+
+
 cdef struct VideoSettings:
     unsigned sws_flags
     int loglevel
@@ -186,6 +266,10 @@ cdef struct VideoSettings:
     uint8_t audio_volume
     int muted
     int audio_sdl
+    # the duration of the audio buffer of the buffer sink in seconds, and whether it
+    # is filled in real time rather than as it's read
+    double audio_buffer_duration
+    int audio_buffer_realtime
     int audio_disable
     int video_disable
     int subtitle_disable
@@ -203,6 +287,11 @@ cdef struct VideoSettings:
     int loop
     int framedrop
     int infinite_buffer
+    int unthrottled
+    # only decode keyframes, keep every nth frame, or at most target_fps frames a second
+    int keyframes_only
+    int every_nth
+    double target_fps
     char *audio_codec_name
     char *subtitle_codec_name
     char *video_codec_name
@@ -214,6 +303,21 @@ cdef struct VideoSettings:
     int autorotate
     int find_stream_info
     int filter_threads
+    int scale_threads
+    # the number of spans to trace, or zero
+    int trace_size
+
+    # the limits of the packet queues read ahead, and the depth of the frame queues
+    int max_queue_size
+    int min_frames
+    double min_queue_duration
+    int video_queue_size
+    int audio_queue_size
+    # the players of a pool with the lowest priority are throttled first
+    int priority
+    # the additional video outputs filtered from each frame
+    int nb_outputs
+    OutputSettings outputs[MAX_OUTPUTS]
 
     #/* current context */
     int64_t audio_callback_time
@@ -6,9 +6,10 @@ include "../includes/inline_funcs.pxi"
 
 from ffpyplayer.player.queue cimport FFPacketQueue
 from ffpyplayer.player.frame_queue cimport FrameQueue
-from ffpyplayer.threading cimport MTGenerator, MTThread, MTMutex, MTCond, Py_MT, SDL_MT
+from ffpyplayer.player.audio_buffer cimport AudioBuffer
+from ffpyplayer.threading cimport MTGenerator, MTThread, MTMutex, MTCond, Py_MT, SDL_MT, Native_MT
 from ffpyplayer.player.clock cimport Clock
-from ffpyplayer.pic cimport Image
+from ffpyplayer.pic cimport Image, decimator_init, decimator_reset, decimator_keep
 from cpython.ref cimport PyObject
 
 import ffpyplayer.tools  # for init
@@ -41,6 +42,7 @@ cdef extern from "math.h" nogil:
     double exp(double x)
     double log(double x)
     double floor(double x)
+    double ceil(double x)
     double round(double x)
 
 cdef extern from "errno.h" nogil:
@@ -54,6 +56,13 @@ cdef extern from "stdio.h" nogil:
 cdef extern from "stdlib.h" nogil:
     int atoi(const char *)
 
+cdef extern from "clib/mt_native.h" nogil:
+    int native_atomic_add(int *, int)
+    int64_t native_atomic_load64_acquire(int64_t *)
+    void native_atomic_store64_release(int64_t *, int64_t)
+    void native_atomic_fence_acquire()
+    void native_atomic_fence_release()
+
 cdef extern from "inttypes.h" nogil:
     const char *PRId64
     const char *PRIx64
@@ -81,7 +90,7 @@ cdef int *next_nb_channels = [0, 0, 1, 6, 2, 6, 4, 6]
 cdef int *next_sample_rates = [0, 44100, 48000, 96000, 192000]
 cdef int next_sample_rates_len = 5
 
-cdef MTMutex audio_mutex = MTMutex(SDL_MT)
+cdef MTMutex audio_mutex = MTMutex(Native_MT)
 cdef int audio_count = 0
 cdef SDL_AudioSpec spec_used
 
@@ -90,6 +99,20 @@ cdef void sdl_mixer_callback(int chan, uint8_t *stream, int len, VideoState self
     self.sdl_audio_callback(stream, len)
 
 
+cdef int log_source_error(AVIOSource source, int loglevel) except 1 with gil:
+    '''Logs and clears the exception raised by the file-like object the media
+    is read from, if any.
+    '''
+    cdef bytes msg
+    if source is None or source.error is None:
+        return 0
+    if loglevel >= AV_LOG_ERROR:
+        msg = str(source.error).encode('utf8')
+        av_log(NULL, AV_LOG_ERROR, b"Reading the source failed: %s\n", <const char *>msg)
+    source.error = None
+    return 0
+
+
 cdef int read_thread_enter(void *obj_id) except? 1 with gil:
     cdef VideoState vs = <VideoState>obj_id
     cdef bytes msg
@@ -150,6 +173,26 @@ cdef int audio_thread_enter(void *obj_id) except? 1 with gil:
         if IS_ANDROID:
             jnius.detach()
 
+cdef int audio_sink_thread_enter(void *obj_id) except? 1 with gil:
+    cdef VideoState vs = <VideoState>obj_id
+    cdef bytes msg
+    try:
+        with nogil:
+            return vs.audio_sink_thread()
+    except Exception as e:
+        msg = str(e).encode('utf8')
+        av_log(NULL, AV_LOG_FATAL, '%s', msg)
+        msg = traceback.format_exc().encode('utf8')
+        av_log(NULL, AV_LOG_FATAL, '%s', msg)
+        vs.request_thread_s('audio:error', e)
+        if vs.mt_gen.mt_src == Py_MT:
+            raise
+        else:
+            return 1
+    finally:
+        if IS_ANDROID:
+            jnius.detach()
+
 cdef int subtitle_thread_enter(void *obj_id) except? 1 with gil:
     cdef VideoState vs = <VideoState>obj_id
     cdef bytes msg
@@ -270,6 +313,25 @@ cdef double get_rotation(int32_t *displaymatrix) nogil:
 
     return theta
 
+cdef int insert_rotation(double theta, AVFilterGraph *graph, AVFilterContext **last_filter) nogil:
+    ''' Inserts the filters that rotate the video by ``theta`` degrees before
+    ``last_filter``.
+    '''
+    cdef char rotate_buf[64]
+    cdef int ret = 0
+    if fabs(theta - 90) < 1.0:
+        ret = insert_filt(b"transpose", b"clock", graph, last_filter)
+    elif fabs(theta - 180) < 1.0:
+        ret = insert_filt(b"hflip", NULL, graph, last_filter)
+        if ret >= 0:
+            ret = insert_filt(b"vflip", NULL, graph, last_filter)
+    elif fabs(theta - 270) < 1.0:
+        ret = insert_filt(b"transpose", b"cclock", graph, last_filter)
+    elif fabs(theta) > 1.0:
+        snprintf(rotate_buf, sizeof(rotate_buf), b"%f*PI/180", theta)
+        ret = insert_filt(b"rotate", rotate_buf, graph, last_filter)
+    return ret
+
 cdef bytes py_pat = bytes(b"%7.2f %s:%7.3f fd=%4d aq=%5dKB vq=%5dKB sq=%5dB f=%" + PRId64 + b"/%" + PRId64 + b"   \r")
 cdef char *py_pat_str = py_pat
 cdef bytes av_str = b"A-V", mv_str = b"M-V", ma_str = b"M-A", empty_str = b"   "
@@ -288,11 +350,11 @@ cdef class VideoState(object):
         self.metadata = {
             'src_vid_size': (0, 0), 'sink_vid_size': (0, 0), 'title': '',
             'duration': None, 'frame_rate': (0, 0), 'src_pix_fmt': '',
-            'aspect_ratio':(1, 1)}
+            'aspect_ratio':(1, 1), 'sink_sample_rate': 0, 'sink_channels': 0}
 
     cdef int cInit(self, MTGenerator mt_gen, VideoSettings *player, int paused,
                    AVPixelFormat out_fmt) nogil except 1:
-        cdef int i
+        cdef int i, pooled
         self.player = player
         self.vfilter_idx = 0
         self.pix_fmt = out_fmt
@@ -305,6 +367,10 @@ cdef class VideoState(object):
         self.iformat = player.file_iformat
         with gil:
             self.read_tid = None
+            self.audio_sink_tid = None
+            self.audio_buffer = None
+            if not player.audio_sdl:
+                self.audio_buffer = AudioBuffer.__new__(AudioBuffer, mt_gen)
             self.mt_gen = mt_gen
             self.audioq = FFPacketQueue.__new__(FFPacketQueue, mt_gen)
             self.subtitleq = FFPacketQueue.__new__(FFPacketQueue, mt_gen)
@@ -316,14 +382,15 @@ cdef class VideoState(object):
 
             self.pictq = FrameQueue.__new__(
                 FrameQueue, mt_gen, self.videoq,
-                VIDEO_PICTURE_QUEUE_SIZE, 1)
+                player.video_queue_size, 1)
             self.subpq = FrameQueue.__new__(
                 FrameQueue, mt_gen, self.subtitleq,
                 SUBPICTURE_QUEUE_SIZE, 0)
             self.sampq = FrameQueue.__new__(
                 FrameQueue, mt_gen, self.audioq,
-                SAMPLE_QUEUE_SIZE, 1)
+                player.audio_queue_size, 1)
             self.continue_read_thread = MTCond.__new__(MTCond, mt_gen.mt_src)
+            self.read_wake_req = 0
             self.pause_cond = MTCond.__new__(MTCond, mt_gen.mt_src)
 
             self.vidclk = Clock.__new__(Clock)
@@ -340,6 +407,22 @@ cdef class VideoState(object):
         if paused:
             self.toggle_pause()
 
+        with gil:
+            pooled = self.pool is not None
+        if pooled:
+            self.pool.add_member(&self.pool_member, player.priority)
+
+        self.trace = NULL
+        self.trace_windex = self.trace_rindex = 0
+        if player.trace_size:
+            self.trace_size = 1
+            while self.trace_size < player.trace_size:
+                self.trace_size <<= 1
+            self.trace = <TraceSpan *>av_mallocz(self.trace_size * sizeof(TraceSpan))
+            if self.trace == NULL:
+                with gil:
+                    raise MemoryError
+
         with gil:
             self.read_tid = MTThread.__new__(MTThread, mt_gen.mt_src)
             self.read_tid.create_thread(read_thread_enter, "read_thread", self.self_id)
@@ -348,6 +431,7 @@ cdef class VideoState(object):
     def __dealloc__(VideoState self):
         with nogil:
             self.cquit()
+            av_freep(&self.trace)
 
     cdef int cquit(VideoState self) nogil except 1:
         cdef int i
@@ -355,9 +439,12 @@ cdef class VideoState(object):
         if self.read_tid is None:
             return 0
         self.abort_request = 1
+        if self.audio_buffer is not None:
+            self.audio_buffer.abort()
         self.pause_cond.lock()
         self.pause_cond.cond_signal()
         self.pause_cond.unlock()
+        self.wake_read_thread()
         self.read_tid.wait_thread(NULL)
 
         with gil:
@@ -372,6 +459,8 @@ cdef class VideoState(object):
 
         avformat_close_input(&self.ic)
         self.ic = NULL
+        if self.pool_member.registered:
+            self.pool.remove_member(&self.pool_member)
 
         IF not CONFIG_AVFILTER:
             sws_freeContext(self.player.img_convert_ctx)
@@ -445,13 +534,54 @@ cdef class VideoState(object):
             val = self.extclk.get_clock()
         return val
 
+    cdef void trace_span(VideoState self, TraceKind kind, TraceThread thread, int64_t start,
+                         int stream, int serial, double pts) nogil:
+        ''' Records a span from start until now. Any thread may call it, the spans
+        go in a ring so the oldest are overwritten. Each span is a seqlock, see
+        :meth:`read_trace_span`. '''
+        cdef int64_t i = atomic_fetch_inc64(&self.trace_windex)
+        cdef TraceSpan *span = &self.trace[i & (self.trace_size - 1)]
+        native_atomic_store64_release(&span.seq, -1)
+        # the fields must not be written before the seq is invalidated
+        native_atomic_fence_release()
+        span.start = start
+        span.end = av_gettime_relative()
+        span.kind = kind
+        span.thread = thread
+        span.stream = stream
+        span.serial = serial
+        span.pts = pts
+        native_atomic_store64_release(&span.seq, i)
+
+    cdef int read_trace_span(VideoState self, int64_t i, TraceSpan *span) nogil:
+        ''' Copies the ith span into span. Returns 1 if it was copied, or 0 if it
+        is being written or was already overwritten by a later span. '''
+        cdef TraceSpan *src = &self.trace[i & (self.trace_size - 1)]
+        if native_atomic_load64_acquire(&src.seq) != i:
+            return 0
+        span[0] = src[0]
+        # a writer that started while copying changed the seq before the fields
+        native_atomic_fence_acquire()
+        return native_atomic_load64_acquire(&src.seq) == i
+
+    cdef double get_av_diff(VideoState self) nogil except? 0.0:
+        ''' The difference between the audio and video clocks, or between the
+        master clock and the only stream if there's just one. '''
+        if self.audio_st != NULL and self.video_st != NULL:
+            return self.audclk.get_clock() - self.vidclk.get_clock()
+        elif self.video_st != NULL:
+            return self.get_master_clock() - self.vidclk.get_clock()
+        elif self.audio_st != NULL:
+            return self.get_master_clock() - self.audclk.get_clock()
+        return 0
+
     cdef int check_external_clock_speed(VideoState self) nogil except 1:
         cdef double speed
-        if self.video_stream >= 0 and self.videoq.nb_packets <= EXTERNAL_CLOCK_MIN_FRAMES or\
-        self.audio_stream >= 0 and self.audioq.nb_packets <= EXTERNAL_CLOCK_MIN_FRAMES:
+        if self.video_stream >= 0 and self.videoq.packet_queue_nb_packets() <= EXTERNAL_CLOCK_MIN_FRAMES or\
+        self.audio_stream >= 0 and self.audioq.packet_queue_nb_packets() <= EXTERNAL_CLOCK_MIN_FRAMES:
             self.extclk.set_clock_speed(FFMAXD(EXTERNAL_CLOCK_SPEED_MIN, self.extclk.speed - EXTERNAL_CLOCK_SPEED_STEP))
-        elif (self.video_stream < 0 or self.videoq.nb_packets > EXTERNAL_CLOCK_MAX_FRAMES) and\
-        (self.audio_stream < 0 or self.audioq.nb_packets > EXTERNAL_CLOCK_MAX_FRAMES):
+        elif (self.video_stream < 0 or self.videoq.packet_queue_nb_packets() > EXTERNAL_CLOCK_MAX_FRAMES) and\
+        (self.audio_stream < 0 or self.audioq.packet_queue_nb_packets() > EXTERNAL_CLOCK_MAX_FRAMES):
             self.extclk.set_clock_speed(FFMIND(EXTERNAL_CLOCK_SPEED_MAX, self.extclk.speed + EXTERNAL_CLOCK_SPEED_STEP))
         else:
             speed = self.extclk.speed
@@ -475,9 +605,7 @@ cdef class VideoState(object):
             if seek_by_bytes:
                 self.seek_flags |= AVSEEK_FLAG_BYTE
             self.seek_req = 1
-            self.continue_read_thread.lock()
-            self.continue_read_thread.cond_signal()
-            self.continue_read_thread.unlock()
+            self.wake_read_thread()
             if flush:
                 while not self.pictq.is_empty():
                     self.pictq.frame_queue_next()
@@ -521,6 +649,9 @@ cdef class VideoState(object):
         self.pause_cond.lock()
         self.pause_cond.cond_signal()
         self.pause_cond.unlock()
+        self.wake_read_thread()
+        # wake up a get_frame blocked on the picture queue
+        self.pictq.frame_queue_signal()
         return 0
 
     cdef double compute_target_delay(VideoState self, double delay) nogil except? 0.0:
@@ -564,9 +695,13 @@ cdef class VideoState(object):
         self.extclk.sync_clock_to_slave(self.vidclk)
 
     cdef int video_refresh(VideoState self, Image next_image, double *pts, double *remaining_time,
-                           int force_refresh) nogil except -1:
+                           int force_refresh, AVFrame **outputs) nogil except -1:
         ''' Returns: 1 = paused, 2 = eof, 3 = no pic but remaining_time is set, 0 = valid image
+
+        If ``outputs`` is not NULL, it's set to new references of the frames of the
+        additional outputs of the displayed image.
         '''
+        cdef int i
         cdef Frame *vp
         cdef Frame *vp_temp
         cdef Frame *lastvp
@@ -584,7 +719,10 @@ cdef class VideoState(object):
         cdef char *m
         cdef int64_t m2, m3
         cdef int result = 3
+        cdef int64_t trace_start = 0
         remaining_time[0] = 0.
+        if self.trace != NULL:
+            trace_start = av_gettime_relative()
 
         self.pictq.alloc_picture()
         if self.paused and not force_refresh:
@@ -620,7 +758,7 @@ cdef class VideoState(object):
 
                         # compute nominal last_duration
                         last_duration = self.vp_duration(lastvp, vp)
-                        if redisplay:
+                        if redisplay or self.player.unthrottled:
                             delay = 0.0
                         else:
                             delay = self.compute_target_delay(last_duration)
@@ -638,7 +776,7 @@ cdef class VideoState(object):
                             self.update_video_pts(vp.pts, vp.pos, vp.serial)
                         self.pictq.cond.unlock()
 
-                        if self.pictq.frame_queue_nb_remaining() > 1:
+                        if self.pictq.frame_queue_nb_remaining() > 1 and not self.player.unthrottled:
                             nextvp = self.pictq.frame_queue_peek_next()
                             duration = self.vp_duration(vp, nextvp)
                             if (redisplay or self.player.framedrop > 0 or\
@@ -673,7 +811,18 @@ cdef class VideoState(object):
                         vp_temp = self.pictq.frame_queue_peek_last()
                         if next_image is not None:
                             next_image.cython_init(vp_temp.frame)
+                        if outputs != NULL:
+                            for i in range(self.player.nb_outputs):
+                                av_frame_unref(outputs[i])
+                                if i < vp_temp.nb_outputs and av_frame_ref(outputs[i], vp_temp.outputs[i]) < 0:
+                                    with gil:
+                                        raise MemoryError()
                         pts[0] = vp_temp.pts
+                        self.frames_displayed += 1
+                        if self.trace != NULL:
+                            self.trace_span(
+                                TRACE_REFRESH, TRACE_MAIN, trace_start, self.video_stream,
+                                vp_temp.serial, vp_temp.pts)
                         result = 0
                     self.pictq.frame_queue_next()
                 break
@@ -686,18 +835,12 @@ cdef class VideoState(object):
                 vqsize = 0
                 sqsize = 0
                 if self.audio_st != NULL:
-                    aqsize = self.audioq.size
+                    aqsize = self.audioq.packet_queue_size()
                 if self.video_st != NULL:
-                    vqsize = self.videoq.size
+                    vqsize = self.videoq.packet_queue_size()
                 if self.subtitle_st != NULL:
-                    sqsize = self.subtitleq.size
-                av_diff = 0
-                if self.audio_st != NULL and self.video_st != NULL:
-                    av_diff = self.audclk.get_clock() - self.vidclk.get_clock()
-                elif self.video_st != NULL:
-                    av_diff = self.get_master_clock() - self.vidclk.get_clock()
-                elif self.audio_st != NULL:
-                    av_diff = self.get_master_clock() - self.audclk.get_clock()
+                    sqsize = self.subtitleq.packet_queue_size()
+                av_diff = self.get_av_diff()
 
                 m = (str_av if self.audio_st != NULL and self.video_st != NULL else\
                 (str_mv if self.video_st != NULL else (str_ma if self.audio_st != NULL else str_empty)))
@@ -719,6 +862,26 @@ cdef class VideoState(object):
                 self.last_time = cur_time
         return result
 
+    cdef int wait_for_frame(VideoState self, double timeout, int frame_pending) nogil except 1:
+        ''' Waits up to timeout seconds, or until a new frame is pushed to the picture
+        queue, the player is paused, or eof is reached. If frame_pending, a frame
+        is already in the queue and we only wait until it's due (the timeout).
+        '''
+        cdef uint32_t ms = <uint32_t>ceil(FFMAXD(timeout, 0.) * 1000.)
+        if not ms:
+            return 0
+
+        self.pictq.cond.lock()
+        # so a push wakes us, see FrameQueue.wake_waiting
+        native_atomic_add(&self.pictq.waiting, 1)
+        if not self.pictq.pktq.abort_request and (frame_pending or (
+                not self.paused and not self.reached_eof and
+                not self.pictq.frame_queue_nb_remaining())):
+            self.pictq.cond.cond_wait_timeout(ms)
+        native_atomic_add(&self.pictq.waiting, -1)
+        self.pictq.cond.unlock()
+        return 0
+
     cdef int get_video_frame(VideoState self, AVFrame *frame) nogil except 2:
         cdef int got_picture = self.viddec.decoder_decode_frame(frame, NULL, self.player.decoder_reorder_pts)
         cdef double dpts = NAN, diff
@@ -739,6 +902,15 @@ cdef class VideoState(object):
                     av_frame_unref(frame)
                     return 0
 
+            # drop the frames not selected before they are filtered or converted
+            if self.decimator_serial != self.viddec.pkt_serial:
+                decimator_reset(&self.decimator)
+                self.decimator_serial = self.viddec.pkt_serial
+            if not decimator_keep(&self.decimator, dpts):
+                self.frames_skipped += 1
+                av_frame_unref(frame)
+                return 0
+
             if self.player.framedrop > 0 or (self.player.framedrop and\
             self.get_master_sync_type() != AV_SYNC_VIDEO_MASTER):
                 if frame.pts != AV_NOPTS_VALUE:
@@ -747,7 +919,7 @@ cdef class VideoState(object):
                     fabs(diff) < AV_NOSYNC_THRESHOLD and\
                     diff - self.frame_last_filter_delay < 0 and\
                     self.viddec.pkt_serial == self.vidclk.serial and\
-                    self.videoq.nb_packets:
+                    self.videoq.packet_queue_nb_packets():
                         self.frame_drops_early += 1
                         av_frame_unref(frame)
                         got_picture = 0
@@ -810,12 +982,18 @@ cdef class VideoState(object):
             cdef AVFilterContext *filt_out = NULL
             cdef AVFilterContext *last_filter = NULL
             cdef AVFilterContext *filt_scale = NULL
+            cdef AVFilterContext *filt_split = NULL
+            cdef AVFilterContext *filt_main = NULL
+            cdef AVFilterContext *filt_sink = NULL
             cdef AVCodecParameters *codecpar = self.video_st.codecpar
             cdef AVRational fr = av_guess_frame_rate(self.ic, self.video_st, NULL)
             cdef AVPixelFormat *pix_fmts = [pix_fmt, AV_PIX_FMT_NONE]
+            cdef AVPixelFormat out_pix_fmts[2]
+            cdef OutputSettings *output
+            cdef char name_buf[64]
+            cdef int i
             cdef double rot
             cdef double theta = 0
-            cdef char rotate_buf[64]
             cdef const AVDictionaryEntry *e = NULL
             cdef AVFrameSideData *sd = NULL
             memset(str_flags, 0, sizeof(str_flags))
@@ -873,17 +1051,11 @@ cdef class VideoState(object):
                 if displaymatrix == NULL:
                     displaymatrix = <int32_t *>av_stream_get_side_data(self.video_st, AV_PKT_DATA_DISPLAYMATRIX, NULL)
                 theta = get_rotation(displaymatrix)
-                if fabs(theta - 90) < 1.0:
-                    insert_filt(b"transpose", b"clock", graph, &last_filter)
-                elif fabs(theta - 180) < 1.0:
-                    insert_filt(b"hflip", NULL, graph, &last_filter)
-                    insert_filt(b"vflip", NULL, graph, &last_filter)
-                elif fabs(theta - 270) < 1.0:
-                    insert_filt(b"transpose", b"cclock", graph, &last_filter)
-                elif fabs(theta) > 1.0:
-                    snprintf(rotate_buf, sizeof(rotate_buf), b"%f*PI/180", theta)
-                    insert_filt(b"rotate", rotate_buf, graph, &last_filter)
+                ret = insert_rotation(theta, graph, &last_filter)
+                if ret < 0:
+                    return ret
 
+            filt_main = last_filter
             if self.player.screen_height or self.player.screen_width:
                 snprintf(scale_args, sizeof(scale_args), b"%d:%d", self.player.screen_width,
                          self.player.screen_height)
@@ -896,15 +1068,54 @@ cdef class VideoState(object):
                 ret = avfilter_link(filt_scale, 0, last_filter, 0)
                 if ret < 0:
                     return ret
-                # this needs to be here in case user provided filter at the input
-                ret = self.configure_filtergraph(graph, vfilters, filt_src, filt_scale)
+                filt_main = filt_scale
+
+            # the user filters are split to the main and the additional outputs,
+            # each with its own scale and format
+            if self.player.nb_outputs:
+                snprintf(scale_args, sizeof(scale_args), b"%d", self.player.nb_outputs + 1)
+                ret = avfilter_graph_create_filter(&filt_split, avfilter_get_by_name(b"split"),
+                                                   b"ffpyplayer_split", scale_args, NULL, graph)
                 if ret < 0:
                     return ret
-            else:
-                ret = self.configure_filtergraph(graph, vfilters, filt_src, last_filter)
+                ret = avfilter_link(filt_split, 0, filt_main, 0)
                 if ret < 0:
                     return ret
 
+                for i in range(self.player.nb_outputs):
+                    output = &self.player.outputs[i]
+                    snprintf(name_buf, sizeof(name_buf), b"ffpyplayer_buffersink_%d", i)
+                    ret = avfilter_graph_create_filter(&filt_sink, avfilter_get_by_name(b"buffersink"),
+                                                       name_buf, NULL, NULL, graph)
+                    if ret < 0:
+                        return ret
+                    out_pix_fmts[0] = output.pix_fmt
+                    out_pix_fmts[1] = AV_PIX_FMT_NONE
+                    ret = av_opt_set_int_list(filt_sink, b"pix_fmts", out_pix_fmts,
+                                              sizeof(out_pix_fmts[0]), AV_PIX_FMT_NONE, AV_OPT_SEARCH_CHILDREN)
+                    if ret < 0:
+                        return ret
+                    self.output_filters[i] = filt_sink
+
+                    last_filter = filt_sink
+                    ret = insert_rotation(theta, graph, &last_filter)
+                    if ret < 0:
+                        return ret
+                    if output.width or output.height:
+                        snprintf(scale_args, sizeof(scale_args), b"%d:%d", output.width, output.height)
+                        ret = insert_filt(b"scale", scale_args, graph, &last_filter)
+                        if ret < 0:
+                            return ret
+                    ret = avfilter_link(filt_split, i + 1, last_filter, 0)
+                    if ret < 0:
+                        return ret
+                filt_main = filt_split
+
+            # this needs to be here in case user provided filter at the input
+            ret = self.configure_filtergraph(graph, vfilters, filt_src, filt_main)
+            if ret < 0:
+                return ret
+
             self.in_video_filter  = filt_src
             self.out_video_filter = filt_out
             return ret
@@ -983,6 +1194,7 @@ cdef class VideoState(object):
         cdef AVFrame *frame = av_frame_alloc()
         cdef Frame *af
         cdef int got_frame = 0
+        cdef int64_t ts = 0
         cdef AVRational tb
         cdef int ret = 0
         cdef char err_msg[256]
@@ -1002,10 +1214,16 @@ cdef class VideoState(object):
 
         while True:
             ret = 0
+            if self.trace != NULL:
+                ts = av_gettime_relative()
             got_frame = self.auddec.decoder_decode_frame(frame, NULL, self.player.decoder_reorder_pts)
             if got_frame < 0:
                 ret = -1
                 break
+            if got_frame and self.trace != NULL:
+                self.trace_span(
+                    TRACE_DECODE, TRACE_AUDIO, ts, self.audio_stream, self.auddec.pkt_serial,
+                    frame.pts / <double>frame.sample_rate if frame.pts != AV_NOPTS_VALUE else NAN)
 
             if got_frame:
                 tb.num = 1
@@ -1120,6 +1338,7 @@ cdef class VideoState(object):
         cdef AVRational sar
         cdef char err_msg[256]
         cdef AVPixelFormat last_out_fmt = self.pix_fmt
+        cdef int64_t ts = 0
         IF CONFIG_AVFILTER:
             cdef AVFilterGraph *graph = NULL
             cdef AVFilterContext *filt_out = NULL
@@ -1131,8 +1350,22 @@ cdef class VideoState(object):
             cdef AVPixelFormat last_out_fmt_temp
             cdef int last_serial = -1
             cdef int last_vfilter_idx = self.vfilter_idx
+            # the frames of the additional outputs
+            cdef AVFrame *outputs[MAX_OUTPUTS]
+            cdef int i, nb_outputs = 0
+
+        IF CONFIG_AVFILTER:
+            memset(outputs, 0, sizeof(outputs))
+            for i in range(self.player.nb_outputs):
+                outputs[i] = av_frame_alloc()
+                if outputs[i] == NULL:
+                    av_frame_free(&frame)
+                    break
 
         if frame == NULL:
+            IF CONFIG_AVFILTER:
+                for i in range(self.player.nb_outputs):
+                    av_frame_free(&outputs[i])
             if self.player.loglevel >= AV_LOG_ERROR:
                 av_log(NULL, AV_LOG_ERROR, b'Memory Error in video thread\n')
             self.request_thread_s(b'video:error', fmt_err(AVERROR(ENOMEM), err_msg, sizeof(err_msg)))
@@ -1140,11 +1373,17 @@ cdef class VideoState(object):
 
         while 1:
             av_frame_unref(frame)
+            if self.trace != NULL:
+                ts = av_gettime_relative()
             ret = self.get_video_frame(frame)
             if ret < 0:
                 break
             if not ret:
                 continue
+            if self.trace != NULL:
+                self.trace_span(
+                    TRACE_DECODE, TRACE_VIDEO, ts, self.video_stream, self.viddec.pkt_serial,
+                    frame.pts * av_q2d(tb) if frame.pts != AV_NOPTS_VALUE else NAN)
 
             IF CONFIG_AVFILTER:
                 last_out_fmt_temp = self.pix_fmt
@@ -1194,6 +1433,8 @@ cdef class VideoState(object):
                         self.metadata['aspect_ratio'] = (sar.num, sar.den)
                         self.metadata['frame_rate'] = (frame_rate.num, frame_rate.den)
 
+                if self.trace != NULL:
+                    ts = av_gettime_relative()
                 ret = av_buffersrc_add_frame(filt_in, frame)
                 if ret < 0:
                     break
@@ -1207,6 +1448,15 @@ cdef class VideoState(object):
                         ret = 0
                         break
 
+                    # split passes each frame to all the outputs, so they have
+                    # the frames with the same pts
+                    nb_outputs = 0
+                    while nb_outputs < self.player.nb_outputs:
+                        if av_buffersink_get_frame_flags(
+                                self.output_filters[nb_outputs], outputs[nb_outputs], 0) < 0:
+                            break
+                        nb_outputs += 1
+
                     self.frame_last_filter_delay = av_gettime_relative() / 1000000.0 - self.frame_last_returned_time
                     if fabs(self.frame_last_filter_delay) > AV_NOSYNC_THRESHOLD / 10.0:
                         self.frame_last_filter_delay = 0
@@ -1221,8 +1471,23 @@ cdef class VideoState(object):
                         pts = NAN
                     else:
                         pts = frame.pts * av_q2d(tb)
+                    if self.trace != NULL:
+                        # from pushing the frame until it came out of the graph
+                        self.trace_span(
+                            TRACE_FILTER, TRACE_VIDEO, ts, self.video_stream,
+                            self.viddec.pkt_serial, pts)
+                        ts = av_gettime_relative()
                     ret = self.pictq.queue_picture(frame, pts, duration, frame.pkt_pos,
-                                             self.viddec.pkt_serial, last_out_fmt, &self.abort_request, self.player)
+                                             self.viddec.pkt_serial, last_out_fmt, &self.abort_request,
+                                             self.player, outputs, nb_outputs)
+                    # in case it wasn't queued
+                    for i in range(nb_outputs):
+                        av_frame_unref(outputs[i])
+                    if self.trace != NULL:
+                        self.trace_span(
+                            TRACE_QUEUE, TRACE_VIDEO, ts, self.video_stream,
+                            self.viddec.pkt_serial, pts)
+                        ts = av_gettime_relative()
                     #av_frame_unref(frame)
                     if self.videoq.serial != self.viddec.pkt_serial:
                         break
@@ -1241,9 +1506,15 @@ cdef class VideoState(object):
                     self.metadata['src_vid_size'] = (frame.width, frame.height)
                     self.metadata['aspect_ratio'] = (sar.num, sar.den)
                     self.metadata['frame_rate'] = (frame_rate.num, frame_rate.den)
+                if self.trace != NULL:
+                    ts = av_gettime_relative()
                 ret = self.pictq.queue_picture(frame, pts, duration, frame.pkt_pos,
                                          self.viddec.pkt_serial, last_out_fmt, &self.abort_request,
-                                         self.player)
+                                         self.player, NULL, 0)
+                if self.trace != NULL:
+                    self.trace_span(
+                        TRACE_QUEUE, TRACE_VIDEO, ts, self.video_stream,
+                        self.viddec.pkt_serial, pts)
                 #av_frame_unref(frame)
 
             if ret < 0:
@@ -1251,6 +1522,8 @@ cdef class VideoState(object):
 
         IF CONFIG_AVFILTER:
             avfilter_graph_free(&graph)
+            for i in range(self.player.nb_outputs):
+                av_frame_free(&outputs[i])
         av_frame_free(&frame)
 
         if ret and not self.videoq.abort_request:
@@ -1523,10 +1796,9 @@ cdef class VideoState(object):
                 return -1
         return resampled_data_size
 
-    # prepare a new audio buffer
-    cdef int sdl_audio_callback(VideoState self, uint8_t *stream, int len) nogil except 1:
+    # fill stream with len bytes of the audio output, or silence if there's none
+    cdef int fill_audio_buffer(VideoState self, uint8_t *stream, int len) nogil except 1:
         cdef int audio_size, len1
-        self.player.audio_callback_time = av_gettime_relative()
 
         memset(stream, 0, len)
         while len > 0:
@@ -1546,7 +1818,7 @@ cdef class VideoState(object):
             if len1 > len:
                 len1 = len
 
-            if USE_SDL2_MIXER:
+            if USE_SDL2_MIXER and self.player.audio_sdl:
                 if self.audio_buf:
                     memcpy(stream, <uint8_t *>self.audio_buf + self.audio_buf_index, len1)
             elif not self.player.muted and self.player.audio_volume == SDL_MIX_MAXVOLUME:
@@ -1565,6 +1837,12 @@ cdef class VideoState(object):
             self.audio_buf_index += len1
 
         self.audio_write_buf_size = self.audio_buf_size - self.audio_buf_index
+        return 0
+
+    # prepare a new audio buffer
+    cdef int sdl_audio_callback(VideoState self, uint8_t *stream, int len) nogil except 1:
+        self.player.audio_callback_time = av_gettime_relative()
+        self.fill_audio_buffer(stream, len)
         # Let's assume the audio driver that is used by SDL has two periods.
         if not isnan(self.audio_clock):
             self.audclk.set_clock_at(
@@ -1573,12 +1851,80 @@ cdef class VideoState(object):
             self.extclk.sync_clock_to_slave(self.audclk)
         return 0
 
+    cdef int audio_sink_thread(VideoState self) nogil except 1:
+        '''Writes the audio output into the audio buffer in place of an SDL device.
+
+        By default, a period is only pulled when there's room for it in the buffer,
+        so decoding is paced by the reader and the audio clock is set as the samples
+        are read in :meth:`read_audio`. With audio_buffer_realtime, a period is
+        pulled every period like a device would, the oldest unread samples are
+        overwritten, and the clock is set as they are pulled.
+        '''
+        cdef int size = self.audio_hw_buf_size
+        cdef int realtime = self.player.audio_buffer_realtime
+        cdef double period = <double>size / self.audio_tgt.bytes_per_sec
+        cdef double next_time = av_gettime_relative() / 1000000.0
+        cdef double time, end_pts
+        cdef uint8_t *buf = <uint8_t *>av_malloc(size)
+        if buf == NULL:
+            with gil:
+                raise MemoryError
+
+        while not self.audio_buffer.abort_request:
+            if realtime:
+                time = av_gettime_relative() / 1000000.0
+                if next_time > time:
+                    av_usleep(<unsigned>((next_time - time) * 1000000.0))
+                    continue
+                # don't pull a burst of periods to catch up after falling behind
+                next_time = FFMAXD(next_time, time - period) + period
+            elif self.audio_buffer.wait_space(size, 10) < size:
+                continue
+
+            if self.paused:
+                if not realtime:
+                    av_usleep(10000)
+                continue
+
+            self.player.audio_callback_time = av_gettime_relative()
+            self.fill_audio_buffer(buf, size)
+            end_pts = self.audio_clock - <double>self.audio_write_buf_size / self.audio_tgt.bytes_per_sec
+            self.audio_buffer.write(buf, size, end_pts, self.audio_clock_serial, realtime)
+            if realtime and not isnan(end_pts):
+                # the period just written is the one playing now
+                self.audclk.set_clock_at(
+                    end_pts - period, self.audio_clock_serial,
+                    self.player.audio_callback_time / 1000000.0)
+                self.extclk.sync_clock_to_slave(self.audclk)
+
+        av_freep(&buf)
+        return 0
+
+    cdef int64_t read_audio(VideoState self, uint8_t *dst, int64_t n, double *pts) nogil except -1:
+        '''Reads up to ``n`` bytes from the audio buffer into ``dst``, setting ``pts``
+        to the time of the first sample. Unless the buffer is filled in real time,
+        the audio clock is set to it, because those samples are now being played.
+        '''
+        cdef double end_pts
+        cdef int serial
+        n = self.audio_buffer.read(dst, n, pts, &end_pts, &serial)
+        if n and not self.player.audio_buffer_realtime and not isnan(pts[0]):
+            self.audclk.set_clock_at(pts[0], serial, av_gettime_relative() / 1000000.0)
+            self.extclk.sync_clock_to_slave(self.audclk)
+        return n
+
     cdef inline int open_audio_device(VideoState self, SDL_AudioSpec *wanted_spec,
                                       SDL_AudioSpec *spec) nogil except 1:
         cdef int error = 0
         cdef int channels
         global audio_count, spec_used
 
+        if not self.player.audio_sdl:
+            # the buffer sink accepts any rate and channels
+            memcpy(spec, wanted_spec, sizeof(spec_used))
+            spec.size = spec.samples * 2 * spec.channels
+            return 0
+
         IF USE_SDL2_MIXER:
             self.audio_count = -1
             audio_mutex.lock()
@@ -1724,6 +2070,8 @@ cdef class VideoState(object):
         cdef int64_t channel_layout
         cdef int ret = 0
         cdef int stream_lowres = self.player.lowres
+        cdef int pooled
+        cdef int pool_threads = 0
         cdef AVFilterContext *sink
         if stream_index < 0 or stream_index >= ic.nb_streams:
             return -1
@@ -1767,17 +2115,32 @@ cdef class VideoState(object):
                     codec.max_lowres)
             stream_lowres = codec.max_lowres
         avctx.lowres =  stream_lowres
+        if avctx.codec_type == AVMEDIA_TYPE_VIDEO:
+            if self.player.keyframes_only:
+                avctx.skip_frame = AVDISCARD_NONKEY
+            decimator_init(&self.decimator, self.player.every_nth, self.player.target_fps)
+            self.decimator_serial = -1
 
         if self.player.fast:
             avctx.flags2 |= AV_CODEC_FLAG2_FAST
 
         opts = filter_codec_opts(self.player.codec_opts, avctx.codec_id, ic,
                                  ic.streams[stream_index], codec)
+        with gil:
+            pooled = self.pool is not None
         if av_dict_get(opts, b"threads", NULL, 0) == NULL:
-            av_dict_set(&opts, b"threads", b"auto", 0)
+            if pooled:
+                pool_threads = self.pool.add_stream(1)
+                av_dict_set_int(&opts, b"threads", pool_threads, 0)
+            else:
+                av_dict_set(&opts, b"threads", b"auto", 0)
+        elif pooled:
+            self.pool.add_stream(0)
         if stream_lowres:
             av_dict_set_int(&opts, b"lowres", stream_lowres, 0)
         if avcodec_open2(avctx, codec, &opts) < 0:
+            if pooled:
+                self.pool.remove_stream(pool_threads)
             avcodec_free_context(&avctx)
             av_dict_free(&opts)
             return -1
@@ -1785,6 +2148,8 @@ cdef class VideoState(object):
         if t != NULL:
             if self.player.loglevel >= AV_LOG_ERROR:
                 av_log(NULL, AV_LOG_ERROR, b"Option %s not found.\n", t.key)
+            if pooled:
+                self.pool.remove_stream(pool_threads)
             avcodec_free_context(&avctx)
             av_dict_free(&opts)
             return AVERROR_OPTION_NOT_FOUND
@@ -1798,6 +2163,8 @@ cdef class VideoState(object):
                 self.audio_filter_src.fmt            = avctx.sample_fmt
                 ret = self.configure_audio_filters(self.player.afilters, 0)
                 if ret < 0:
+                    if pooled:
+                        self.pool.remove_stream(pool_threads)
                     avcodec_free_context(&avctx)
                     av_dict_free(&opts)
                     return ret
@@ -1813,6 +2180,8 @@ cdef class VideoState(object):
             # prepare audio output
             ret = self.audio_open(channel_layout, nb_channels, sample_rate, &self.audio_tgt)
             if ret < 0:
+                if pooled:
+                    self.pool.remove_stream(pool_threads)
                 avcodec_free_context(&avctx)
                 av_dict_free(&opts)
                 return ret
@@ -1831,31 +2200,52 @@ cdef class VideoState(object):
             self.audio_stream = stream_index
             self.audio_st = ic.streams[stream_index]
 
-            self.auddec.decoder_init(self.mt_gen, avctx, self.audioq, self.continue_read_thread)
+            self.auddec.decoder_init(
+                self.mt_gen, avctx, self.audioq, self.continue_read_thread, self.sampq, self.pool,
+                pool_threads)
             if ((self.ic.iformat.flags & (AVFMT_NOBINSEARCH | AVFMT_NOGENSEARCH | AVFMT_NO_BYTE_SEEK)) and
                 not self.ic.iformat.read_seek):
                 self.auddec.start_pts = self.audio_st.start_time
                 self.auddec.start_pts_tb = self.audio_st.time_base
             self.auddec.decoder_start(audio_thread_enter, "audio_decoder", self.self_id)
-            IF USE_SDL2_MIXER:
-                Mix_Resume(self.audio_dev)
-            ELSE:
-                SDL_PauseAudioDevice(<SDL_AudioDeviceID>self.audio_dev, 0)
+            with gil:
+                self.metadata['sink_sample_rate'] = self.audio_tgt.freq
+                self.metadata['sink_channels'] = self.audio_tgt.channels
+            if not self.player.audio_sdl:
+                self.audio_buffer.configure(
+                    max(<int64_t>(self.player.audio_buffer_duration * self.audio_tgt.bytes_per_sec),
+                        2 * self.audio_hw_buf_size),
+                    self.audio_tgt.frame_size, self.audio_tgt.bytes_per_sec)
+                with gil:
+                    self.audio_sink_tid = MTThread(self.mt_gen.mt_src)
+                    self.audio_sink_tid.create_thread(
+                        audio_sink_thread_enter, "audio_sink", self.self_id)
+            else:
+                IF USE_SDL2_MIXER:
+                    Mix_Resume(self.audio_dev)
+                ELSE:
+                    SDL_PauseAudioDevice(<SDL_AudioDeviceID>self.audio_dev, 0)
         elif avctx.codec_type ==  AVMEDIA_TYPE_VIDEO:
             with gil:
                 self.metadata['src_pix_fmt'] = <const char *>av_x_if_null(av_get_pix_fmt_name(avctx.pix_fmt), b"none")
             self.video_stream = stream_index
             self.video_st = ic.streams[stream_index]
-            self.viddec.decoder_init(self.mt_gen, avctx, self.videoq, self.continue_read_thread)
+            self.viddec.decoder_init(
+                self.mt_gen, avctx, self.videoq, self.continue_read_thread, self.pictq, self.pool,
+                pool_threads)
 
             self.viddec.decoder_start(video_thread_enter, "video_decoder", self.self_id)
             self.queue_attachments_req = 1
         elif avctx.codec_type ==  AVMEDIA_TYPE_SUBTITLE:
             self.subtitle_stream = stream_index
             self.subtitle_st = ic.streams[stream_index]
-            self.subdec.decoder_init(self.mt_gen, avctx, self.subtitleq, self.continue_read_thread)
+            self.subdec.decoder_init(
+                self.mt_gen, avctx, self.subtitleq, self.continue_read_thread, self.subpq, self.pool,
+                pool_threads)
             self.subdec.decoder_start(subtitle_thread_enter, "subtitle_decoder", self.self_id)
         av_dict_free(&opts)
+        # so the read thread fills the new queue
+        self.wake_read_thread()
         return 0
 
     cdef int stream_component_close(VideoState self, int stream_index) nogil except 1:
@@ -1868,21 +2258,28 @@ cdef class VideoState(object):
 
         if codecpar.codec_type == AVMEDIA_TYPE_AUDIO:
             self.auddec.decoder_abort(self.sampq)
-            IF USE_SDL2_MIXER:
-                Mix_UnregisterEffect(self.audio_dev, <void (*)(int, void *, int, void *) noexcept nogil>sdl_mixer_callback)
-                Mix_HaltChannel(self.audio_dev)
-                Mix_FreeChunk(self.chunk)
-                self.chunk = NULL
-
-                audio_mutex.lock()
-                if self.audio_count != -1:
-                    audio_count -= 1
-                self.audio_count = -1
-                if not audio_count:
-                    Mix_CloseAudio()
-                audio_mutex.unlock()
-            ELSE:
-                SDL_CloseAudioDevice(<SDL_AudioDeviceID>self.audio_dev)
+            if not self.player.audio_sdl:
+                self.audio_buffer.abort()
+                if self.audio_sink_tid is not None:
+                    self.audio_sink_tid.wait_thread(NULL)
+                    with gil:
+                        self.audio_sink_tid = None
+            else:
+                IF USE_SDL2_MIXER:
+                    Mix_UnregisterEffect(self.audio_dev, <void (*)(int, void *, int, void *) noexcept nogil>sdl_mixer_callback)
+                    Mix_HaltChannel(self.audio_dev)
+                    Mix_FreeChunk(self.chunk)
+                    self.chunk = NULL
+
+                    audio_mutex.lock()
+                    if self.audio_count != -1:
+                        audio_count -= 1
+                    self.audio_count = -1
+                    if not audio_count:
+                        Mix_CloseAudio()
+                    audio_mutex.unlock()
+                ELSE:
+                    SDL_CloseAudioDevice(<SDL_AudioDeviceID>self.audio_dev)
 
             self.auddec.decoder_destroy()
             swr_free(&self.swr_ctx)
@@ -1906,6 +2303,7 @@ cdef class VideoState(object):
         elif codecpar.codec_type == AVMEDIA_TYPE_SUBTITLE:
             self.subtitle_st = NULL
             self.subtitle_stream = -1
+        self.wake_read_thread()
         return 0
 
     # this thread gets the stream from the disk or the network
@@ -1924,6 +2322,8 @@ cdef class VideoState(object):
         cdef char err_msg[256]
         cdef int64_t timestamp
         cdef int temp
+        cdef int queue_size, throttled
+        cdef int64_t ts = 0
         cdef int64_t seek_target, seek_min, seek_max
         cdef int64_t temp64, temp64_2
         cdef AVStream *st
@@ -1944,6 +2344,9 @@ cdef class VideoState(object):
         #av_opt_set_int(ic, b"threads", 1, 0)
         ic.interrupt_callback.callback = <int (*)(void *) noexcept>self.decode_interrupt_cb
         ic.interrupt_callback.opaque = self.self_id
+        with gil:
+            if self.source is not None:
+                self.source.attach(ic)
 
         if not av_dict_get(self.player.format_opts, b"scan_all_pmts", NULL, AV_DICT_MATCH_CASE):
             av_dict_set(&self.player.format_opts, b"scan_all_pmts", b"1", AV_DICT_DONT_OVERWRITE)
@@ -1953,6 +2356,7 @@ cdef class VideoState(object):
         if err < 0:
             if self.player.loglevel >= AV_LOG_ERROR:
                 av_log(NULL, AV_LOG_ERROR, b"%s: %s\n", self.player.input_filename, fmt_err(err, err_msg, sizeof(err_msg)))
+            log_source_error(self.source, self.player.loglevel)
             return self.failed(-1, ic, &pkt)
 
         if scan_all_pmts_set:
@@ -2136,16 +2540,26 @@ cdef class VideoState(object):
                     self.videoq.packet_queue_put(pkt)
                     self.videoq.packet_queue_put_nullpacket(pkt, self.video_stream)
                 self.queue_attachments_req = 0
-            # if the queue are full, no need to read more
+            # if the queue are full, or the pool is over budget, no need to read more
+            queue_size = (self.audioq.packet_queue_size() + self.videoq.packet_queue_size() +
+                          self.subtitleq.packet_queue_size())
+            throttled = 0
+            if self.pool_member.registered:
+                throttled = self.pool.update_memory(
+                    &self.pool_member, queue_size,
+                    self.stream_is_starving(self.audio_st, self.audio_stream, self.audioq) or
+                    self.stream_is_starving(self.video_st, self.video_stream, self.videoq) or
+                    self.stream_is_starving(self.subtitle_st, self.subtitle_stream, self.subtitleq))
             if self.player.infinite_buffer < 1 and \
-                (self.audioq.size + self.videoq.size + self.subtitleq.size > MAX_QUEUE_SIZE or
+                (queue_size > self.player.max_queue_size or throttled or
                 (self.stream_has_enough_packets(self.audio_st, self.audio_stream, self.audioq) and
                 self.stream_has_enough_packets(self.video_st, self.video_stream, self.videoq) and
                 self.stream_has_enough_packets(self.subtitle_st, self.subtitle_stream, self.subtitleq))):
-                # wait 10 ms
-                self.continue_read_thread.lock()
-                self.continue_read_thread.cond_wait_timeout(10)
-                self.continue_read_thread.unlock()
+                # wait until a decoder drains its queue, or for any packet to be
+                # taken if we're over the size or memory budget
+                self.wait_read_thread(
+                    queue_size > self.player.max_queue_size or throttled,
+                    READ_THREAD_TIMEOUT)
                 continue
 
             if (not self.paused) and (
@@ -2175,9 +2589,18 @@ cdef class VideoState(object):
                 else:
                     if not self.reached_eof:
                         self.reached_eof = 1
+                        self.pictq.frame_queue_signal()
                         self.request_thread_s(b'eof', b'')
 
+            if self.trace != NULL:
+                ts = av_gettime_relative()
             ret = av_read_frame(ic, pkt)
+            if ret >= 0 and self.trace != NULL:
+                pkt_ts = pkt.dts if pkt.pts == AV_NOPTS_VALUE else pkt.pts
+                self.trace_span(
+                    TRACE_DEMUX, TRACE_READ, ts, pkt.stream_index, -1,
+                    pkt_ts * av_q2d(ic.streams[pkt.stream_index].time_base)
+                    if pkt_ts != AV_NOPTS_VALUE else NAN)
             if ret < 0:
                 if (ret == AVERROR_EOF or avio_feof(ic.pb)) and not self.eof:
                     self.auddec.set_seek_pos(-1)
@@ -2195,12 +2618,22 @@ cdef class VideoState(object):
                             av_log(NULL, AV_LOG_INFO, b"Reached eof\n")
                         self.request_thread_s(b'eof', b'')
                     break
-                self.continue_read_thread.lock()
-                self.continue_read_thread.cond_wait_timeout(10)
-                self.continue_read_thread.unlock()
+                # at the end, once eof was handled, or while paused only a seek,
+                # stream change, or resuming gives us more to do. Otherwise, poll
+                # until the demuxer or the decoders are ready
+                if self.eof and (self.reached_eof or self.paused):
+                    self.wait_read_thread(0, READ_THREAD_TIMEOUT)
+                else:
+                    self.continue_read_thread.lock()
+                    if not self.read_wake_req:
+                        self.continue_read_thread.cond_wait_timeout(READ_THREAD_POLL)
+                    self.read_wake_req = 0
+                    self.continue_read_thread.unlock()
                 continue
             else:
                 self.eof = 0
+                self.packets_read += 1
+                self.bytes_read += pkt.size
 
             # check if packet is in play range specified by user, then queue, otherwise discard
             stream_start_time = ic.streams[pkt.stream_index].start_time
@@ -2221,7 +2654,11 @@ cdef class VideoState(object):
                 self.audioq.packet_queue_put(pkt)
             elif (pkt.stream_index == self.video_stream and pkt_in_play_range
                   and not (self.video_st.disposition & AV_DISPOSITION_ATTACHED_PIC)):
-                self.videoq.packet_queue_put(pkt)
+                if self.skip_video_packet(pkt):
+                    self.packets_skipped += 1
+                    av_packet_unref(pkt)
+                else:
+                    self.videoq.packet_queue_put(pkt)
             elif pkt.stream_index == self.subtitle_stream and pkt_in_play_range:
                 self.subtitleq.packet_queue_put(pkt)
             else:
@@ -2232,13 +2669,89 @@ cdef class VideoState(object):
             av_log(NULL, AV_LOG_INFO, b"Exiting read thread\n")
         return self.failed(ret, ic, &pkt)
 
+    cdef int wake_read_thread(VideoState self) nogil except 1:
+        '''Wakes the read thread if it's waiting, or makes its next wait return
+        immediately, so it handles e.g. a seek, pause, or stream change.
+        '''
+        self.continue_read_thread.lock()
+        self.read_wake_req = 1
+        self.continue_read_thread.cond_signal()
+        self.continue_read_thread.unlock()
+        return 0
+
+    cdef int set_low_water(VideoState self, AVStream *st, FFPacketQueue queue, int any_packet) nogil:
+        '''Sets when the decoder of the queue wakes the read thread, and returns
+        whether the queue is already below it. Must be called with
+        continue_read_thread locked.
+        '''
+        if st == NULL or st.disposition & AV_DISPOSITION_ATTACHED_PIC:
+            return 0
+        if any_packet:
+            queue.low_water_duration = -1
+            queue.low_water_packets = queue.packet_queue_nb_packets() - 1
+        else:
+            # the inverse of stream_has_enough_packets
+            queue.low_water_duration = <int64_t>(
+                self.player.min_queue_duration / av_q2d(st.time_base))
+            queue.low_water_packets = self.player.min_frames
+        return queue.below_low_water()
+
+    cdef int wait_read_thread(VideoState self, int any_packet, uint32_t timeout) nogil except 1:
+        '''Waits until a decoder drained its queue below its low-water mark (or
+        took any packet if ``any_packet``), until woken by
+        :meth:`wake_read_thread`, or at most ``timeout`` ms.
+        '''
+        cdef int below
+        self.continue_read_thread.lock()
+        below = self.set_low_water(self.audio_st, self.audioq, any_packet)
+        below = self.set_low_water(self.video_st, self.videoq, any_packet) or below
+        below = self.set_low_water(self.subtitle_st, self.subtitleq, any_packet) or below
+        # checking after setting the marks, in case a decoder drained its queue
+        # before it could see them
+        if not below and not self.read_wake_req:
+            self.continue_read_thread.cond_wait_timeout(timeout)
+        self.read_wake_req = 0
+        self.audioq.low_water_packets = -1
+        self.videoq.low_water_packets = -1
+        self.subtitleq.low_water_packets = -1
+        self.continue_read_thread.unlock()
+        return 0
+
+    cdef int skip_video_packet(VideoState self, AVPacket *pkt) nogil:
+        '''Whether the video packet can be dropped before decoding, because
+        its frame would not be kept. Only packets that no other frame depends on
+        can be dropped, except for the non-keyframes when decoding only keyframes.
+        '''
+        if self.player.keyframes_only:
+            return not pkt.flags & AV_PKT_FLAG_KEY
+        # every_nth counts the decoded frames, so it cannot skip packets
+        if (self.player.every_nth > 1 or self.decimator.period <= 0 or
+                not pkt.flags & AV_PKT_FLAG_DISPOSABLE or pkt.pts == AV_NOPTS_VALUE):
+            return 0
+        # next_pts is from the video thread, so it's only valid for the same serial
+        # and it's NaN until the first frame is kept
+        return (self.decimator_serial == self.videoq.serial and
+                av_q2d(self.video_st.time_base) * pkt.pts + 1e-6 < self.decimator.next_pts)
+
+    cdef int stream_is_starving(self, AVStream *st, int stream_id, FFPacketQueue queue) nogil:
+        '''Whether the stream is about to run out of packets, so the player must
+        keep reading even when its pool is over the memory budget.
+        '''
+        return (
+            stream_id >= 0 and
+            not queue.abort_request and
+            not (st.disposition & AV_DISPOSITION_ATTACHED_PIC) and
+            queue.packet_queue_nb_packets() <= EXTERNAL_CLOCK_MIN_FRAMES
+        )
+
     cdef int stream_has_enough_packets(self, AVStream *st, int stream_id, FFPacketQueue queue) nogil:
         return (
             stream_id < 0 or
             queue.abort_request or
             (st.disposition & AV_DISPOSITION_ATTACHED_PIC) or
-            queue.nb_packets > MIN_FRAMES and
-            (not queue.duration or av_q2d(st.time_base) * queue.duration > 1.0)
+            queue.packet_queue_nb_packets() > self.player.min_frames and
+            (not queue.packet_queue_duration() or
+             av_q2d(st.time_base) * queue.packet_queue_duration() > self.player.min_queue_duration)
         )
 
     cdef inline int failed(VideoState self, int ret, AVFormatContext *ic, AVPacket **pkt) nogil except 1:
@@ -4,6 +4,7 @@ include '../includes/ffmpeg.pxi'
 from ffpyplayer.threading cimport MTGenerator, MTCond, MTMutex, MTThread
 from ffpyplayer.player.queue cimport FFPacketQueue
 from ffpyplayer.player.frame_queue cimport FrameQueue
+from ffpyplayer.player.pool cimport PlayerPool
 
 
 cdef class Decoder(object):
@@ -25,8 +26,21 @@ cdef class Decoder(object):
         int seeking
         MTGenerator mt_gen
 
+        # if not None, a slot of the pool is taken for each decoded packet
+        PlayerPool pool
+        int pooled
+        # the codec threads taken from the pool's budget
+        int pool_threads
+        # the queue the decoded frames are pushed to, its fill sets the priority in the pool
+        FrameQueue frameq
+
+        # the number of frames decoded, and the time in us spent in the codec
+        int64_t frames_decoded
+        int64_t decode_time
+
     cdef int decoder_init(self, MTGenerator mt_gen, AVCodecContext *avctx, FFPacketQueue queue,
-                           MTCond empty_queue_cond) nogil except 1
+                           MTCond empty_queue_cond, FrameQueue frameq, PlayerPool pool,
+                           int pool_threads) nogil except 1
     cdef void decoder_destroy(self) nogil
     cdef void set_seek_pos(self, double seek_req_pos) nogil
     cdef int is_seeking(self) nogil
@@ -20,22 +20,28 @@ cdef class Decoder(object):
 
     cdef int decoder_init(
             self, MTGenerator mt_gen, AVCodecContext *avctx, FFPacketQueue queue,
-            MTCond empty_queue_cond) nogil except 1:
+            MTCond empty_queue_cond, FrameQueue frameq, PlayerPool pool,
+            int pool_threads) nogil except 1:
         self.pkt = av_packet_alloc()
+        # the stream was added to the pool when its codec was opened
+        self.pool_threads = pool_threads
 
         with gil:
             self.queue = queue
             self.empty_queue_cond = empty_queue_cond
             self.mt_gen = mt_gen
+            self.frameq = frameq
+            self.pool = pool
+            self.pooled = pool is not None
             if self.pkt == NULL:
                 raise MemoryError
-
         self.avctx = avctx
         self.packet_pending = self.finished = 0
         self.seeking = self.start_pts = self.next_pts = 0
         self.seek_req_pos = -1
         self.start_pts = AV_NOPTS_VALUE
         self.pkt_serial = -1
+        self.frames_decoded = self.decode_time = 0
         memset(&self.start_pts_tb, 0, sizeof(self.start_pts_tb))
         memset(&self.next_pts_tb, 0, sizeof(self.next_pts_tb))
         return 0
@@ -43,6 +49,10 @@ cdef class Decoder(object):
     cdef void decoder_destroy(self) nogil:
         av_packet_free(&self.pkt)
         avcodec_free_context(&self.avctx)
+        if self.pooled:
+            self.pool.remove_stream(self.pool_threads)
+            self.pool_threads = 0
+            self.pooled = 0
 
     cdef void set_seek_pos(self, double seek_req_pos) nogil:
         self.seek_req_pos = seek_req_pos
@@ -55,10 +65,14 @@ cdef class Decoder(object):
     cdef int decoder_abort(self, FrameQueue fq) nogil except 1:
         self.queue.packet_queue_abort()
         fq.frame_queue_signal()
+        if self.pooled:
+            self.pool.wake()
         self.decoder_tid.wait_thread(NULL)
         with gil:
             self.decoder_tid = None
         self.queue.packet_queue_flush()
+        # the decoder exited, so free the packets it would have dropped
+        self.queue.packet_queue_drop_flushed()
         return 0
 
     cdef int decoder_start(self, int_void_func func, const char *thread_name, void *arg) nogil except 1:
@@ -71,17 +85,32 @@ cdef class Decoder(object):
     cdef int decoder_decode_frame(self, AVFrame *frame, AVSubtitle *sub, int decoder_reorder_pts) nogil except? 2:
         cdef int ret = AVERROR(EAGAIN)
         cdef int got_frame
+        cdef int64_t ts
         cdef AVRational tb
         cdef int old_serial
+        # whether we hold a slot of the pool. It's held for the whole
+        # send/receive cycle of a packet, and only released when returning or
+        # when waiting for the next packet
+        cdef int held = 0
 
         while True:
             if self.queue.serial == self.pkt_serial:
                 while True:
                     if self.queue.abort_request:
+                        if held:
+                            self.pool.release()
                         return -1
 
+                    if self.pooled and not held and self.avctx.codec_type != AVMEDIA_TYPE_SUBTITLE:
+                        if self.pool.acquire(&self.frameq.size, self.frameq.max_size,
+                                             &self.queue.abort_request):
+                            return -1
+                        held = 1
+
                     if self.avctx.codec_type == AVMEDIA_TYPE_VIDEO:
+                        ts = av_gettime_relative()
                         ret = avcodec_receive_frame(self.avctx, frame)
+                        self.decode_time += av_gettime_relative() - ts
                         if ret >= 0:
                             if decoder_reorder_pts == -1:
                                 frame.pts = frame.best_effort_timestamp
@@ -89,7 +118,9 @@ cdef class Decoder(object):
                                 frame.pts = frame.pkt_dts
 
                     elif self.avctx.codec_type == AVMEDIA_TYPE_AUDIO:
+                        ts = av_gettime_relative()
                         ret = avcodec_receive_frame(self.avctx, frame)
+                        self.decode_time += av_gettime_relative() - ts
                         if ret >= 0:
                             tb.num = 1
                             tb.den = frame.sample_rate
@@ -102,25 +133,39 @@ cdef class Decoder(object):
                                 self.next_pts_tb = tb
 
                     if ret == AVERROR_EOF:
+                        if held:
+                            self.pool.release()
                         self.finished = self.pkt_serial
                         avcodec_flush_buffers(self.avctx)
                         return 0
                     if ret >= 0:
+                        if held:
+                            self.pool.release()
+                        self.frames_decoded += 1
                         return 1
                     if ret == AVERROR(EAGAIN):
                         break
 
             while True:
-                if not self.queue.nb_packets:
+                # wake the read thread if it waits for us to drain the queue
+                if self.queue.below_low_water():
                     self.empty_queue_cond.lock()
+                    self.queue.low_water_packets = -1
                     self.empty_queue_cond.cond_signal()
                     self.empty_queue_cond.unlock()
 
                 if self.packet_pending:
                     self.packet_pending = 0
                 else:
+                    # don't hold the slot while blocking for a packet. We are the
+                    # only reader, so if there's a packet the get won't block
+                    if held and not self.queue.packet_queue_nb_packets():
+                        self.pool.release()
+                        held = 0
                     old_serial = self.pkt_serial
                     if self.queue.packet_queue_get(self.pkt, 1, &self.pkt_serial) < 0:
+                        if held:
+                            self.pool.release()
                         return -1
 
                     if old_serial != self.pkt_serial:
@@ -148,7 +193,16 @@ cdef class Decoder(object):
                         ret = AVERROR(EAGAIN) if self.pkt.data != NULL else AVERROR_EOF
                 av_packet_unref(self.pkt)
             else:
-                if avcodec_send_packet(self.avctx, self.pkt) == AVERROR(EAGAIN):
+                if self.pooled and not held:
+                    if self.pool.acquire(&self.frameq.size, self.frameq.max_size,
+                                         &self.queue.abort_request):
+                        av_packet_unref(self.pkt)
+                        return -1
+                    held = 1
+                ts = av_gettime_relative()
+                ret = avcodec_send_packet(self.avctx, self.pkt)
+                self.decode_time += av_gettime_relative() - ts
+                if ret == AVERROR(EAGAIN):
                     av_log(self.avctx, AV_LOG_ERROR, "Receive_frame and send_packet both returned EAGAIN, which is an API violation.\n")
                     self.packet_pending = 1
                 else:
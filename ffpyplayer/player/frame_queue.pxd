@@ -20,6 +20,9 @@ cdef struct Frame:
     int height
     AVRational sar
     AVPixelFormat pix_fmt
+    # the frames of the additional outputs, filtered from the same frame
+    AVFrame *outputs[MAX_OUTPUTS]
+    int nb_outputs
 
 
 cdef class FrameQueue(object):
@@ -27,18 +30,29 @@ cdef class FrameQueue(object):
         MTCond cond
         FFPacketQueue pktq
         Frame queue[FRAME_QUEUE_SIZE]
+        # rindex is only changed by the consumer and windex by the producer, and
+        # size is accessed atomically, so only waiting requires the lock
         int rindex
         int windex
         int size
+        # the number of threads waiting on cond for the size to change
+        int waiting
         int max_size
         int keep_last
         int rindex_shown
 
         MTMutex alloc_mutex
         int requested_alloc
+        # if not -1, a byte is written to it whenever a frame is pushed or the
+        # queue is signaled
+        int notify_fd
+        # the time in us spent converting frames to the output format
+        int64_t sws_time
+        int64_t sws_frames
 
     cdef void frame_queue_unref_item(self, Frame *vp) nogil
     cdef int frame_queue_signal(self) nogil except 1
+    cdef int wake_waiting(self) nogil except 1
     cdef int is_empty(self) nogil
     cdef Frame *frame_queue_peek(self) nogil
     cdef Frame *frame_queue_peek_next(self) nogil
@@ -56,7 +70,7 @@ cdef class FrameQueue(object):
     cdef int queue_picture(
         self, AVFrame *src_frame, double pts, double duration, int64_t pos,
         int serial, AVPixelFormat out_fmt, int *abort_request,
-        VideoSettings *player) nogil except 1
+        VideoSettings *player, AVFrame **outputs, int nb_outputs) nogil except 1
     cdef int alloc_picture(self) nogil except 1
     cdef int copy_picture(self, Frame *vp, AVFrame *src_frame,
                            VideoSettings *player) nogil except 1
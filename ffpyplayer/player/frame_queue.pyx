@@ -7,6 +7,13 @@ include "../includes/inline_funcs.pxi"
 cdef extern from "string.h" nogil:
     void * memset(void *, int, size_t)
 
+cdef extern from "clib/mt_native.h" nogil:
+    int native_atomic_load(int *)
+    int native_atomic_add(int *, int)
+
+from ffpyplayer.pic cimport frame_pool_get_buffer, get_sws_context, scale_frame
+from ffpyplayer.threading cimport MTThread, SDL_MT, Py_MT, Native_MT
+
 cdef void raise_py_exception(msg) nogil except *:
     with gil:
         raise Exception(tcode(msg))
@@ -19,6 +26,8 @@ cdef class FrameQueue(object):
         self.alloc_mutex = MTMutex.__new__(MTMutex, mt_gen.mt_src)
         self.max_size = FFMIN(max_size, FRAME_QUEUE_SIZE)
         self.pktq = pktq
+        self.notify_fd = -1
+        self.sws_time = self.sws_frames = 0
         cdef int i
 
         with nogil:
@@ -34,29 +43,50 @@ cdef class FrameQueue(object):
                         raise_py_exception(b'Could not allocate avframe buffer')
 
     def __dealloc__(self):
-        cdef int i
+        cdef int i, j
         cdef Frame *vp
 
         with nogil:
             for i in range(self.max_size):
                 vp = &self.queue[i]
                 self.frame_queue_unref_item(vp)
-                if vp.need_conversion:
-                    av_freep(&vp.frame.data[0])
                 av_frame_free(&vp.frame)
+                for j in range(MAX_OUTPUTS):
+                    av_frame_free(&vp.outputs[j])
 
     cdef void frame_queue_unref_item(self, Frame *vp) nogil:
+        cdef int i
         av_frame_unref(vp.frame)
         avsubtitle_free(&vp.sub)
+        for i in range(vp.nb_outputs):
+            av_frame_unref(vp.outputs[i])
+        vp.nb_outputs = 0
 
     cdef int frame_queue_signal(self) nogil except 1:
         self.cond.lock()
         self.cond.cond_signal()
         self.cond.unlock()
+        if self.notify_fd != -1:
+            notify_fd(self.notify_fd)
+        return 0
+
+    cdef int wake_waiting(self) nogil except 1:
+        '''Wakes the other thread after the size changed, if it's waiting on it.
+
+        The size is changed before waiting is read, and the waiter increments
+        waiting before checking the size, both atomically, so either the waiter
+        sees the new size or waiting is seen here. Signaling with the lock held
+        ensures the waiter is already waiting. All waiters are woken, because
+        besides the other end of the queue, e.g. a blocking get_frame may wait.
+        '''
+        if native_atomic_load(&self.waiting):
+            self.cond.lock()
+            self.cond.cond_broadcast()
+            self.cond.unlock()
         return 0
 
     cdef int is_empty(self) nogil:
-        return self.size - self.rindex_shown <= 0
+        return native_atomic_load(&self.size) - self.rindex_shown <= 0
 
     cdef Frame *frame_queue_peek(self) nogil:
         return &self.queue[(self.rindex + self.rindex_shown) % self.max_size]
@@ -68,11 +98,15 @@ cdef class FrameQueue(object):
         return &self.queue[self.rindex]
 
     cdef Frame *frame_queue_peek_writable(self) nogil:
-        # wait until we have space to put a new frame
-        self.cond.lock()
-        while self.size >= self.max_size and not self.pktq.abort_request:
-            self.cond.cond_wait()
-        self.cond.unlock()
+        # wait until we have space to put a new frame, only locking if we need to
+        if native_atomic_load(&self.size) >= self.max_size:
+            self.cond.lock()
+            native_atomic_add(&self.waiting, 1)
+            while (native_atomic_load(&self.size) >= self.max_size and
+                   not self.pktq.abort_request):
+                self.cond.cond_wait()
+            native_atomic_add(&self.waiting, -1)
+            self.cond.unlock()
 
         if self.pktq.abort_request:
             return NULL
@@ -80,11 +114,15 @@ cdef class FrameQueue(object):
         return &self.queue[self.windex]
 
     cdef Frame *frame_queue_peek_readable(self) nogil:
-        # wait until we have a readable a new frame
-        self.cond.lock()
-        while self.size - self.rindex_shown <= 0 and not self.pktq.abort_request:
-            self.cond.cond_wait()
-        self.cond.unlock()
+        # wait until we have a readable a new frame, only locking if we need to
+        if native_atomic_load(&self.size) - self.rindex_shown <= 0:
+            self.cond.lock()
+            native_atomic_add(&self.waiting, 1)
+            while (native_atomic_load(&self.size) - self.rindex_shown <= 0 and
+                   not self.pktq.abort_request):
+                self.cond.cond_wait()
+            native_atomic_add(&self.waiting, -1)
+            self.cond.unlock()
 
         if self.pktq.abort_request:
             return NULL
@@ -96,10 +134,11 @@ cdef class FrameQueue(object):
         if self.windex == self.max_size:
             self.windex = 0
 
-        self.cond.lock()
-        self.size += 1
-        self.cond.cond_signal()
-        self.cond.unlock()
+        # publishes the frame to the consumer
+        native_atomic_add(&self.size, 1)
+        self.wake_waiting()
+        if self.notify_fd != -1:
+            notify_fd(self.notify_fd)
         return 0
 
     cdef int frame_queue_next(self) nogil except 1:
@@ -112,10 +151,8 @@ cdef class FrameQueue(object):
         if self.rindex == self.max_size:
             self.rindex = 0
 
-        self.cond.lock()
-        self.size -= 1
-        self.cond.cond_signal()
-        self.cond.unlock()
+        native_atomic_add(&self.size, -1)
+        self.wake_waiting()
         return 0
 
     cdef int frame_queue_prev(self) nogil:
@@ -127,7 +164,7 @@ cdef class FrameQueue(object):
 
     cdef int frame_queue_nb_remaining(self) nogil:
         # return the number of undisplayed frames in the queue
-        return self.size - self.rindex_shown
+        return native_atomic_load(&self.size) - self.rindex_shown
 
     cdef int64_t frame_queue_last_pos(self) nogil:
         cdef Frame *fp = &self.queue[self.rindex]
@@ -142,6 +179,7 @@ cdef class FrameQueue(object):
         cdef const AVClass *cls
         cdef const AVOption *o
         cdef int ret
+        cdef int64_t ts
 
         if not vp.need_conversion:
             av_frame_unref(vp.frame)
@@ -156,14 +194,29 @@ cdef class FrameQueue(object):
                 if ret < 0:
                     raise_py_exception(b'Could not av_opt_eval_flags')
 
-            player.img_convert_ctx = sws_getCachedContext(player.img_convert_ctx,\
+            player.img_convert_ctx = get_sws_context(player.img_convert_ctx,\
             vp.width, vp.height, <AVPixelFormat>src_frame.format, vp.width, vp.height,\
-            vp.pix_fmt, player.sws_flags, NULL, NULL, NULL)
+            vp.pix_fmt, player.sws_flags, player.scale_threads)
             if player.img_convert_ctx == NULL:
                 av_log(NULL, AV_LOG_FATAL, b"Cannot initialize the conversion context\n")
                 raise_py_exception(b'Cannot initialize the conversion context.')
-            sws_scale(player.img_convert_ctx, <const unsigned char* const*>src_frame.data, src_frame.linesize,
-                      0, vp.height, vp.frame.data, vp.frame.linesize)
+
+            # the previous buffer may still be referenced by an Image, so get a
+            # new one from the pool rather than overwriting it
+            av_frame_unref(vp.frame)
+            vp.frame.width = vp.width
+            vp.frame.height = vp.height
+            vp.frame.format = <int>vp.pix_fmt
+            if frame_pool_get_buffer(vp.frame, 1) < 0:
+                av_log(NULL, AV_LOG_FATAL, b"Could not allocate avframe buffer.\n")
+                raise_py_exception(b'Could not allocate avframe buffer')
+            ts = av_gettime_relative()
+            ret = scale_frame(player.img_convert_ctx, src_frame, vp.frame, player.scale_threads, 0)
+            self.sws_time += av_gettime_relative() - ts
+            self.sws_frames += 1
+            if ret < 0:
+                av_log(NULL, AV_LOG_FATAL, b"Could not convert the frame.\n")
+                raise_py_exception(b'Could not convert the frame')
             av_frame_unref(src_frame)
         return 0
 
@@ -174,19 +227,8 @@ cdef class FrameQueue(object):
         self.alloc_mutex.lock()
         if self.requested_alloc:
             vp = &self.queue[self.windex]
+            # converted frames get their buffers from the frame pool when copied
             self.frame_queue_unref_item(vp)
-            if vp.need_conversion:
-                av_freep(&vp.frame.data[0])
-
-            if vp.need_conversion:
-                if (av_image_alloc(vp.frame.data, vp.frame.linesize, vp.width,
-                                   vp.height, vp.pix_fmt, 1) < 0):
-                    av_log(NULL, AV_LOG_FATAL, b"Could not allocate avframe buffer.\n")
-                    raise_py_exception(b'Could not allocate avframe buffer')
-
-                vp.frame.width = vp.width
-                vp.frame.height = vp.height
-                vp.frame.format = <int>vp.pix_fmt
 
             self.cond.lock()
             vp.allocated = 1
@@ -206,8 +248,12 @@ cdef class FrameQueue(object):
     cdef int queue_picture(
             self, AVFrame *src_frame, double pts, double duration, int64_t pos,
             int serial, AVPixelFormat out_fmt, int *abort_request,
-            VideoSettings *player) nogil except 1:
+            VideoSettings *player, AVFrame **outputs, int nb_outputs) nogil except 1:
+        ''' Queues ``src_frame``, and the ``nb_outputs`` frames of the additional
+        outputs filtered from it. The references of all the frames are taken.
+        '''
         cdef Frame *vp
+        cdef int i
 
         IF 0:# and defined(DEBUG_SYNC):
             av_log(NULL, AV_LOG_DEBUG, b"frame_type=%c pts=%0.3f\n",
@@ -251,6 +297,14 @@ cdef class FrameQueue(object):
 
         # if the frame is not skipped, then display it
         self.copy_picture(vp, src_frame, player)
+        for i in range(nb_outputs):
+            if vp.outputs[i] == NULL:
+                vp.outputs[i] = av_frame_alloc()
+                if vp.outputs[i] == NULL:
+                    raise_py_exception(b'Could not allocate avframe buffer')
+            av_frame_unref(vp.outputs[i])
+            av_frame_move_ref(vp.outputs[i], outputs[i])
+        vp.nb_outputs = nb_outputs
 
         vp.pts = pts
         vp.duration = duration
@@ -258,3 +312,100 @@ cdef class FrameQueue(object):
         vp.serial = serial
         self.frame_queue_push()
         return 0
+
+
+cdef class QueueBenchmark(object):
+    '''Passes items from a producer thread to a consumer through a
+    :class:`FrameQueue` or :class:`FFPacketQueue`.
+    '''
+    cdef MTGenerator mt_gen
+    cdef FFPacketQueue pktq
+    cdef FrameQueue frameq
+    cdef int n
+    cdef int use_frameq
+
+    cdef int produce(self) nogil except 1:
+        cdef int i
+        cdef Frame *vp
+        cdef AVPacket *pkt = av_packet_alloc()
+        if pkt == NULL:
+            raise_py_exception(b'Could not allocate packet')
+
+        for i in range(self.n):
+            if self.use_frameq:
+                vp = self.frameq.frame_queue_peek_writable()
+                if vp == NULL:
+                    break
+                vp.serial = i
+                self.frameq.frame_queue_push()
+            elif self.pktq.packet_queue_put(pkt) < 0:
+                break
+        av_packet_free(&pkt)
+        return 0
+
+    cdef int consume(self) nogil except 1:
+        cdef int i
+        cdef AVPacket *pkt = av_packet_alloc()
+        if pkt == NULL:
+            raise_py_exception(b'Could not allocate packet')
+
+        for i in range(self.n):
+            if self.use_frameq:
+                if self.frameq.frame_queue_peek_readable() == NULL:
+                    break
+                self.frameq.frame_queue_next()
+            else:
+                if self.pktq.packet_queue_get(pkt, 1, NULL) < 0:
+                    break
+                av_packet_unref(pkt)
+        av_packet_free(&pkt)
+        return 0
+
+
+cdef int queue_benchmark_enter(void *obj_id) except? 1 with gil:
+    cdef QueueBenchmark bench = <QueueBenchmark>obj_id
+    with nogil:
+        return bench.produce()
+
+
+def _benchmark_queues(int n=100000, thread_lib='native'):
+    '''Returns a dict with the number of items per second passed from a
+    producer thread to a consumer thread through the frame queue
+    (``'frame_queue'``) and the packet queue (``'packet_queue'``), using the
+    ``thread_lib`` threading backend. Used by ``examples/benchmarks.py``.
+    '''
+    cdef QueueBenchmark bench
+    cdef MTGenerator mt_gen
+    cdef MTThread thread
+    cdef int64_t ts, elapsed
+    cdef dict results = {}
+
+    if thread_lib == 'SDL':
+        mt_gen = MTGenerator(SDL_MT)
+    elif thread_lib == 'python':
+        mt_gen = MTGenerator(Py_MT)
+    elif thread_lib == 'native':
+        mt_gen = MTGenerator(Native_MT)
+    else:
+        raise Exception('Thread library parameter not recognized.')
+
+    for name, use_frameq in (('frame_queue', 1), ('packet_queue', 0)):
+        bench = QueueBenchmark()
+        bench.mt_gen = mt_gen
+        bench.n = n
+        bench.use_frameq = use_frameq
+        bench.pktq = FFPacketQueue(mt_gen)
+        bench.frameq = FrameQueue(mt_gen, bench.pktq, VIDEO_PICTURE_QUEUE_SIZE, 0)
+        thread = MTThread(mt_gen.mt_src)
+
+        with nogil:
+            bench.pktq.packet_queue_start()
+            ts = av_gettime_relative()
+            thread.create_thread(queue_benchmark_enter, "queue_benchmark", <void *>bench)
+            bench.consume()
+            elapsed = av_gettime_relative() - ts
+            thread.wait_thread(NULL)
+            bench.pktq.packet_queue_abort()
+            bench.pktq.packet_queue_flush()
+        results[name] = n / max(elapsed / 1000000., 1e-9)
+    return results
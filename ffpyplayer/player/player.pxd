@@ -14,6 +14,11 @@ cdef class MediaPlayer(object):
         Image next_image
         int is_closed
         dict ff_opts
+        int trace_id
+        # the names of the additional outputs, and their last displayed frames
+        list output_names
+        AVFrame *output_frames[MAX_OUTPUTS]
 
     cdef void _seek(self, double pts, int relative, int seek_by_bytes, int accurate) nogil
+    cdef object _get_output_images(self, Image image, object output)
     cpdef close_player(self)
@@ -1,5 +1,5 @@
 
-__all__ = ('MediaPlayer', )
+__all__ = ('MediaPlayer', 'AsyncMediaPlayer')
 
 include '../includes/ff_consts.pxi'
 include "../includes/inline_funcs.pxi"
@@ -14,16 +14,29 @@ cdef extern from "math.h" nogil:
 cdef extern from "string.h" nogil:
     void * memset(void *, int, size_t)
 
-from ffpyplayer.threading cimport MTGenerator, SDL_MT, Py_MT, MTThread, MTMutex
+from ffpyplayer.threading cimport MTGenerator, SDL_MT, Py_MT, Native_MT, MTThread, MTMutex
 from ffpyplayer.player.queue cimport FFPacketQueue
-from ffpyplayer.player.core cimport VideoState, VideoSettings
+from ffpyplayer.player.frame_queue cimport FrameQueue
+from ffpyplayer.player.core cimport VideoState, VideoSettings, TraceSpan, OutputSettings
+from ffpyplayer.player.pool cimport PlayerPool
+from ffpyplayer.avio cimport AVIOSource, is_avio_source, get_avio_source
 from ffpyplayer.pic cimport Image
 from libc.stdio cimport printf
 from cpython.ref cimport PyObject
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_WRITABLE, \
+    PyBUF_C_CONTIGUOUS
 
 import ffpyplayer.tools  # required to init ffmpeg
 from ffpyplayer.tools import initialize_sdl_aud, encode_to_bytes, loglevels
+from ffpyplayer.pic import _fill_frame_batch
 from copy import deepcopy
+from time import perf_counter
+from itertools import count
+import json
+
+_trace_ids = count(1)
+_trace_kinds = ('demux', 'decode', 'filter', 'queue_picture', 'get_frame')
+_trace_threads = ('main', 'read', 'video', 'audio')
 
 
 cdef inline void *grow_array(void *array, int elem_size, int *size, int new_size) nogil:
@@ -67,11 +80,14 @@ cdef class MediaPlayer(object):
 
     :Parameters:
 
-        `filename`: str
+        `filename`: str, file-like, or buffer
             The filename or url of the media object. This can be physical files,
             remote files or even webcam name's e.g. for direct show or Video4Linux
             webcams. The ``f`` specifier in ``ff_opts`` can be used to indicate the
             format needed to open the file (e.g. dshow).
+
+            It can also be a file-like object or buffer holding the media, which
+            is then read using a :class:`~ffpyplayer.avio.AVIOSource`.
         `callback`: Function or ref to function or None
             A function, which if not None will be called when a internal thread quits,
             when eof is reached (as determined by whichever is the main ``sync`` stream,
@@ -116,7 +132,11 @@ cdef class MediaPlayer(object):
             :attr:`~ffpyplayer.tools.set_loglevel`, this is applied first to quickly filter
             logs generated by this instance (it's not applied to internal ffmpeg logs).
         `thread_lib`: str
-            The threading library to use internally. Can be one of 'SDL' or 'python'.
+            The threading library to use internally. Can be one of 'SDL', 'python',
+            or 'native'. 'native' uses the OS threads (pthreads, or Win32 threads on
+            Windows) directly, so the queues are locked and waited on without the GIL,
+            unlike with 'python', and without requiring SDL to be initialized.
+            Defaults to 'SDL'.
 
             .. warning::
 
@@ -128,7 +148,17 @@ cdef class MediaPlayer(object):
                 before python exits.
 
         `audio_sink`: str
-            Currently it must be 'SDL'. Defaults to 'SDL'.
+            Where the audio is output. Defaults to 'SDL'. Can be one of:
+
+            `'SDL'`: The audio is played on the SDL audio device.
+            `'buffer'`: No audio device is opened. Instead, the audio is written as
+                interleaved signed 16 bit samples, at the sample rate and channels
+                given by ``sink_sample_rate`` and ``sink_channels`` in
+                :meth:`get_metadata`, into a ring buffer from which it's read with
+                :meth:`get_audio`. Audio sync and the audio master clock work as
+                with SDL, except that the clock follows the samples read (or with
+                ``audio_buffer_realtime``, the wall time). Useful on servers
+                without a sound card. ``set_volume`` and ``set_mute`` still apply.
         `lib_opts`: dict
             A dictionary of options that will be passed to the ffmpeg libraries,
             codecs, sws, swr, and formats when opening them. This accepts most of the
@@ -152,6 +182,24 @@ cdef class MediaPlayer(object):
                 from the input as soon as possible. Enabled by default for realtime streams,
                 where data may be dropped if not read in time. Use this option to enable
                 infinite buffers for all inputs.
+            `max_queue_size`: int
+                The maximum number of bytes of packets read ahead into the packet
+                queues of all the streams, unless ``infbuf``. Defaults to 15 MiB.
+            `min_frames`: int
+                Reading stops once each stream has more than this many packets
+                queued, and at least ``min_queue_duration`` of them. Defaults to 25.
+            `min_queue_duration`: float
+                See ``min_frames``. In seconds. Defaults to 1.
+            `video_queue_size`: int
+                The number of decoded video frames that are queued ready to be
+                displayed. Between 2 and 64. Defaults to 3.
+            `audio_queue_size`: int
+                The number of decoded audio frames that are queued ready to be
+                played. Between 2 and 64. Defaults to 9.
+            `priority`: int
+                When the player is part of a ``pool`` with a ``memory_budget``,
+                the players with the lowest priority are the first to stop reading
+                when over the budget. Defaults to 0.
             `framedrop`: bool
                 Drop video frames if video is out of sync. Enabled by default if the master
                 clock (``sync``) is not set to video. Use this option to enable/disable frame
@@ -239,6 +287,18 @@ cdef class MediaPlayer(object):
                 The desired pixel format for the data returned by :meth:`get_frame`. Accepts
                 the same value as :meth:`set_output_pix_fmt` and can be
                 one of :attr:`ffpyplayer.tools.pix_fmts`. Defaults to rgb24.
+            `outputs`: dict
+                Additional named outputs, e.g. a thumbnail, that are filtered from
+                each decoded video frame alongside the main output, rather than
+                decoding the file again. It maps each name to a dict with the
+                optional keys ``x``, ``y``, and ``out_fmt`` that have the same meaning
+                as the options of the same name for the main output and default to
+                the source size and the main ``out_fmt``. E.g.
+                ``{'thumb': {'x': 160, 'y': -1, 'out_fmt': 'gray'}}``. Up to 8 outputs
+                may be added. See the ``output`` parameter of :meth:`get_frame`.
+
+                CONFIG_AVFILTER must be True (the default) when compiling in order to use this.
+                Defaults to no additional outputs.
             `autorotate`: bool
                 Whether to automatically rotate the video according to presentation metadata.
                 Defaults to True.
@@ -250,6 +310,57 @@ cdef class MediaPlayer(object):
             `filter_threads`: int
                 The number of filter threads per graph. Defaults to zero
                 (determined by the number of available CPUs).
+            `scale_threads`: int
+                The number of threads used to convert each frame to the output pixel
+                format when the conversion is not done by the filters (e.g. when
+                CONFIG_AVFILTER is False). When not 1, horizontal slices of the frame
+                are converted in parallel, see :class:`~ffpyplayer.pic.SWScale`. If
+                zero, the number of CPUs is used. Defaults to 1.
+            `unthrottled`: bool
+                If True, frames are not paced against the clock, instead
+                :meth:`get_frame` returns each frame as soon as it has been decoded,
+                so the file is read as fast as it can be decoded. This is useful for
+                offline processing. Video is used as the master clock, frames are
+                never dropped, and audio is disabled. Defaults to False.
+            `keyframes_only`: bool
+                If True, only the keyframes of the video are decoded and returned.
+                The other packets are dropped before they reach the decoder, which
+                makes e.g. scrubbing or making thumbnails much cheaper. Defaults to
+                False.
+            `every_nth`: int
+                If larger than 1, only every ``every_nth`` decoded video frame is
+                returned, counting from the first frame after opening or seeking.
+                Defaults to 1.
+            `target_fps`: float
+                If positive, at most this many video frames are returned for each
+                second of the video, keeping each frame that is at least
+                ``1 / target_fps`` seconds after the previously kept one. Packets that no other frame depends on
+                (e.g. non-reference B-frames) are dropped before decoding when
+                their frame would not be kept. Defaults to zero.
+
+                The frames skipped by these options are never filtered or
+                converted, and are counted in the ``frames_skipped`` of
+                :meth:`get_stats`. They are best combined with ``unthrottled``.
+            `audio_buffer_duration`: float
+                The duration, in seconds, of the audio the ring buffer holds when
+                ``audio_sink`` is ``'buffer'``. Defaults to 1.
+            `audio_buffer_realtime`: bool
+                When ``audio_sink`` is ``'buffer'`` and this is False, the default,
+                audio is only decoded into the ring buffer as there's room for it,
+                so playback is paced by how fast :meth:`get_audio` reads it, and the
+                audio clock is set to the time of the samples read. If True, the
+                audio is written into it in real time, like to a sound card, and
+                the oldest samples are overwritten if they are not read in time.
+            `trace`: int
+                If not zero, the internal threads record timestamped spans of
+                reading, decoding, filtering, and queuing each frame, and of
+                :meth:`get_frame` returning it, into a ring buffer of this many
+                spans (rounded up to a power of 2). See :meth:`get_trace`.
+                Defaults to zero, when nothing is recorded.
+        `pool`: :class:`~ffpyplayer.player.pool.PlayerPool` or None
+            If not None, the pool that limits how many decoders of all the players
+            sharing it decode at once, and how many codec threads each stream
+            gets. Defaults to None, when the player is not limited.
 
     For example, a simple player:
 
@@ -285,15 +396,23 @@ cdef class MediaPlayer(object):
     '''
 
     def __cinit__(self, filename, callback=None, loglevel='trace', ff_opts={},
-                  thread_lib='SDL', audio_sink='SDL', lib_opts={}, **kargs):
+                  thread_lib='SDL', audio_sink='SDL', lib_opts={}, PlayerPool pool=None,
+                  **kargs):
         cdef unsigned flags
         cdef VideoSettings *settings = &self.settings
         cdef AVPixelFormat out_fmt
-        cdef int res, paused
+        cdef OutputSettings *output
+        cdef int res, paused, i
+        cdef AVIOSource source = None
         ff_opts_orig = ff_opts
         ff_opts = self.ff_opts = encode_to_bytes(deepcopy(ff_opts))
         lib_opts = encode_to_bytes(deepcopy(lib_opts))
         kargs = encode_to_bytes(deepcopy(kargs))
+        if is_avio_source(filename):
+            source = get_avio_source(filename)
+            if source.attached:
+                raise ValueError('The source has already been used')
+            filename = b''
         filename = encode_to_bytes(filename)
 
         self.is_closed = 0
@@ -327,6 +446,9 @@ cdef class MediaPlayer(object):
         settings.autorotate = bool(ff_opts.get('autorotate', 1))
         settings.find_stream_info = bool(ff_opts.get('find_stream_info', 1))
         settings.filter_threads = int(ff_opts.get('filter_threads', 0))
+        settings.scale_threads = int(ff_opts.get('scale_threads', 1))
+        if settings.scale_threads < 0:
+            raise ValueError('scale_threads must be zero or positive')
         settings.seek_by_bytes = -1
         settings.file_iformat = NULL
         if 'f' in ff_opts:
@@ -362,6 +484,37 @@ cdef class MediaPlayer(object):
         settings.framedrop = bool(ff_opts['framedrop']) if 'framedrop' in ff_opts else -1
         # -1 means not infinite, not respected if real time.
         settings.infinite_buffer = 1 if 'infbuf' in ff_opts and ff_opts['infbuf'] else -1
+        self._set_queue_limits(
+            ff_opts.get('max_queue_size', MAX_QUEUE_SIZE),
+            ff_opts.get('min_frames', MIN_FRAMES),
+            ff_opts.get('min_queue_duration', 1.))
+        settings.video_queue_size = int(
+            ff_opts.get('video_queue_size', VIDEO_PICTURE_QUEUE_SIZE))
+        settings.audio_queue_size = int(
+            ff_opts.get('audio_queue_size', SAMPLE_QUEUE_SIZE))
+        if not 2 <= settings.video_queue_size <= FRAME_QUEUE_SIZE:
+            raise ValueError(
+                'video_queue_size must be between 2 and {}'.format(FRAME_QUEUE_SIZE))
+        if not 2 <= settings.audio_queue_size <= FRAME_QUEUE_SIZE:
+            raise ValueError(
+                'audio_queue_size must be between 2 and {}'.format(FRAME_QUEUE_SIZE))
+        settings.priority = int(ff_opts.get('priority', 0))
+        settings.unthrottled = bool(ff_opts.get('unthrottled', 0))
+        settings.keyframes_only = bool(ff_opts.get('keyframes_only', 0))
+        settings.every_nth = int(ff_opts.get('every_nth', 1))
+        settings.target_fps = float(ff_opts.get('target_fps', 0))
+        if settings.every_nth < 1:
+            raise ValueError('every_nth must be at least 1')
+        if settings.target_fps < 0:
+            raise ValueError('target_fps must be zero or positive')
+        settings.trace_size = int(ff_opts.get('trace', 0))
+        if settings.trace_size < 0:
+            raise ValueError('trace must be zero or positive')
+        self.trace_id = next(_trace_ids)
+        if settings.unthrottled:
+            settings.av_sync_type = AV_SYNC_VIDEO_MASTER
+            settings.framedrop = 0
+            settings.audio_disable = 1
 
         IF CONFIG_AVFILTER:
             if 'vf' in ff_opts:
@@ -415,12 +568,18 @@ cdef class MediaPlayer(object):
             self.mt_gen = MTGenerator(SDL_MT)
         elif thread_lib == 'python':
             self.mt_gen = MTGenerator(Py_MT)
+        elif thread_lib == 'native':
+            self.mt_gen = MTGenerator(Native_MT)
         else:
             raise Exception('Thread library parameter not recognized.')
 
         settings.audio_sdl = audio_sink == 'SDL'
-        if audio_sink != 'SDL':
+        if audio_sink not in ('SDL', 'buffer'):
             raise Exception('Audio sink "{}" not recognized'.format(audio_sink))
+        settings.audio_buffer_duration = float(ff_opts.get('audio_buffer_duration', 1.))
+        settings.audio_buffer_realtime = bool(ff_opts.get('audio_buffer_realtime', 0))
+        if settings.audio_buffer_duration <= 0:
+            raise ValueError('audio_buffer_duration must be positive')
         if callback is not None and not callable(callback):
             raise Exception('Video sink parameter not recognized.')
 
@@ -431,11 +590,36 @@ cdef class MediaPlayer(object):
         if out_fmt == AV_PIX_FMT_NONE:
             raise Exception('Unrecognized output pixel format.')
 
-        if not settings.audio_disable:
+        self.output_names = []
+        outputs = ff_opts_orig.get('outputs', {})
+        if outputs and not CONFIG_AVFILTER:
+            raise Exception('You can only add outputs when avfilter is enabled.')
+        if len(outputs) > MAX_OUTPUTS:
+            raise ValueError('At most {} outputs can be added.'.format(MAX_OUTPUTS))
+        for i, (name, opts) in enumerate(outputs.items()):
+            if name is None or name in self.output_names:
+                raise ValueError('Invalid output name {}.'.format(name))
+            output = &settings.outputs[i]
+            output.width = int(opts.get('x', 0))
+            output.height = int(opts.get('y', 0))
+            output.pix_fmt = out_fmt
+            if 'out_fmt' in opts:
+                output.pix_fmt = av_get_pix_fmt(opts['out_fmt'].encode('utf8'))
+                if <int>output.pix_fmt == <int>AV_PIX_FMT_NONE:
+                    raise Exception('Unrecognized output pixel format {}.'.format(opts['out_fmt']))
+            self.output_frames[i] = av_frame_alloc()
+            if self.output_frames[i] == NULL:
+                raise MemoryError()
+            self.output_names.append(name)
+        settings.nb_outputs = len(self.output_names)
+
+        if not settings.audio_disable and settings.audio_sdl:
             initialize_sdl_aud()
 
         self.next_image = Image.__new__(Image, no_create=True)
         self.ivs = VideoState(callback)
+        self.ivs.pool = pool
+        self.ivs.source = source
         paused = ff_opts.get('paused', False)
         with nogil:
             self.ivs.cInit(self.mt_gen, settings, paused, out_fmt)
@@ -451,6 +635,7 @@ cdef class MediaPlayer(object):
             After calling this method, calling any other class method on this instance may
             result in a crash or program corruption.
         '''
+        cdef int i
         if self.is_closed:
             return
         self.is_closed = 1
@@ -469,6 +654,8 @@ cdef class MediaPlayer(object):
         av_dict_free(&self.settings.sws_dict)
         IF CONFIG_AVFILTER:
             av_freep(&self.settings.vfilters_list)
+        for i in range(MAX_OUTPUTS):
+            av_frame_free(&self.output_frames[i])
         # avformat_network_deinit()
         av_free(self.settings.input_filename)
         # if self.settings.show_status:
@@ -476,7 +663,8 @@ cdef class MediaPlayer(object):
         # SDL_Quit()
         # av_log(NULL, AV_LOG_QUIET, b"")
 
-    def get_frame(self, force_refresh=False, show=True, *args):
+    def get_frame(self, force_refresh=False, show=True, *args, block=False, timeout=None,
+                  output=None):
         '''Retrieves the next available frame if ready.
 
         The frame is returned as a :class:`ffpyplayer.pic.Image`. If CONFIG_AVFILTER
@@ -495,6 +683,22 @@ cdef class MediaPlayer(object):
                 returned, even when one is available. Can be useful if we just need
                 the timestamps or when ``force_refresh`` to just get the timestamps.
                 Defaults to True.
+            `block`: bool
+                If True, instead of returning immediately when no frame is ready,
+                it waits (with the GIL released) until the next frame is due, the
+                player is paused, or eof is reached. Defaults to False.
+            `timeout`: float or None
+                When ``block`` is True, the maximum number of seconds to wait. If the
+                timeout elapses before a frame is ready, it returns as if ``block``
+                was False. If None, the default, it waits indefinitely.
+            `output`: str, list, or None
+                When additional outputs were added with the ``outputs`` option, the
+                name of the output whose image is returned instead of the main
+                image. If it's a list of names, the image is instead a dict mapping
+                each name to its image, where the name None is the main image. An
+                image may be None if the filters did not produce it. All the images
+                are filtered from the same decoded frame, so they share the returned
+                pts. If None, the default, the main image is returned.
 
         :returns:
 
@@ -601,13 +805,36 @@ cdef class MediaPlayer(object):
         '''
         cdef Image next_image = self.next_image
         cdef int res, f = force_refresh
-        cdef int s = show
-        cdef double pts, remaining_time
+        cdef int s = show, b = block
+        cdef double pts, remaining_time, wait
+        cdef double deadline = -1
+        cdef AVFrame **outputs = NULL
 
         if not s:
             next_image = None
+        elif output is not None:
+            names = output if isinstance(output, (list, tuple)) else [output]
+            for name in names:
+                if name is not None and name not in self.output_names:
+                    raise ValueError('Unknown output {}.'.format(name))
+            outputs = self.output_frames
+        if b and timeout is not None:
+            deadline = av_gettime_relative() / 1000000.0 + timeout
+
         with nogil:
-            res = self.ivs.video_refresh(next_image, &pts, &remaining_time, f)
+            while True:
+                res = self.ivs.video_refresh(next_image, &pts, &remaining_time, f, outputs)
+                if res != 3 or not b or self.ivs.video_st == NULL:
+                    break
+                f = 0
+
+                # with no frame in the queue we are woken when one is pushed
+                wait = remaining_time if remaining_time > 0 else 0.1
+                if deadline >= 0:
+                    wait = FFMIND(wait, deadline - av_gettime_relative() / 1000000.0)
+                    if wait <= 0:
+                        break
+                self.ivs.wait_for_frame(wait, remaining_time > 0)
 
         if res == 1:
             return (None, 'paused')
@@ -618,8 +845,404 @@ cdef class MediaPlayer(object):
 
         if s:
             self.next_image = Image.__new__(Image, no_create=True)
+            if outputs != NULL:
+                return ((self._get_output_images(next_image, output), pts), remaining_time)
         return ((next_image, pts), remaining_time)
 
+    cdef object _get_output_images(self, Image image, object output):
+        cdef Image img
+        cdef int i
+        images = {None: image}
+        for i, name in enumerate(self.output_names):
+            images[name] = None
+            if self.output_frames[i].buf[0] != NULL:
+                img = Image.__new__(Image, no_create=True)
+                img.cython_init(self.output_frames[i])
+                av_frame_unref(self.output_frames[i])
+                images[name] = img
+
+        if isinstance(output, (list, tuple)):
+            return {name: images[name] for name in output}
+        return images[output]
+
+    def get_frames(self, int n, out=None, pts=None, timeout=None, pix_fmt=None):
+        '''Retrieves the next ``n`` frames, waiting for each one as in
+        :meth:`get_frame` with ``block=True``, and copies their image data into
+        consecutive slots of a single contiguous buffer.
+
+        Each frame is copied once, directly from the output frame of the player,
+        with its planes packed without line padding. For the default ``rgb24``
+        output format, ``out`` can therefore be e.g. a numpy uint8 array of shape
+        ``(n, h, w, 3)``. When ``pix_fmt`` differs from the output format, each
+        frame is instead scaled directly into its slot.
+
+        :Parameters:
+
+            `n`: int
+                The maximum number of frames to read.
+            `out`: writable, C-contiguous, buffer-protocol object or None
+                The buffer into which the frames are copied. See
+                :meth:`ffpyplayer.pic.ImageLoader.get_frames`.
+            `pts`: writable, C-contiguous, buffer of doubles or None
+                Buffer into which the pts of the frames are written. See
+                :meth:`ffpyplayer.pic.ImageLoader.get_frames`.
+            `timeout`: float or None
+                The maximum total number of seconds to wait for the frames. If None,
+                the default, it waits indefinitely.
+            `pix_fmt`: str or None
+                The pixel format of the frames in ``out``. See
+                :meth:`ffpyplayer.pic.ImageLoader.get_frames`.
+
+        :returns:
+            a 3-tuple of ``(count, out, pts)``, where ``count`` is the number of
+            frames read. It is less than ``n`` if the player is paused, eof is
+            reached, or the timeout elapsed. See
+            :meth:`ffpyplayer.pic.ImageLoader.get_frames`.
+
+        All the frames must have the same size and pixel format, i.e. the output
+        size and format should not be changed while this is running.
+        '''
+        deadline = None if timeout is None else perf_counter() + timeout
+
+        def next_frame():
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - perf_counter(), 0)
+            return self.get_frame(block=True, timeout=remaining)[0]
+
+        return _fill_frame_batch(next_frame, n, out, pts, pix_fmt)
+
+    def get_audio(self, int n_samples, out=None, block=False, timeout=None):
+        '''Reads the next audio samples from the ring buffer of the ``'buffer'``
+        ``audio_sink``. The samples are copied directly from the ring buffer into
+        ``out`` without holding the GIL.
+
+        :Parameters:
+
+            `n_samples`: int
+                The maximum number of samples (per channel) to read.
+            `out`: writable, C-contiguous, buffer-protocol object or None
+                The buffer into which the interleaved signed 16 bit samples are
+                copied, e.g. a numpy int16 array of shape ``(n_samples, channels)``.
+                It must have at least ``n_samples`` times the size of a sample of
+                all the channels bytes. If None, a bytearray of that size is created
+                once the audio format is known.
+            `block`: bool
+                If False, the default, only the samples already available are read.
+                Otherwise, it waits until ``n_samples`` samples were read.
+            `timeout`: float or None
+                When blocking, the maximum number of seconds to wait. If None, the
+                default, it waits until the samples are read or the audio is closed.
+
+        :returns:
+            a 3-tuple of ``(count, out, pts)``, where ``count`` is the number of
+            samples read, ``out`` is the output buffer, or None if it was not
+            provided and the audio is not yet open, and ``pts`` is the time of the
+            first sample read, or NaN if none were read.
+
+        For example:
+
+        .. code-block:: python
+
+            >>> player = MediaPlayer(filename, audio_sink='buffer')
+            >>> count, out, pts = player.get_audio(4096, block=True, timeout=1)
+            >>> rate = player.get_metadata()['sink_sample_rate']
+        '''
+        cdef VideoState ivs = self.ivs
+        cdef Py_buffer view
+        cdef int frame_size
+        cdef int64_t size, n = 0, read
+        cdef double pts = NAN, sample_pts, remaining = -1, deadline = 0
+        cdef int c_block = bool(block)
+
+        if ivs.audio_buffer is None:
+            raise Exception("get_audio requires the 'buffer' audio_sink")
+        if n_samples <= 0:
+            raise ValueError('n_samples must be positive')
+        if timeout is not None:
+            remaining = max(timeout, 0)
+            deadline = perf_counter() + remaining
+
+        if c_block:
+            # the format is known once there are samples
+            with nogil:
+                ivs.audio_buffer.wait_readable(1, remaining)
+        frame_size = ivs.audio_buffer.frame_size
+        if not frame_size:
+            return 0, out, NAN
+
+        size = <int64_t>n_samples * frame_size
+        if out is None:
+            out = bytearray(size)
+        PyObject_GetBuffer(out, &view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS)
+        try:
+            if view.len < size:
+                raise ValueError(
+                    'out has {} bytes, but {} are needed'.format(view.len, size))
+
+            while True:
+                with nogil:
+                    read = ivs.read_audio(<uint8_t *>view.buf + n, size - n, &sample_pts)
+                if read and isnan(pts) and not n:
+                    pts = sample_pts
+                n += read
+                if n >= size or not c_block:
+                    break
+                if timeout is not None:
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        break
+                with nogil:
+                    read = ivs.audio_buffer.wait_readable(frame_size, remaining)
+                if not read:
+                    break
+        finally:
+            PyBuffer_Release(&view)
+        return n // frame_size, out, pts
+
+    def set_notify_fd(self, int fd):
+        '''Sets a file descriptor to which the internal threads write a byte
+        whenever a new video frame is ready to be read with :meth:`get_frame`,
+        or the player is paused, unpaused, or reaches eof.
+
+        This allows waiting for frames with e.g. ``select`` or an event loop,
+        rather than polling :meth:`get_frame`. See :class:`AsyncMediaPlayer`.
+
+        :Parameters:
+
+            `fd`: int
+                The file descriptor, e.g. the write end of a pipe, or on Windows
+                a socket. It should be non-blocking, because the threads write
+                to it while decoding. The bytes are only a wake up signal, so the
+                reader should drain it and then call :meth:`get_frame` until no
+                frame is returned. If -1, nothing is written. Defaults to -1.
+        '''
+        self.ivs.pictq.notify_fd = fd
+
+    def _set_queue_limits(self, max_queue_size, min_frames, min_queue_duration):
+        if max_queue_size <= 0:
+            raise ValueError('max_queue_size must be positive')
+        if min_frames < 0:
+            raise ValueError('min_frames must be zero or positive')
+        if min_queue_duration < 0:
+            raise ValueError('min_queue_duration must be zero or positive')
+        self.settings.max_queue_size = max_queue_size
+        self.settings.min_frames = min_frames
+        self.settings.min_queue_duration = min_queue_duration
+
+    def set_queue_limits(self, max_queue_size=None, min_frames=None, min_queue_duration=None):
+        '''Changes how much data is read ahead into the packet queues, while playing.
+
+        :Parameters:
+
+            `max_queue_size`: int or None
+                The maximum bytes of packets queued. See the ``ff_opts`` of the
+                same name. If None, it's not changed. Defaults to None.
+            `min_frames`: int or None
+                See the ``ff_opts`` of the same name. If None, it's not changed.
+                Defaults to None.
+            `min_queue_duration`: float or None
+                See the ``ff_opts`` of the same name. If None, it's not changed.
+                Defaults to None.
+        '''
+        self._set_queue_limits(
+            self.settings.max_queue_size if max_queue_size is None else max_queue_size,
+            self.settings.min_frames if min_frames is None else min_frames,
+            self.settings.min_queue_duration if min_queue_duration is None else min_queue_duration)
+        # so it reads more right away if the limits were raised
+        with nogil:
+            self.ivs.wake_read_thread()
+
+    def get_queue_usage(self):
+        '''Returns how full the packet and frame queues of the player currently are.
+
+        :returns:
+
+            A dict with the keys ``packet_bytes``, the bytes of packets currently
+            queued for all the streams, ``max_queue_size``, and ``video``, ``audio``,
+            and ``subtitle``. The latter are each a dict with the keys ``packets``,
+            ``bytes``, and ``duration`` in seconds of the packets queued for the stream,
+            and ``frames`` and ``max_frames``, the number of decoded frames queued
+            and the depth of the frame queue.
+
+        For example::
+
+            >>> player.get_queue_usage()
+            {'packet_bytes': 2291014, 'max_queue_size': 15728640,
+             'video': {'packets': 26, 'bytes': 2230417, 'duration': 1.04,
+                       'frames': 3, 'max_frames': 3},
+             'audio': {'packets': 49, 'bytes': 60597, 'duration': 1.04,
+                       'frames': 9, 'max_frames': 9},
+             'subtitle': {'packets': 0, 'bytes': 0, 'duration': 0.0,
+                          'frames': 0, 'max_frames': 16}}
+        '''
+        cdef VideoState ivs = self.ivs
+        usage = {
+            'packet_bytes': (ivs.audioq.packet_queue_size() + ivs.videoq.packet_queue_size() +
+                             ivs.subtitleq.packet_queue_size()),
+            'max_queue_size': self.settings.max_queue_size}
+        usage['video'] = _queue_usage(ivs.videoq, ivs.pictq, ivs.video_st)
+        usage['audio'] = _queue_usage(ivs.audioq, ivs.sampq, ivs.audio_st)
+        usage['subtitle'] = _queue_usage(ivs.subtitleq, ivs.subpq, ivs.subtitle_st)
+        return usage
+
+    def get_stats(self):
+        '''Returns the playback statistics of the player. These are the values
+        logged by the ``stats`` ``ff_opts`` option, and more, but they are read
+        directly rather than formatted.
+
+        The counters start from zero when the player or the stream is opened.
+        They are updated by the internal threads without locking so they may be
+        slightly out of date, but reading them is cheap.
+
+        :returns:
+
+            A dict with the keys:
+
+            `master_clock`: float
+                The current time of the master clock in seconds.
+            `av_diff`: float
+                The difference between the audio and video clocks, or the master
+                clock and the only stream, in seconds.
+            `frame_drops_early`, `frame_drops_late`: int
+                The video frames dropped before being queued, and when being
+                displayed, because they were late.
+            `frames_skipped`: int
+                The video frames, or packets dropped before decoding, that were
+                not returned due to the ``keyframes_only``, ``every_nth``, or
+                ``target_fps`` options.
+            `faulty_dts`, `faulty_pts`: int
+                The number of wrong dts and pts detected by the video decoder.
+            `filter_delay`: float
+                The last delay of the video filter graph in seconds.
+            `frames_decoded`, `audio_frames_decoded`: int
+                The number of video and audio frames decoded.
+            `decode_time`, `audio_decode_time`: float
+                The total time, in seconds, spent in the video and audio codecs.
+            `pool_threads`, `audio_pool_threads`: int
+                The codec threads the video and audio streams took from the
+                ``thread_budget`` of the :class:`PlayerPool`, if any.
+            `decode_time_per_frame`: float
+                The average decode time of a video frame in seconds.
+            `frames_displayed`: int
+                The number of frames returned by :meth:`get_frame`.
+            `sws_frames`: int
+                The number of frames converted to the output format or size.
+            `sws_time`, `sws_time_per_frame`: float
+                The total and average time, in seconds, spent converting them.
+            `packets_read`, `bytes_read`: int
+                The number and bytes of packets read from the input.
+            `queues`: dict
+                The fill of the packet and frame queues, see :meth:`get_queue_usage`.
+        '''
+        cdef VideoState ivs = self.ivs
+        cdef double master_clock, av_diff
+        cdef int64_t faulty_dts = 0, faulty_pts = 0
+
+        with nogil:
+            master_clock = ivs.get_master_clock()
+            av_diff = ivs.get_av_diff()
+        if ivs.video_st != NULL and ivs.viddec.avctx != NULL:
+            faulty_dts = ivs.viddec.avctx.pts_correction_num_faulty_dts
+            faulty_pts = ivs.viddec.avctx.pts_correction_num_faulty_pts
+
+        return {
+            'master_clock': master_clock, 'av_diff': av_diff,
+            'frame_drops_early': ivs.frame_drops_early,
+            'frame_drops_late': ivs.frame_drops_late,
+            'frames_skipped': ivs.frames_skipped + ivs.packets_skipped,
+            'faulty_dts': faulty_dts, 'faulty_pts': faulty_pts,
+            'filter_delay': ivs.frame_last_filter_delay,
+            'frames_decoded': ivs.viddec.frames_decoded,
+            'decode_time': ivs.viddec.decode_time / 1000000.,
+            'decode_time_per_frame': (
+                ivs.viddec.decode_time / 1000000. / ivs.viddec.frames_decoded
+                if ivs.viddec.frames_decoded else 0.),
+            'audio_frames_decoded': ivs.auddec.frames_decoded,
+            'audio_decode_time': ivs.auddec.decode_time / 1000000.,
+            'pool_threads': ivs.viddec.pool_threads,
+            'audio_pool_threads': ivs.auddec.pool_threads,
+            'frames_displayed': ivs.frames_displayed,
+            'sws_frames': ivs.pictq.sws_frames,
+            'sws_time': ivs.pictq.sws_time / 1000000.,
+            'sws_time_per_frame': (
+                ivs.pictq.sws_time / 1000000. / ivs.pictq.sws_frames
+                if ivs.pictq.sws_frames else 0.),
+            'packets_read': ivs.packets_read, 'bytes_read': ivs.bytes_read,
+            'queues': self.get_queue_usage()}
+
+    def get_trace(self, clear=False):
+        '''Returns the spans recorded since the last time the trace was cleared,
+        when the ``trace`` ``ff_opts`` option is used, as Chrome trace events.
+
+        Each span is a complete (``"ph": "X"``) event whose ``name`` is one of
+        ``demux`` (reading a packet), ``decode`` (decoding a frame, including waiting
+        for packets), ``filter`` (the video filter graph), ``queue_picture``
+        (converting the frame and waiting for space in the frame queue), or
+        ``get_frame`` (:meth:`get_frame` returning the frame, from when it was called).
+        Its ``args`` hold the ``stream`` index, the packet ``serial`` (which
+        changes on a seek), and the ``pts`` of the frame.
+
+        The player is a process in the trace and its threads are named. Once the
+        ring buffer is full the oldest spans are overwritten.
+
+        :Parameters:
+
+            `clear`: bool
+                If True, the returned spans are cleared from the trace. Defaults
+                to False.
+
+        :returns:
+
+            A list of dicts, the events. See also :meth:`save_trace`.
+        '''
+        cdef VideoState ivs = self.ivs
+        cdef TraceSpan span
+        cdef int64_t i, start, end
+        cdef int pid = self.trace_id
+        if ivs is None or ivs.trace == NULL:
+            return []
+
+        events = [
+            {'name': 'process_name', 'ph': 'M', 'pid': pid,
+             'args': {'name': 'MediaPlayer {}'.format(pid)}}]
+        events.extend([
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+             'args': {'name': name}} for tid, name in enumerate(_trace_threads)])
+
+        end = ivs.trace_windex
+        start = max(ivs.trace_rindex, end - ivs.trace_size)
+        for i in range(start, end):
+            # skip spans still being written or already overwritten
+            if not ivs.read_trace_span(i, &span):
+                continue
+            events.append({
+                'name': _trace_kinds[<int>span.kind], 'cat': 'ffpyplayer', 'ph': 'X',
+                'ts': span.start, 'dur': span.end - span.start, 'pid': pid,
+                'tid': <int>span.thread,
+                'args': {'stream': span.stream, 'serial': span.serial,
+                         'pts': None if isnan(span.pts) else span.pts}})
+
+        if clear:
+            ivs.trace_rindex = end
+        return events
+
+    def save_trace(self, filename, clear=False):
+        '''Saves the trace returned by :meth:`get_trace` as a JSON file that
+        can be opened in ``chrome://tracing`` or https://ui.perfetto.dev.
+
+        :Parameters:
+
+            `filename`: str
+                The file to write.
+            `clear`: bool
+                Passed to :meth:`get_trace`. Defaults to False.
+        '''
+        with open(filename, 'w') as fh:
+            json.dump(
+                {'traceEvents': self.get_trace(clear=clear), 'displayTimeUnit': 'ms'},
+                fh)
+
     def get_metadata(self):
         '''Returns metadata of the file being played.
 
@@ -630,7 +1253,8 @@ cdef class MediaPlayer(object):
                 numerator and denominator. src and sink video sizes correspond to
                 the frame size of the original video, and the frames returned by
                 :meth:`get_frame`, respectively. `src_pix_fmt` is the pixel format
-                of the original input stream. 'aspect_ratio' is the source to
+                of the original input stream. `sink_sample_rate` and `sink_channels`
+                are the format of the audio output, or zero until it is open. 'aspect_ratio' is the source to
                 display aspect ratio as a numerator and denominator. Duration
                 is the file duration and defaults to None until updated.
 
@@ -683,8 +1307,9 @@ cdef class MediaPlayer(object):
         '''
         self.settings.audio_volume = av_clip(volume * SDL_MIX_MAXVOLUME, 0, SDL_MIX_MAXVOLUME)
         IF USE_SDL2_MIXER:
-            with nogil:
-                Mix_Volume(self.ivs.audio_dev, self.settings.audio_volume)
+            if self.settings.audio_sdl:
+                with nogil:
+                    Mix_Volume(self.ivs.audio_dev, self.settings.audio_volume)
 
     def get_volume(self):
         '''Returns the volume of the audio.
@@ -1063,3 +1688,178 @@ cdef class MediaPlayer(object):
                 if self.ivs.ic.start_time != AV_NOPTS_VALUE and t_pos < self.ivs.ic.start_time:
                     t_pos = self.ivs.ic.start_time
         self.ivs.stream_seek(t_pos, t_rel, seek_by_bytes, accurate)
+
+
+cdef dict _queue_usage(FFPacketQueue pktq, FrameQueue frameq, AVStream *st):
+    return {
+        'packets': pktq.packet_queue_nb_packets(), 'bytes': pktq.packet_queue_size(),
+        'duration': pktq.packet_queue_duration() * av_q2d(st.time_base) if st != NULL else 0.,
+        'frames': frameq.size, 'max_frames': frameq.max_size}
+
+
+class AsyncMediaPlayer(object):
+    '''An asyncio based wrapper of :class:`MediaPlayer`, which provides the
+    frames through coroutines instead of polling :meth:`MediaPlayer.get_frame`.
+
+    The internal threads of the player write to a socket registered with the
+    event loop whenever a frame is decoded (see :meth:`MediaPlayer.set_notify_fd`),
+    and the callbacks of the player (eof, thread exits, and errors) are passed
+    through the same socket. Frames that are not yet due to be displayed are
+    waited for with a timer of the loop. So no thread or polling is required
+    for each player, and a single loop can serve many players.
+
+    Because this uses :meth:`asyncio.loop.add_reader`, on Windows the loop must
+    be a selector event loop.
+
+    :Parameters:
+
+        `filename`: str
+            The media to play, see :class:`MediaPlayer`.
+        `callback`: function or None
+            If not None, it is called in the event loop with the ``selector`` and
+            ``value`` of each callback of the player, see :class:`MediaPlayer`.
+            Defaults to None.
+        `loop`: asyncio event loop or None
+            The loop to use. If None, the running loop is used. Defaults to None.
+        `**kwargs`:
+            Passed on to :class:`MediaPlayer`. E.g. ``ff_opts={'unthrottled': True}``
+            returns the frames as fast as they can be decoded.
+
+    For example:
+
+    .. code-block:: python
+
+        async def play(filename):
+            player = AsyncMediaPlayer(filename)
+            try:
+                async for img, pts in player.frames():
+                    print(pts, img.get_size())
+            finally:
+                player.close()
+
+    .. attribute:: player
+
+        The underlying :class:`MediaPlayer`. Its methods e.g.
+        :meth:`MediaPlayer.set_pause` or :meth:`MediaPlayer.seek` can be used
+        directly.
+    '''
+
+    def __init__(self, filename, callback=None, loop=None, **kwargs):
+        import asyncio
+        import socket
+        from collections import deque
+        from weakref import WeakMethod
+
+        self._loop = asyncio.get_running_loop() if loop is None else loop
+        self._callback = callback
+        self._frames = deque()
+        self._events = deque()
+        self._waiter = None
+        self._timer = None
+        self._eof = False
+        self._closed = False
+
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._wsock.setblocking(False)
+
+        self.player = MediaPlayer(
+            filename, callback=WeakMethod(self._player_callback), **kwargs)
+        self.player.set_notify_fd(self._wsock.fileno())
+        self._loop.add_reader(self._rsock.fileno(), self._read_ready)
+        # frames may have been queued before we started listening
+        self._loop.call_soon(self._poll)
+
+    def _player_callback(self, selector, value):
+        # called from the internal threads of the player
+        self._events.append((selector, value))
+        try:
+            self._wsock.send(b'c')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _read_ready(self):
+        try:
+            while self._rsock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+        while self._events:
+            selector, value = self._events.popleft()
+            if self._callback is not None:
+                self._callback(selector, value)
+        self._poll()
+
+    def _poll(self):
+        if self._closed:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # only buffer one frame, the rest wait in the player's own queue so
+        # that a slow consumer applies back pressure to the decoder
+        if self._frames:
+            return
+        frame, val = self.player.get_frame()
+        if frame is not None:
+            self._frames.append(frame)
+        elif val == 'eof':
+            self._eof = True
+        elif val != 'paused' and val > 0:
+            # a frame is queued, but it's not yet time to display it
+            self._timer = self._loop.call_later(val, self._poll)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            if self._frames or self._eof or self._closed:
+                self._waiter.set_result(None)
+
+    async def get_frame(self):
+        '''Waits for the next frame and returns it.
+
+        :returns:
+
+            A 2-tuple of ``(image, pts)`` as returned by :meth:`MediaPlayer.get_frame`,
+            or None once eof is reached or the player is closed.
+        '''
+        if not self._frames:
+            self._poll()
+        while not self._frames:
+            if self._eof or self._closed:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._frames.popleft()
+
+    async def frames(self):
+        '''An async iterator that yields the ``(image, pts)`` of each frame, see
+        :meth:`get_frame`, until eof.
+        '''
+        while True:
+            frame = await self.get_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        '''Closes the player and stops listening for its frames. Any pending
+        :meth:`get_frame` returns None.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # stops the internal threads before the socket is closed
+        self.player.close_player()
+        self._loop.remove_reader(self._rsock.fileno())
+        self._rsock.close()
+        self._wsock.close()
+        self._wake()
@@ -0,0 +1,55 @@
+include '../includes/ffmpeg.pxi'
+
+from ffpyplayer.threading cimport MTCond
+
+
+cdef struct PoolWaiter:
+    # the fill level of the frame queue into which the decoder outputs
+    int *size
+    int max_size
+    int granted
+    PoolWaiter *next
+
+
+cdef struct PoolMember:
+    # the bytes of packets buffered by the player
+    int64_t memory
+    int priority
+    int registered
+    # whether one of the player's streams is about to run out of packets
+    int starving
+    PoolMember *next
+
+
+cdef class PlayerPool(object):
+    cdef:
+        MTCond cond
+        # the number of decoders that may decode simultaneously
+        int workers
+        # the number of codec threads divided between the open streams
+        int thread_budget
+        # the share of the budget of each stream
+        int stream_threads
+        int streams
+        int threads_used
+        int busy
+        int waiting
+        PoolWaiter *waiters
+        int64_t slices
+        int64_t waits
+        int64_t wait_time
+
+        # the bytes of packets all the players may buffer, or 0 if unlimited
+        int64_t memory_budget
+        int64_t memory_used
+        PoolMember *members
+        int64_t throttled
+
+    cdef int add_stream(PlayerPool self, int reserve) nogil except -1
+    cdef int remove_stream(PlayerPool self, int threads) nogil except 1
+    cdef int acquire(PlayerPool self, int *size, int max_size, int *abort_request) nogil except 2
+    cdef int release(PlayerPool self) nogil except 1
+    cdef int wake(PlayerPool self) nogil except 1
+    cdef int add_member(PlayerPool self, PoolMember *member, int priority) nogil except 1
+    cdef int remove_member(PlayerPool self, PoolMember *member) nogil except 1
+    cdef int update_memory(PlayerPool self, PoolMember *member, int64_t memory, int starving) nogil except 2
@@ -0,0 +1,292 @@
+'''
+Player pool
+===========
+
+A :class:`PlayerPool` shares the CPU between many :class:`~ffpyplayer.player.MediaPlayer`
+instances playing simultaneously.
+'''
+
+__all__ = ('PlayerPool', )
+
+include '../includes/ff_consts.pxi'
+
+from ffpyplayer.threading cimport Native_MT
+
+
+cdef class PlayerPool(object):
+    '''A pool that limits the decoding work of all the players that use it.
+
+    Each player still has its own read and decoder threads, however, a decoder
+    thread must take one of the ``workers`` slots of the pool before it decodes a
+    packet, and holds it while sending the packet to and receiving its frames
+    from the codec. It's released when a frame is returned or when waiting for
+    the next packet. When all the slots are taken, the
+    waiting decoders get the next free slot ordered by how full their output
+    frame queue is, so that the players that are closest to running out of frames
+    are decoded first. Threads waiting for a packet or for space in their
+    queue don't take a slot.
+
+    Similarly, rather than each stream starting as many codec threads as there
+    are CPUs (``threads`` is ``'auto'`` by default), each stream opened in the
+    pool gets a fixed share of the ``thread_budget``, ``stream_threads``. As
+    only ``workers`` decoders decode at the same time, the share defaults to the
+    budget divided between the workers. A stream gets less only when fewer
+    threads than its share are still free, so the total never exceeds the
+    budget. Threads are returned to the budget when the stream is closed. A
+    stream whose share is a single thread decodes on its decoder thread and
+    starts no codec threads. If ``threads`` is given explicitly in the
+    ``ff_opts`` of a player it's used instead.
+
+    Finally, the pool can limit the total bytes of packets read ahead by all its
+    players. When over the ``memory_budget``, the players with the lowest
+    ``priority`` (see the ``ff_opts`` of :class:`~ffpyplayer.player.MediaPlayer`)
+    that have any packets buffered stop reading until the usage drops back under
+    the budget, or until one of their streams is about to run out of packets.
+    Players with a stream that is about to run out are never stopped, because
+    e.g. a drained audio stream would stall the clock that drains the others.
+
+    :Parameters:
+
+        `workers`: int
+            The number of decoders that may decode at the same time. If zero,
+            the number of CPUs is used. Defaults to zero.
+        `thread_budget`: int
+            The total number of codec threads to divide between the streams. If
+            zero, the number of CPUs is used. Defaults to zero.
+        `stream_threads`: int
+            The number of codec threads each stream takes from the
+            ``thread_budget``. If zero, ``thread_budget // workers`` (at least
+            one) is used. Defaults to zero.
+        `memory_budget`: int
+            The total bytes of packets that the players may buffer. If zero, only
+            the ``max_queue_size`` of each player limits it. Defaults to zero.
+
+    For example:
+
+    .. code-block:: python
+
+        from ffpyplayer.player import MediaPlayer, PlayerPool
+
+        pool = PlayerPool(workers=8, thread_budget=16)
+        players = [MediaPlayer(filename, pool=pool) for filename in filenames]
+    '''
+
+    def __cinit__(PlayerPool self, int workers=0, int thread_budget=0,
+                  int64_t memory_budget=0, int stream_threads=0):
+        if workers < 0:
+            raise ValueError('workers must be zero or positive')
+        if thread_budget < 0:
+            raise ValueError('thread_budget must be zero or positive')
+        if stream_threads < 0:
+            raise ValueError('stream_threads must be zero or positive')
+        if memory_budget < 0:
+            raise ValueError('memory_budget must be zero or positive')
+
+        self.workers = workers if workers else av_cpu_count()
+        self.thread_budget = thread_budget if thread_budget else av_cpu_count()
+        self.stream_threads = (
+            stream_threads if stream_threads else
+            max(self.thread_budget // self.workers, 1))
+        self.streams = self.threads_used = self.busy = self.waiting = 0
+        self.waiters = NULL
+        self.slices = self.waits = self.wait_time = 0
+        self.memory_budget = memory_budget
+        self.memory_used = self.throttled = 0
+        self.members = NULL
+        self.cond = MTCond.__new__(MTCond, Native_MT)
+
+    cdef int add_stream(PlayerPool self, int reserve) nogil except -1:
+        '''Adds a stream about to be opened. If ``reserve``, its share of the
+        ``thread_budget`` is taken and returned, otherwise it returns 0. The
+        returned threads must be passed back to :meth:`remove_stream`.
+        '''
+        cdef int threads = 0
+        self.cond.lock()
+        self.streams += 1
+        if reserve:
+            threads = min(self.stream_threads, self.thread_budget - self.threads_used)
+            # a single threaded codec doesn't start any threads
+            if threads > 1:
+                self.threads_used += threads
+            else:
+                threads = 1
+        self.cond.unlock()
+        return threads
+
+    cdef int remove_stream(PlayerPool self, int threads) nogil except 1:
+        self.cond.lock()
+        self.streams -= 1
+        if threads > 1:
+            self.threads_used -= threads
+        self.cond.unlock()
+        return 0
+
+    cdef int acquire(PlayerPool self, int *size, int max_size, int *abort_request) nogil except 2:
+        '''Waits until a slot is free. Returns 0 when the slot was taken and must
+        be released with :meth:`release`, or 1 if ``abort_request`` was set while
+        waiting, in which case no slot was taken.
+        '''
+        cdef PoolWaiter waiter
+        cdef PoolWaiter **w
+        cdef int64_t ts
+
+        self.cond.lock()
+        self.slices += 1
+        if self.busy < self.workers and self.waiters == NULL:
+            self.busy += 1
+            self.cond.unlock()
+            return 0
+
+        waiter.size = size
+        waiter.max_size = max(max_size, 1)
+        waiter.granted = 0
+        waiter.next = NULL
+        w = &self.waiters
+        while w[0] != NULL:
+            w = &w[0].next
+        w[0] = &waiter
+        self.waiting += 1
+        self.waits += 1
+
+        ts = av_gettime_relative()
+        while not waiter.granted and not abort_request[0]:
+            self.cond.cond_wait()
+        self.wait_time += av_gettime_relative() - ts
+
+        if not waiter.granted:
+            w = &self.waiters
+            while w[0] != &waiter:
+                w = &w[0].next
+            w[0] = waiter.next
+            self.waiting -= 1
+        self.cond.unlock()
+        return 0 if waiter.granted else 1
+
+    cdef int release(PlayerPool self) nogil except 1:
+        '''Releases the slot and hands it to the waiting decoder whose frame
+        queue is the least full.
+        '''
+        cdef PoolWaiter **w
+        cdef PoolWaiter **best = NULL
+        cdef double fill, best_fill = 0
+
+        self.cond.lock()
+        self.busy -= 1
+        if self.waiters != NULL and self.busy < self.workers:
+            w = &self.waiters
+            while w[0] != NULL:
+                fill = w[0].size[0] / <double>w[0].max_size
+                if best == NULL or fill < best_fill:
+                    best = w
+                    best_fill = fill
+                w = &w[0].next
+
+            best[0].granted = 1
+            best[0] = best[0].next
+            self.waiting -= 1
+            self.busy += 1
+            self.cond.cond_broadcast()
+        self.cond.unlock()
+        return 0
+
+    cdef int wake(PlayerPool self) nogil except 1:
+        '''Wakes the waiting decoders so they can check their abort request.
+        '''
+        self.cond.lock()
+        self.cond.cond_broadcast()
+        self.cond.unlock()
+        return 0
+
+    cdef int add_member(PlayerPool self, PoolMember *member, int priority) nogil except 1:
+        self.cond.lock()
+        member.memory = 0
+        member.starving = 0
+        member.priority = priority
+        member.registered = 1
+        member.next = self.members
+        self.members = member
+        self.cond.unlock()
+        return 0
+
+    cdef int remove_member(PlayerPool self, PoolMember *member) nogil except 1:
+        cdef PoolMember **m
+        self.cond.lock()
+        if member.registered:
+            m = &self.members
+            while m[0] != member:
+                m = &m[0].next
+            m[0] = member.next
+            self.memory_used -= member.memory
+            member.memory = 0
+            member.registered = 0
+        self.cond.unlock()
+        return 0
+
+    cdef int update_memory(PlayerPool self, PoolMember *member, int64_t memory, int starving) nogil except 2:
+        '''Updates the bytes buffered by the player and returns 1 if it should
+        stop reading because the pool is over budget, otherwise 0. A player
+        ``starving`` for packets in one of its streams is never stopped.
+        '''
+        cdef PoolMember *m
+        cdef int lowest
+        cdef int throttle = 0
+
+        self.cond.lock()
+        self.memory_used += memory - member.memory
+        member.memory = memory
+        member.starving = starving
+        if (self.memory_budget and memory and not starving and
+                self.memory_used > self.memory_budget):
+            # only the lowest priority players still holding packets, and that
+            # are not starving, wait
+            lowest = member.priority
+            m = self.members
+            while m != NULL:
+                if m.memory and not m.starving and m.priority < lowest:
+                    lowest = m.priority
+                m = m.next
+            throttle = member.priority == lowest
+            if throttle:
+                self.throttled += 1
+        self.cond.unlock()
+        return throttle
+
+    def set_memory_budget(PlayerPool self, int64_t memory_budget):
+        '''Sets the ``memory_budget``, see :class:`PlayerPool`. Takes effect
+        immediately.
+        '''
+        if memory_budget < 0:
+            raise ValueError('memory_budget must be zero or positive')
+        self.cond.lock()
+        self.memory_budget = memory_budget
+        self.cond.unlock()
+
+    def get_stats(PlayerPool self):
+        '''Returns a dict with the current state of the pool.
+
+        :returns:
+
+            A dict with the keys: ``workers``, ``thread_budget`` and
+            ``stream_threads``, the parameters of the pool; ``streams``, the number of open streams;
+            ``threads_used``, the codec threads they took from the budget; ``busy`` and
+            ``waiting``, the number of decoders currently decoding and waiting for
+            a slot; ``slices``, the total number of decode slots requested;
+            ``waits``, how many of them had to wait; ``wait_time``, the total
+            time in seconds spent waiting; ``memory_budget`` and ``memory_used``,
+            the budget and the bytes of packets currently buffered by the players;
+            and ``throttled``, how many times a player's reading was paused because
+            of the budget.
+        '''
+        cdef dict stats
+        self.cond.lock()
+        stats = {
+            'workers': self.workers, 'thread_budget': self.thread_budget,
+            'stream_threads': self.stream_threads,
+            'streams': self.streams, 'threads_used': self.threads_used,
+            'busy': self.busy,
+            'waiting': self.waiting, 'slices': self.slices,
+            'waits': self.waits, 'wait_time': self.wait_time / 1000000.,
+            'memory_budget': self.memory_budget, 'memory_used': self.memory_used,
+            'throttled': self.throttled}
+        self.cond.unlock()
+        return stats
@@ -7,23 +7,60 @@ cdef struct MyAVPacketList:
     AVPacket *pkt
     int serial
 
+# a block of the packet ring. The producer links a new segment once the last one
+# is full, and the consumer frees a segment once it read all of its packets
+cdef struct PacketSegment:
+    MyAVPacketList items[PACKET_SEGMENT_SIZE]
+    PacketSegment *next
+
 
 cdef class FFPacketQueue(object):
     cdef:
         MTGenerator mt_gen
-        AVFifoBuffer *pkt_list
-        int nb_packets
-        int size
-        int64_t duration
+        # the producer (read) thread appends at windex of wseg and the consumer
+        # (decoder) thread reads at rindex of rseg, so only waiting requires the lock
+        PacketSegment *wseg
+        PacketSegment *rseg
+        int windex
+        int rindex
+        # the running totals of the packets, bytes, and duration put by the
+        # producer, read by the consumer, and put before the last flush. Each is
+        # only written by one thread and is accessed atomically. The queue holds
+        # the put total minus the larger of the read and flushed totals
+        int64_t packets_in
+        int64_t bytes_in
+        int64_t duration_in
+        int64_t packets_out
+        int64_t bytes_out
+        int64_t duration_out
+        int64_t packets_flushed
+        int64_t bytes_flushed
+        int64_t duration_flushed
         int abort_request
         int serial
+        # the number of threads blocked in packet_queue_get
+        int waiting
+        # the number of puts in progress, which packet_queue_abort waits for
+        int putting
+        # while the read thread waits for the queue to drain, the decoder wakes it
+        # once at most low_water_packets packets are queued or, if the packets have
+        # a duration, at most low_water_duration. low_water_packets is -1 otherwise
+        int low_water_packets
+        int64_t low_water_duration
         MTCond cond
 
+    cdef int packet_queue_nb_packets(FFPacketQueue self) nogil
+    cdef int packet_queue_size(FFPacketQueue self) nogil
+    cdef int64_t packet_queue_duration(FFPacketQueue self) nogil
+    cdef int wake_waiting(FFPacketQueue self) nogil except 1
     cdef int packet_queue_put_private(FFPacketQueue self, AVPacket *pkt) nogil except 1
     cdef int packet_queue_put_nullpacket(FFPacketQueue self, AVPacket *pkt, int stream_index) nogil except 1
     cdef int packet_queue_put(FFPacketQueue self, AVPacket *pkt) nogil except 1
     cdef int packet_queue_flush(FFPacketQueue self) nogil except 1
+    cdef int packet_queue_pop(FFPacketQueue self, MyAVPacketList *pkt1) nogil
+    cdef int packet_queue_drop_flushed(FFPacketQueue self) nogil
     cdef int packet_queue_abort(FFPacketQueue self) nogil except 1
     cdef int packet_queue_start(FFPacketQueue self) nogil except 1
+    cdef int below_low_water(FFPacketQueue self) nogil
     # return < 0 if aborted, 0 if no packet and > 0 if packet.
     cdef int packet_queue_get(FFPacketQueue self, AVPacket *pkt, int block, int *serial) nogil except 0
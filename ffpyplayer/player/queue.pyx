@@ -3,54 +3,124 @@ __all__ = ('FFPacketQueue', )
 
 include '../includes/ff_consts.pxi'
 
+cdef extern from "stdlib.h" nogil:
+    void *malloc(size_t)
+    void free(void *)
+
+cdef extern from "errno.h" nogil:
+    int ENOMEM
+
+cdef extern from "clib/mt_native.h" nogil:
+    int native_atomic_load(int *)
+    void native_atomic_store(int *, int)
+    int native_atomic_add(int *, int)
+    int64_t native_atomic_load64(int64_t *)
+    void native_atomic_store64(int64_t *, int64_t)
+    int64_t native_atomic_load64_acquire(int64_t *)
+    void native_atomic_store64_release(int64_t *, int64_t)
+
 from ffpyplayer.threading cimport MTGenerator, MTMutex, MTCond
 
 
 cdef class FFPacketQueue(object):
+    '''A single producer, single consumer queue of packets.
+
+    The packets are kept in a ring of segments that grows as needed. The read
+    thread puts and flushes packets and the decoder thread gets them, without
+    locking. The condition is only used when the decoder has to wait for a
+    packet, and when aborting.
+    '''
 
     def __cinit__(FFPacketQueue self, MTGenerator mt_gen):
         self.mt_gen = mt_gen
-        self.pkt_list = NULL
-        self.nb_packets = self.size = self.serial = 0
-        self.duration = 0
+        self.wseg = self.rseg = NULL
+        self.windex = self.rindex = 0
+        self.packets_in = self.bytes_in = self.duration_in = 0
+        self.packets_out = self.bytes_out = self.duration_out = 0
+        self.packets_flushed = self.bytes_flushed = self.duration_flushed = 0
+        self.serial = self.waiting = self.putting = 0
+        self.low_water_packets = self.low_water_duration = -1
 
-        self.pkt_list = av_fifo_alloc(sizeof(MyAVPacketList))
-        if self.pkt_list == NULL:
+        self.wseg = <PacketSegment *>malloc(sizeof(PacketSegment))
+        if self.wseg == NULL:
             raise MemoryError
+        self.wseg.next = NULL
+        self.rseg = self.wseg
 
         self.cond = MTCond.__new__(MTCond, mt_gen.mt_src)
         self.abort_request = 1
 
     def __dealloc__(self):
+        cdef PacketSegment *seg
         if self.cond is None:
             return
         with nogil:
             self.packet_queue_flush()
-            av_fifo_freep(&self.pkt_list)
+            self.packet_queue_drop_flushed()
+            while self.rseg != NULL:
+                seg = self.rseg.next
+                free(self.rseg)
+                self.rseg = seg
+
+    cdef int packet_queue_nb_packets(FFPacketQueue self) nogil:
+        # the read totals are loaded first, so they never exceed the put total
+        cdef int64_t out = max(native_atomic_load64_acquire(&self.packets_out),
+                               native_atomic_load64_acquire(&self.packets_flushed))
+        return <int>(native_atomic_load64_acquire(&self.packets_in) - out)
+
+    cdef int packet_queue_size(FFPacketQueue self) nogil:
+        cdef int64_t out = max(native_atomic_load64_acquire(&self.bytes_out),
+                               native_atomic_load64_acquire(&self.bytes_flushed))
+        return <int>(native_atomic_load64_acquire(&self.bytes_in) - out)
+
+    cdef int64_t packet_queue_duration(FFPacketQueue self) nogil:
+        cdef int64_t out = max(native_atomic_load64_acquire(&self.duration_out),
+                               native_atomic_load64_acquire(&self.duration_flushed))
+        return native_atomic_load64_acquire(&self.duration_in) - out
+
+    cdef int wake_waiting(FFPacketQueue self) nogil except 1:
+        '''Wakes the decoder after a packet was put, if it's waiting for one.
+
+        packets_in is stored before waiting is read, and the decoder increments
+        waiting before reading packets_in, both sequentially consistent, so
+        either the decoder sees the packet or waiting is seen here. Signaling
+        with the lock held ensures the decoder is already waiting.
+        '''
+        if native_atomic_load(&self.waiting):
+            self.cond.lock()
+            self.cond.cond_broadcast()
+            self.cond.unlock()
+        return 0
 
     cdef int packet_queue_put_private(FFPacketQueue self, AVPacket *pkt) nogil except 1:
-        cdef MyAVPacketList pkt1
-        cdef int ret
+        cdef MyAVPacketList *pkt1
+        cdef PacketSegment *seg
 
-        if self.abort_request:
+        if native_atomic_load(&self.abort_request):
             return -1
 
-        if av_fifo_space(self.pkt_list) < sizeof(pkt1):
-            ret = av_fifo_grow(self.pkt_list, sizeof(pkt1))
-            if ret < 0:
-                return ret
+        if self.windex == PACKET_SEGMENT_SIZE:
+            seg = <PacketSegment *>malloc(sizeof(PacketSegment))
+            if seg == NULL:
+                return AVERROR(ENOMEM)
+            seg.next = NULL
+            # published to the decoder together with the packet below
+            self.wseg.next = seg
+            self.wseg = seg
+            self.windex = 0
 
+        pkt1 = &self.wseg.items[self.windex]
         pkt1.pkt = pkt
         pkt1.serial = self.serial
+        self.windex += 1
 
-        ret = av_fifo_generic_write(self.pkt_list, &pkt1, sizeof(pkt1), NULL)
-        if ret < 0:
-            return ret
-        self.nb_packets += 1
-        self.size += pkt1.pkt.size + sizeof(pkt1)
-        self.duration += pkt1.pkt.duration
+        native_atomic_store64_release(
+            &self.bytes_in, self.bytes_in + pkt.size + sizeof(MyAVPacketList))
+        native_atomic_store64_release(&self.duration_in, self.duration_in + pkt.duration)
+        # publishes the packet to the decoder
+        native_atomic_store64(&self.packets_in, self.packets_in + 1)
         #/* XXX: should duplicate packet data in DV case */
-        self.cond.cond_signal()
+        self.wake_waiting()
         return 0
 
     cdef int packet_queue_put(FFPacketQueue self, AVPacket *pkt) nogil except 1:
@@ -62,9 +132,16 @@ cdef class FFPacketQueue(object):
             return -1
         av_packet_move_ref(pkt1, pkt)
 
-        self.cond.lock()
+        # putting is incremented before abort_request is read, and abort sets
+        # abort_request before reading putting, so abort either waits for us or
+        # we see the abort and don't touch the ring
+        native_atomic_add(&self.putting, 1)
         ret = self.packet_queue_put_private(pkt1)
-        self.cond.unlock()
+        if (not native_atomic_add(&self.putting, -1) and
+                native_atomic_load(&self.abort_request)):
+            self.cond.lock()
+            self.cond.cond_broadcast()
+            self.cond.unlock()
 
         if ret < 0:
             av_packet_free(&pkt1)
@@ -76,67 +153,105 @@ cdef class FFPacketQueue(object):
         return self.packet_queue_put(pkt)
 
     cdef int packet_queue_flush(FFPacketQueue self) nogil except 1:
-        cdef MyAVPacketList pkt1
-        cdef int ret = 0
+        '''Empties the queue. It's called by the read thread, or when it doesn't
+        put packets, e.g. when aborted.
 
+        The decoder may be reading one of the packets, so the packets are only
+        marked as flushed and they're freed by the decoder on its next get, or
+        by :meth:`packet_queue_drop_flushed` once the decoder exited.
+        '''
         self.cond.lock()
-        while av_fifo_size(self.pkt_list) >= sizeof(pkt1):
-            ret = av_fifo_generic_read(self.pkt_list, &pkt1, sizeof(pkt1), NULL)
-            if ret < 0:
-                break
-            av_packet_free(&pkt1.pkt)
-
-        self.nb_packets = 0
-        self.size = 0
-        self.duration = 0
+        native_atomic_store64_release(&self.bytes_flushed, self.bytes_in)
+        native_atomic_store64_release(&self.duration_flushed, self.duration_in)
+        native_atomic_store64_release(&self.packets_flushed, self.packets_in)
         self.serial += 1
         self.cond.unlock()
-        return ret
+        return 0
 
     cdef int packet_queue_abort(FFPacketQueue self) nogil except 1:
         self.cond.lock()
-        self.abort_request = 1
-        self.cond.cond_signal()
+        native_atomic_store(&self.abort_request, 1)
+        self.cond.cond_broadcast()
+        # a put that started before the abort may still be writing to the ring
+        while native_atomic_load(&self.putting):
+            self.cond.cond_wait()
         self.cond.unlock()
         return 0
 
     cdef int packet_queue_start(FFPacketQueue self) nogil except 1:
         self.cond.lock()
-        self.abort_request = 0
+        native_atomic_store(&self.abort_request, 0)
         self.serial += 1
         self.cond.unlock()
         return 0
 
+    cdef int below_low_water(FFPacketQueue self) nogil:
+        cdef int64_t duration
+        if self.low_water_packets < 0:
+            return 0
+        duration = self.packet_queue_duration()
+        return (self.packet_queue_nb_packets() <= self.low_water_packets or
+                duration and duration <= self.low_water_duration)
+
+    cdef int packet_queue_pop(FFPacketQueue self, MyAVPacketList *pkt1) nogil:
+        '''Moves the oldest packet into pkt1 and returns 1, or returns 0 if the
+        queue is empty. Only called by the decoder.
+        '''
+        cdef PacketSegment *seg
+        if native_atomic_load64(&self.packets_in) == self.packets_out:
+            return 0
+
+        # the producer moved on to the next segment before putting this packet
+        if self.rindex == PACKET_SEGMENT_SIZE:
+            seg = self.rseg.next
+            free(self.rseg)
+            self.rseg = seg
+            self.rindex = 0
+
+        pkt1[0] = self.rseg.items[self.rindex]
+        self.rindex += 1
+
+        native_atomic_store64_release(
+            &self.bytes_out, self.bytes_out + pkt1.pkt.size + sizeof(MyAVPacketList))
+        native_atomic_store64_release(&self.duration_out, self.duration_out + pkt1.pkt.duration)
+        native_atomic_store64_release(&self.packets_out, self.packets_out + 1)
+        return 1
+
+    cdef int packet_queue_drop_flushed(FFPacketQueue self) nogil:
+        '''Frees the packets put before the last flush that were not read yet.
+        Only called by the decoder, or once it exited.
+        '''
+        cdef MyAVPacketList pkt1
+        cdef int64_t flushed = native_atomic_load64_acquire(&self.packets_flushed)
+        while self.packets_out < flushed and self.packet_queue_pop(&pkt1):
+            av_packet_free(&pkt1.pkt)
+        return 0
+
     # return < 0 if aborted, 0 if no packet and > 0 if packet.
     cdef int packet_queue_get(FFPacketQueue self, AVPacket *pkt, int block, int *serial) nogil except 0:
         cdef MyAVPacketList pkt1
-        cdef int ret = 0
-
-        self.cond.lock()
 
         while True:
             if self.abort_request:
-                ret = -1
-                break
+                return -1
 
-            if av_fifo_size(self.pkt_list) >= sizeof(pkt1):
-                ret = av_fifo_generic_read(self.pkt_list, &pkt1, sizeof(pkt1), NULL)
-                if ret < 0:
-                    break
-                self.nb_packets -= 1
-                self.size -= pkt1.pkt.size + sizeof(pkt1)
-                self.duration -= pkt1.pkt.duration
-
-                av_packet_move_ref(pkt, pkt1.pkt)
-                if serial != NULL:
-                    serial[0] = pkt1.serial
-                av_packet_free(&pkt1.pkt)
-                ret = 1
-                break
-            elif not block:
-                ret = -1
+            self.packet_queue_drop_flushed()
+            if self.packet_queue_pop(&pkt1):
                 break
-            else:
+            if not block:
+                return -1
+
+            # wait for a packet, only locking if we need to
+            self.cond.lock()
+            native_atomic_add(&self.waiting, 1)
+            while (native_atomic_load64(&self.packets_in) == self.packets_out and
+                   not self.abort_request):
                 self.cond.cond_wait()
-        self.cond.unlock()
-        return ret
+            native_atomic_add(&self.waiting, -1)
+            self.cond.unlock()
+
+        av_packet_move_ref(pkt, pkt1.pkt)
+        if serial != NULL:
+            serial[0] = pkt1.serial
+        av_packet_free(&pkt1.pkt)
+        return 1
@@ -1,3 +1,5 @@
+import pytest
+
 
 def create_image(size):
     from ffpyplayer.pic import Image
@@ -23,3 +25,230 @@ def test_pic():
     assert img2.get_pixel_format() == 'yuv420p'
     planes = img2.to_bytearray()
     assert list(map(len, planes)) == [w * h, w * h / 4, w * h / 4, 0]
+
+
+def test_frame_reader(tmp_path):
+    from .common import get_media
+    from ffpyplayer.pic import FrameReader
+    import math
+
+    fname = get_media('dw11222.mp4')
+    index = str(tmp_path / 'dw11222.ffindex')
+    reader = FrameReader(fname, index_filename=index)
+    assert reader.get_frame_count() == 6077
+    times = reader.get_frame_times()
+
+    # decode forward from the start
+    forward = [reader.get_frame(frame_number=i)[0].to_bytearray()[0]
+               for i in range(40)]
+
+    img, t = reader.get_frame(frame_number=3000)
+    assert math.isclose(t, times[3000])
+    img, t = reader.get_frame(pts=times[1500])
+    assert math.isclose(t, times[1500])
+    img, t = reader.get_frame(frame_number=35)
+    assert math.isclose(t, times[35])
+    assert img.to_bytearray()[0] == forward[35]
+    reader.close()
+
+    # the second reader uses the saved index
+    reader = FrameReader(fname, index_filename=index)
+    assert reader.get_frame_times() == times
+    img, t = reader.get_frame(frame_number=20)
+    assert img.to_bytearray()[0] == forward[20]
+    reader.close()
+
+    with pytest.raises(Exception):
+        reader.get_frame(frame_number=20)
+    assert not reader.get_frame_count()
+
+
+def test_image_loader_get_frames():
+    from .common import get_media
+    from ffpyplayer.pic import ImageLoader
+
+    fname = get_media('eye.gif')
+    frames = [img for img in ImageLoader(fname)]
+    img, _ = frames[0]
+    w, h = img.get_size()
+    frame_size = sum(map(len, img.to_bytearray()))
+
+    count, out, times = ImageLoader(fname).get_frames(len(frames) + 2)
+    assert count == len(frames)
+    assert times == [t for _, t in frames]
+    for i, (img, _) in enumerate(frames):
+        planes = b''.join(img.to_bytearray())
+        assert out[i * frame_size:(i + 1) * frame_size] == planes
+
+    rgb = [b''.join(img.convert('rgb24').to_bytearray()) for img, _ in frames]
+    count, out, _ = ImageLoader(fname).get_frames(len(frames), pix_fmt='rgb24')
+    assert count == len(frames)
+    assert out == b''.join(rgb)
+
+
+def test_image_loader_file_like():
+    from .common import get_media
+    from ffpyplayer.pic import ImageLoader
+    import io
+
+    fname = get_media('eye.gif')
+    with open(fname, 'rb') as fh:
+        data = fh.read()
+
+    times = [t for _, t in ImageLoader(fname)]
+    assert [t for _, t in ImageLoader(io.BytesIO(data))] == times
+    assert [t for _, t in ImageLoader(bytearray(data))] == times
+
+
+def test_image_loader_decimated():
+    from .common import get_media
+    from ffpyplayer.pic import ImageLoader
+
+    fname = get_media('eye.gif')
+    times = [t for _, t in ImageLoader(fname)]
+    assert [t for _, t in ImageLoader(fname, every_nth=2)] == times[::2]
+
+    # the kept frames are never closer than 1 / target_fps
+    fps = 2 / (times[-1] - times[0])
+    kept = [t for _, t in ImageLoader(fname, target_fps=fps)]
+    assert kept[0] == times[0]
+    assert 1 < len(kept) < len(times)
+    assert set(kept) <= set(times)
+    for t1, t2 in zip(kept, kept[1:]):
+        assert t2 - t1 >= 1 / fps - 1e-6
+
+    frames = list(ImageLoader(get_media('dw11222.mp4'), keyframes_only=True))
+    assert frames
+    for img, _ in frames:
+        assert img.is_key_frame()
+
+
+def test_image_planes():
+    from ffpyplayer.pic import Image, SWScale
+
+    w, h = 101, 10
+    img = create_image((w, h))
+    plane = memoryview(img.planes()[0])
+    assert plane.shape == (h, w, 3)
+    assert plane.strides == (w * 3, 3, 1)
+    assert plane.tobytes() == bytes(img.to_bytearray()[0])
+
+    # padded buffers are viewed without copying
+    img2 = SWScale(w, h, 'rgb24', ofmt='yuv420p').scale(img)
+    planes = img2.planes()
+    assert planes[3] is None
+    ls = img2.get_linesizes(keep_align=True)
+    data = img2.to_bytearray()
+    for i, (pw, ph) in enumerate([(w, h), ((w + 1) // 2, (h + 1) // 2)] * 2):
+        if i == 3:
+            break
+        view = memoryview(planes[i])
+        assert view.shape == (ph, pw)
+        assert view.strides == (ls[i], 1)
+        assert view.tobytes() == bytes(data[i])
+
+    # the planes keep the image alive
+    view = memoryview(Image(pix_fmt='gray16le', size=(w, h)).planes()[0])
+    assert view.shape == (h, w)
+    assert view.itemsize == 2
+    assert view.format == '<H'
+
+
+def test_frame_pool():
+    from ffpyplayer.pic import Image, get_frame_pool_stats, \
+        set_frame_pool_size, clear_frame_pools
+
+    clear_frame_pools()
+    stats = get_frame_pool_stats()
+    w, h = 64, 48
+
+    img = Image(pix_fmt='rgb24', size=(w, h))
+    del img
+    # the buffer of the first image is reused
+    for _ in range(10):
+        img = Image(pix_fmt='rgb24', size=(w, h))
+        del img
+
+    new_stats = get_frame_pool_stats()
+    assert new_stats['requests'] - stats['requests'] == 11
+    assert new_stats['allocations'] - stats['allocations'] == 1
+    pool, = new_stats['pools']
+    assert pool['pix_fmt'] == 'rgb24' and pool['size'] == (w, h)
+
+    # a budget smaller than a buffer allocates without the pool
+    set_frame_pool_size(100)
+    try:
+        img = Image(pix_fmt='rgb24', size=(w, h))
+        stats = get_frame_pool_stats()
+        assert not stats['pools']
+        assert stats['unpooled'] - new_stats['unpooled'] == 1
+    finally:
+        set_frame_pool_size(256 * 1024 * 1024)
+
+
+def test_image_convert():
+    from ffpyplayer.pic import SWScale, get_sws_cache_stats, clear_sws_cache
+
+    w, h = 64, 48
+    img = create_image((w, h))
+    clear_sws_cache()
+    stats = get_sws_cache_stats()
+
+    img2 = img.convert('yuv420p', size=(w // 2, h // 2))
+    assert img2.get_pixel_format() == 'yuv420p'
+    assert img2.get_size() == (w // 2, h // 2)
+    assert img.convert('yuv420p', size=(w // 2, h // 2), out=img2) is img2
+
+    sws = SWScale(w, h, 'rgb24', ow=w // 2, oh=h // 2, ofmt='yuv420p')
+    assert sws.scale(img).to_bytearray() == img2.to_bytearray()
+
+    new_stats = get_sws_cache_stats()
+    assert new_stats['misses'] - stats['misses'] == 1
+    assert new_stats['hits'] - stats['hits'] == 2
+    assert new_stats['contexts'] == 0
+    del sws
+    assert get_sws_cache_stats()['contexts'] == 1
+
+    with pytest.raises(Exception):
+        img.convert('gray', out=img2)
+
+
+def test_threaded_scale():
+    from ffpyplayer.pic import SWScale
+
+    w, h = 128, 96
+    images = [create_image((w, h)) for _ in range(5)]
+    expected = SWScale(w, h, 'rgb24', ow=w // 2, ofmt='yuv420p').scale(images[0])
+
+    sws = SWScale(w, h, 'rgb24', ow=w // 2, ofmt='yuv420p', threads=4)
+    assert sws.scale(images[0]).to_bytearray() == expected.to_bytearray()
+
+    out = sws.scale_many(images)
+    assert len(out) == len(images)
+    for img in out:
+        assert img.get_size() == expected.get_size()
+        assert img.to_bytearray() == expected.to_bytearray()
+
+    assert sws.scale_many(images, out) is out
+
+
+def test_log_buffer():
+    from .common import get_media
+    from ffpyplayer.pic import ImageLoader
+    from ffpyplayer.tools import set_log_callback, set_log_buffer, flush_log, \
+        get_log_stats
+
+    lines = []
+    old_callback = set_log_callback(lambda message, level: lines.append(message))
+    set_log_buffer(1 << 16, deliver='manual')
+    try:
+        ImageLoader(get_media('dw11222.mp4')).next_frame()
+        # nothing is delivered until flushed
+        assert not lines
+        assert get_log_stats()['pending']
+        assert flush_log() == len(lines)
+        assert lines
+        assert not get_log_stats()['pending']
+    finally:
+        set_log_buffer(0)
+        set_log_callback(old_callback)
@@ -1,4 +1,8 @@
 
+import sys
+import pytest
+
+
 def test_play():
     from .common import get_media
     from ffpyplayer.player import MediaPlayer
@@ -31,3 +35,465 @@ def test_play():
         raise Exception('{}: {}'.format(*error[0]))
 
     assert i == 6077
+
+
+@pytest.mark.parametrize('thread_lib', ['SDL', 'python', 'native'])
+def test_play_unthrottled(thread_lib):
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import time
+
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), callback=callback, thread_lib=thread_lib,
+        ff_opts={'unthrottled': True})
+
+    i = 0
+    last_t = -1
+    while not error[0]:
+        frame, val = player.get_frame()
+        if val == 'eof':
+            break
+        elif frame is None:
+            time.sleep(0.001)
+        else:
+            img, t = frame
+            assert val == 0
+            assert t > last_t
+            last_t = t
+            i += 1
+
+    player.close_player()
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+
+    assert i == 6077
+
+
+def test_play_blocking():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    ff_opts = {'an': True, 'sync': 'video'}
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), callback=callback, ff_opts=ff_opts)
+
+    i = 0
+    while not error[0] and i < 30:
+        frame, val = player.get_frame(block=True, timeout=5)
+        assert val != 'eof'
+        assert frame is not None
+        i += 1
+
+    player.set_pause(True)
+    frame, val = player.get_frame(block=True, timeout=5)
+    assert frame is None and val == 'paused'
+
+    player.close_player()
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+
+
+def test_get_frames():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    from array import array
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={'unthrottled': True})
+    try:
+        pts = array('d', [0] * 8)
+        count, out, pts = player.get_frames(8, pts=pts, timeout=10)
+        assert count == 8
+        w, h = player.get_metadata()['src_vid_size']
+        assert len(out) == 8 * w * h * 3
+        assert list(pts) == sorted(pts)
+
+        out = bytearray(4 * w * h * 3)
+        count, out2, times = player.get_frames(4, out=out, timeout=10)
+        assert count == 4 and out2 is out
+        assert times[0] > pts[-1]
+    finally:
+        player.close_player()
+
+
+def test_play_async():
+    from .common import get_media
+    from ffpyplayer.player import AsyncMediaPlayer
+    import asyncio
+
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    async def play():
+        ff_opts = {'an': True, 'sync': 'video', 'unthrottled': True}
+        player = AsyncMediaPlayer(
+            get_media('dw11222.mp4'), callback=callback, ff_opts=ff_opts)
+
+        i = 0
+        try:
+            async for img, t in player.frames():
+                i += 1
+        finally:
+            player.close()
+        return i
+
+    i = asyncio.run(play())
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+
+    assert i == 6077
+
+
+def test_play_pool():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer, PlayerPool
+    import time
+
+    error = [None, ]
+
+    def callback(selector, value):
+        if selector.endswith('error'):
+            error[0] = selector, value
+
+    pool = PlayerPool(workers=1, thread_budget=2)
+    players = [
+        MediaPlayer(
+            get_media('dw11222.mp4'), callback=callback,
+            ff_opts={'an': True, 'unthrottled': True}, pool=pool)
+        for _ in range(2)]
+
+    counts = [0, 0]
+    done = [False, False]
+    while not error[0] and not all(done):
+        for i, player in enumerate(players):
+            if done[i]:
+                continue
+            frame, val = player.get_frame()
+            if val == 'eof':
+                done[i] = True
+            elif frame is not None:
+                counts[i] += 1
+        time.sleep(0.0001)
+
+    stats = pool.get_stats()
+    for player in players:
+        player.close_player()
+    if error[0]:
+        raise Exception('{}: {}'.format(*error[0]))
+
+    assert counts == [6077, 6077]
+    assert stats['workers'] == 1
+    assert stats['streams'] == 2
+    assert stats['threads_used'] <= 2
+    assert stats['slices'] > 0
+    assert pool.get_stats()['streams'] == 0
+    assert pool.get_stats()['threads_used'] == 0
+
+
+def test_play_pool_threads():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer, PlayerPool
+    import time
+
+    pool = PlayerPool(workers=2, thread_budget=4)
+    assert pool.get_stats()['stream_threads'] == 2
+
+    players = []
+    try:
+        # each stream gets the same share until the budget runs out
+        for _ in range(3):
+            player = MediaPlayer(
+                get_media('dw11222.mp4'),
+                ff_opts={'an': True, 'paused': True}, pool=pool)
+            players.append(player)
+            ts = time.perf_counter()
+            while not player.get_stats()['pool_threads']:
+                assert time.perf_counter() - ts < 10
+                time.sleep(0.01)
+
+        assert [p.get_stats()['pool_threads'] for p in players] == [2, 2, 1]
+        assert pool.get_stats()['threads_used'] == 4
+
+        # closing a stream returns its share to the budget
+        players.pop(0).close_player()
+        assert pool.get_stats()['threads_used'] == 2
+        player = MediaPlayer(
+            get_media('dw11222.mp4'), ff_opts={'an': True, 'paused': True}, pool=pool)
+        players.append(player)
+        ts = time.perf_counter()
+        while not player.get_stats()['pool_threads']:
+            assert time.perf_counter() - ts < 10
+            time.sleep(0.01)
+        assert player.get_stats()['pool_threads'] == 2
+        assert pool.get_stats()['threads_used'] == 4
+    finally:
+        for player in players:
+            player.close_player()
+    assert pool.get_stats()['threads_used'] == 0
+
+
+def test_queue_limits():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import time
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={
+            'an': True, 'paused': True, 'video_queue_size': 8,
+            'max_queue_size': 64 * 1024, 'min_frames': 5})
+
+    time.sleep(.5)
+    usage = player.get_queue_usage()
+    assert usage['max_queue_size'] == 64 * 1024
+    assert usage['video']['max_frames'] == 8
+    assert usage['video']['packets'] > 0
+
+    player.set_queue_limits(max_queue_size=1024 * 1024)
+    assert player.get_queue_usage()['max_queue_size'] == 1024 * 1024
+    player.close_player()
+
+
+def test_play_stats():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import time
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={'unthrottled': True})
+
+    i = 0
+    while i < 100:
+        frame, val = player.get_frame()
+        if val == 'eof':
+            break
+        elif frame is None:
+            time.sleep(0.001)
+        else:
+            i += 1
+
+    stats = player.get_stats()
+    player.close_player()
+
+    assert stats['frames_displayed'] == i
+    assert stats['frames_decoded'] >= i
+    assert stats['decode_time'] > 0
+    assert stats['packets_read'] >= i
+    assert stats['bytes_read'] > 0
+    assert stats['queues']['video']['max_frames'] == 3
+
+def test_play_outputs():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={
+            'unthrottled': True, 'an': True,
+            'outputs': {'thumb': {'x': 64, 'y': 48, 'out_fmt': 'gray'}}})
+
+    i = 0
+    try:
+        while i < 50:
+            frame, val = player.get_frame(
+                block=True, timeout=5, output=[None, 'thumb'])
+            if val == 'eof':
+                break
+            assert frame is not None
+            images, t = frame
+            assert images[None].get_pixel_format() == 'rgb24'
+            assert images['thumb'].get_pixel_format() == 'gray'
+            assert images['thumb'].get_size() == (64, 48)
+            i += 1
+
+        frame, val = player.get_frame(block=True, timeout=5, output='thumb')
+        assert frame[0].get_size() == (64, 48)
+    finally:
+        player.close_player()
+
+    assert i == 50
+
+
+def test_play_trace(tmp_path):
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import time
+    import json
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={'unthrottled': True, 'trace': 1024})
+
+    i = 0
+    while i < 20:
+        frame, val = player.get_frame()
+        if val == 'eof':
+            break
+        elif frame is None:
+            time.sleep(0.001)
+        else:
+            i += 1
+
+    events = player.get_trace(clear=True)
+    names = {e['name'] for e in events if e['ph'] == 'X'}
+    assert {'demux', 'decode', 'queue_picture', 'get_frame'} <= names
+    assert len([e for e in events if e['name'] == 'get_frame']) == i
+
+    filename = str(tmp_path / 'trace.json')
+    player.save_trace(filename)
+    player.close_player()
+    with open(filename) as fh:
+        assert 'traceEvents' in json.load(fh)
+
+
+def test_play_file_like():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import io
+    import time
+
+    with open(get_media('dw11222.mp4'), 'rb') as fh:
+        data = fh.read()
+
+    for src in (io.BytesIO(data), memoryview(data)):
+        error = [None, ]
+
+        def callback(selector, value):
+            if selector.endswith('error'):
+                error[0] = selector, value
+
+        player = MediaPlayer(
+            src, callback=callback, ff_opts={'unthrottled': True, 'an': True})
+
+        i = 0
+        while not error[0]:
+            frame, val = player.get_frame()
+            if val == 'eof':
+                break
+            elif frame is None:
+                time.sleep(0.001)
+            else:
+                i += 1
+
+        player.close_player()
+        if error[0]:
+            raise Exception('{}: {}'.format(*error[0]))
+
+        assert i == 6077
+
+
+def test_play_decimated():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import time
+
+    def count_frames(**opts):
+        player = MediaPlayer(
+            get_media('dw11222.mp4'),
+            ff_opts=dict(unthrottled=True, an=True, **opts))
+        i = 0
+        while True:
+            frame, val = player.get_frame()
+            if val == 'eof':
+                break
+            elif frame is None:
+                time.sleep(0.001)
+            else:
+                i += 1
+        stats = player.get_stats()
+        player.close_player()
+        return i, stats['frames_skipped']
+
+    assert count_frames(every_nth=10) == (608, 6077 - 608)
+    n, skipped = count_frames(keyframes_only=True)
+    assert 0 < n < 6077
+    assert n + skipped == 6077
+
+
+def test_play_audio_buffer():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import math
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), audio_sink='buffer', ff_opts={'vn': True})
+    try:
+        count, out, pts = player.get_audio(4096, block=True, timeout=10)
+        assert count == 4096
+        metadata = player.get_metadata()
+        channels = metadata['sink_channels']
+        assert metadata['sink_sample_rate'] > 0
+        assert len(out) == 4096 * channels * 2
+
+        buf = bytearray(1024 * channels * 2)
+        count, out, pts2 = player.get_audio(1024, out=buf, block=True, timeout=10)
+        assert count == 1024
+        assert out is buf
+        assert not math.isnan(pts) and pts2 > pts
+    finally:
+        player.close_player()
+
+
+@pytest.mark.parametrize('thread_lib', ['SDL', 'python', 'native'])
+def test_benchmark_queues(thread_lib):
+    from ffpyplayer.player.frame_queue import _benchmark_queues
+
+    results = _benchmark_queues(1000, thread_lib)
+    assert results['frame_queue'] > 0
+    assert results['packet_queue'] > 0
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='notify_fd needs a socket on Windows')
+def test_play_blocking_wakeup():
+    from .common import get_media
+    from ffpyplayer.player import MediaPlayer
+    import os
+    import threading
+    import time
+
+    # the notify fd records when frames are pushed, so we can check how long a
+    # blocked get_frame takes to return after the push, rather than waiting for
+    # its 100 ms fallback
+    r, w = os.pipe()
+    os.set_blocking(w, False)
+    pushes = []
+
+    def read_pushes():
+        while os.read(r, 4096):
+            pushes.append(time.perf_counter())
+
+    thread = threading.Thread(target=read_pushes)
+    thread.start()
+
+    player = MediaPlayer(
+        get_media('dw11222.mp4'), ff_opts={'an': True, 'unthrottled': True})
+    player.set_notify_fd(w)
+    lags = []
+    try:
+        for _ in range(60):
+            ts = time.perf_counter()
+            frame, val = player.get_frame(block=True, timeout=5)
+            te = time.perf_counter()
+            assert frame is not None
+            after = [t for t in list(pushes) if ts < t <= te]
+            if after:
+                lags.append(te - after[0])
+    finally:
+        player.close_player()
+        os.close(w)
+        thread.join()
+        os.close(r)
+
+    assert max(lags, default=0) < 0.05
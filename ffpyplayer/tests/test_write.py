@@ -180,3 +180,122 @@ def test_write_smaller_than_frame_rate(tmp_path, fmt):
         for i in range(20):
             writer.write_frame(img=img, pts=i / 300, stream=0)
     writer.close()
+
+
+def test_write_async(tmp_path):
+    from ffpyplayer.writer import MediaWriter
+    fname = str(tmp_path / 'test_frame.mkv')
+
+    w, h = 64, 64
+    out_opts = {
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'codec': 'rawvideo', 'frame_rate': (2997, 100)}
+
+    writer = MediaWriter(
+        fname, [out_opts, dict(out_opts, pix_fmt_out='yuv420p')], fmt='matroska',
+        async_write=True, queue_size=4)
+
+    timestamps = []
+    image_vals = []
+    for i in range(20):
+        timestamps.append(i / 29.97)
+        image_vals.append(i * 5)
+
+        img = get_gray_image_with_val(w, h, i * 5)
+        writer.write_frame(img=img, pts=i / 29.97, stream=0)
+        writer.write_frame(img=img, pts=i / 29.97, stream=1)
+    writer.close()
+
+    stats = writer.get_write_stats()
+    assert stats['packets_queued'] == 0
+    assert stats['packets_written'] >= 40
+    # the muxer queue is bounded by queue_size per stream
+    assert 1 <= stats['max_packets_queued'] <= 8
+    for stream in stats['streams']:
+        assert stream['frames_encoded'] == 20
+        assert stream['frames_dropped'] == 0
+        assert stream['frames_queued'] == 0
+        assert 1 <= stream['max_frames_queued'] <= 4
+
+    verify_frames(fname, timestamps, image_vals)
+
+
+def test_remux(tmp_path):
+    from ffpyplayer.writer import MediaWriter, remux
+    fname = str(tmp_path / 'test_frame.mkv')
+    clip = str(tmp_path / 'test_clip.mkv')
+
+    w, h = 64, 64
+    out_opts = {
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'codec': 'rawvideo', 'frame_rate': (30, 1)}
+
+    writer = MediaWriter(fname, [out_opts], fmt='matroska')
+    for i in range(30):
+        writer.write_frame(
+            img=get_gray_image_with_val(w, h, i * 5), pts=i / 30., stream=0)
+    writer.close()
+
+    # every rawvideo frame is a keyframe, so the cut is exact
+    stats = remux(fname, clip, start=10 / 30., end=19.5 / 30.)
+    assert stats['packets'] == 10
+
+    verify_frames(
+        clip, [i / 30. for i in range(10)], [(i + 10) * 5 for i in range(10)])
+
+    with pytest.raises(Exception):
+        remux(fname, clip)
+
+
+def test_write_file_like():
+    from ffpyplayer.writer import MediaWriter
+    import io
+
+    w, h = 64, 64
+    out_opts = {
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'codec': 'rawvideo', 'frame_rate': (30, 1)}
+
+    fh = io.BytesIO()
+    writer = MediaWriter(fh, [out_opts], fmt='matroska')
+    timestamps = []
+    image_vals = []
+    for i in range(20):
+        timestamps.append(i / 30.)
+        image_vals.append(i * 5)
+        writer.write_frame(
+            img=get_gray_image_with_val(w, h, i * 5), pts=i / 30., stream=0)
+    writer.close()
+
+    verify_frames(memoryview(fh.getvalue()), timestamps, image_vals)
+
+
+def test_write_fragmented_callback():
+    from ffpyplayer.writer import MediaWriter
+    from ffpyplayer.avio import AVIOSink
+    from ffpyplayer.pic import ImageLoader
+
+    w, h = 64, 64
+    out_opts = {
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'pix_fmt_out': 'yuv420p', 'codec': 'mpeg4', 'frame_rate': (30, 1)}
+
+    chunks = []
+    writer = MediaWriter(
+        AVIOSink(chunks.append, buffer_size=1024), [out_opts], fmt='mp4',
+        lib_opts={'g': '5'})
+    for i in range(30):
+        writer.write_frame(
+            img=get_gray_image_with_val(w, h, i * 5), pts=i / 30., stream=0)
+    writer.close()
+
+    # writes are coalesced into at most buffer_size chunks, not one per packet
+    assert all(len(chunk) <= 1024 for chunk in chunks)
+    assert len(chunks) < writer.get_write_stats()['packets_written']
+
+    data = b''.join(chunks)
+    assert b'moof' in data
+    assert len([img for img in ImageLoader(memoryview(data))]) == 30
+
+    with pytest.raises(ValueError):
+        MediaWriter(chunks.append, [out_opts])
@@ -4,7 +4,8 @@ include "includes/ffmpeg.pxi"
 
 cdef enum MT_lib:
     SDL_MT,
-    Py_MT
+    Py_MT,
+    Native_MT
 
 cdef class MTMutex(object):
     cdef MT_lib lib
@@ -24,6 +25,8 @@ cdef class MTCond(object):
     cdef int unlock(MTCond self) nogil except 2
     cdef int cond_signal(MTCond self) nogil except 2
     cdef int _cond_signal_py(MTCond self) nogil except 2
+    cdef int cond_broadcast(MTCond self) nogil except 2
+    cdef int _cond_broadcast_py(MTCond self) nogil except 2
     cdef int cond_wait(MTCond self) nogil except 2
     cdef int _cond_wait_py(MTCond self) nogil except 2
     cdef int cond_wait_timeout(MTCond self, uint32_t val) nogil except 2
@@ -13,12 +13,36 @@ cdef extern from "Python.h":
 
 ctypedef int (*int_cls_method)(void *) nogil
 
+cdef extern from "clib/mt_native.h" nogil:
+    struct native_mutex:
+        pass
+    struct native_cond:
+        pass
+    struct native_thread:
+        pass
+    int NATIVE_MUTEX_TIMEDOUT
+
+    native_mutex *native_mutex_create()
+    void native_mutex_destroy(native_mutex *)
+    int native_mutex_lock(native_mutex *)
+    int native_mutex_unlock(native_mutex *)
+    native_cond *native_cond_create()
+    void native_cond_destroy(native_cond *)
+    int native_cond_signal(native_cond *)
+    int native_cond_broadcast(native_cond *)
+    int native_cond_wait(native_cond *, native_mutex *)
+    int native_cond_wait_timeout(native_cond *, native_mutex *, uint32_t)
+    native_thread *native_thread_create(int_void_func, void *)
+    int native_thread_wait(native_thread *, int *)
+
 import traceback
 
 cdef int sdl_initialized = 0
 def initialize_sdl():
     '''Initializes sdl. Must be called before anything can be used.
-    It is automatically called by the modules that use SDL.
+    It is automatically called by the modules that use SDL, and when
+    creating the first ``SDL_MT`` object, so the ``Native_MT`` and ``Py_MT``
+    backends can be used without SDL being initialized.
     '''
     global sdl_initialized
     if sdl_initialized:
@@ -26,7 +50,12 @@ def initialize_sdl():
     if SDL_Init(0):
         raise ValueError('Could not initialize SDL - %s' % SDL_GetError())
     sdl_initialized = 1
-initialize_sdl()
+
+
+cdef inline int check_sdl(MT_lib lib) except 1:
+    if lib == SDL_MT and not sdl_initialized:
+        initialize_sdl()
+    return 0
 
 
 cdef class MTMutex(object):
@@ -34,6 +63,7 @@ cdef class MTMutex(object):
     def __cinit__(MTMutex self, MT_lib lib):
         self.lib = lib
         self.mutex = NULL
+        check_sdl(lib)
         if lib == SDL_MT:
             self.mutex = SDL_CreateMutex()
             if self.mutex == NULL:
@@ -43,6 +73,10 @@ cdef class MTMutex(object):
             mutex = threading.Lock()
             self.mutex = <PyObject *>mutex
             Py_INCREF(<PyObject *>self.mutex)
+        elif lib == Native_MT:
+            self.mutex = native_mutex_create()
+            if self.mutex == NULL:
+                raise Exception('Cannot create mutex.')
 
     def __dealloc__(MTMutex self):
         if self.lib == SDL_MT:
@@ -50,12 +84,17 @@ cdef class MTMutex(object):
                 SDL_DestroyMutex(<SDL_mutex *>self.mutex)
         elif self.lib == Py_MT:
             Py_DECREF(<PyObject *>self.mutex)
+        elif self.lib == Native_MT:
+            if self.mutex != NULL:
+                native_mutex_destroy(<native_mutex *>self.mutex)
 
     cdef int lock(MTMutex self) nogil except 2:
         if self.lib == SDL_MT:
             return SDL_mutexP(<SDL_mutex *>self.mutex)
         elif self.lib == Py_MT:
             return self._lock_py()
+        elif self.lib == Native_MT:
+            return native_mutex_lock(<native_mutex *>self.mutex)
 
     cdef int _lock_py(MTMutex self) nogil except 2:
         with gil:
@@ -66,6 +105,8 @@ cdef class MTMutex(object):
             return SDL_mutexV(<SDL_mutex *>self.mutex)
         elif self.lib == Py_MT:
             return self._unlock_py()
+        elif self.lib == Native_MT:
+            return native_mutex_unlock(<native_mutex *>self.mutex)
 
     cdef int _unlock_py(MTMutex self) nogil except 2:
         with gil:
@@ -87,6 +128,10 @@ cdef class MTCond(object):
             cond = threading.Condition(<object>self.mutex.mutex)
             self.cond = <PyObject *>cond
             Py_INCREF(<PyObject *>self.cond)
+        elif self.lib == Native_MT:
+            self.cond = native_cond_create()
+            if self.cond == NULL:
+                raise Exception('Cannot create condition.')
 
     def __dealloc__(MTCond self):
         if self.lib == SDL_MT:
@@ -94,6 +139,9 @@ cdef class MTCond(object):
                 SDL_DestroyCond(<SDL_cond *>self.cond)
         elif self.lib == Py_MT:
             Py_DECREF(<PyObject *>self.cond)
+        elif self.lib == Native_MT:
+            if self.cond != NULL:
+                native_cond_destroy(<native_cond *>self.cond)
 
     cdef int lock(MTCond self) nogil except 2:
         self.mutex.lock()
@@ -106,17 +154,34 @@ cdef class MTCond(object):
             return SDL_CondSignal(<SDL_cond *>self.cond)
         elif self.lib == Py_MT:
             return self._cond_signal_py()
+        elif self.lib == Native_MT:
+            return native_cond_signal(<native_cond *>self.cond)
 
     cdef int _cond_signal_py(MTCond self) nogil except 2:
         with gil:
             (<object>self.cond).notify()
         return 0
 
+    cdef int cond_broadcast(MTCond self) nogil except 2:
+        if self.lib == SDL_MT:
+            return SDL_CondBroadcast(<SDL_cond *>self.cond)
+        elif self.lib == Py_MT:
+            return self._cond_broadcast_py()
+        elif self.lib == Native_MT:
+            return native_cond_broadcast(<native_cond *>self.cond)
+
+    cdef int _cond_broadcast_py(MTCond self) nogil except 2:
+        with gil:
+            (<object>self.cond).notify_all()
+        return 0
+
     cdef int cond_wait(MTCond self) nogil except 2:
         if self.lib == SDL_MT:
             return SDL_CondWait(<SDL_cond *>self.cond, <SDL_mutex *>self.mutex.mutex)
         elif self.lib == Py_MT:
             return self._cond_wait_py()
+        elif self.lib == Native_MT:
+            return native_cond_wait(<native_cond *>self.cond, <native_mutex *>self.mutex.mutex)
 
     cdef int _cond_wait_py(MTCond self) nogil except 2:
         with gil:
@@ -128,6 +193,9 @@ cdef class MTCond(object):
             return SDL_CondWaitTimeout(<SDL_cond *>self.cond, <SDL_mutex *>self.mutex.mutex, val)
         elif self.lib == Py_MT:
             return self._cond_wait_timeout_py(val)
+        elif self.lib == Native_MT:
+            return native_cond_wait_timeout(
+                <native_cond *>self.cond, <native_mutex *>self.mutex.mutex, val)
 
     cdef int _cond_wait_timeout_py(MTCond self, uint32_t val) nogil except 2:
         with gil:
@@ -142,6 +210,7 @@ cdef class MTThread(object):
     def __cinit__(MTThread self, MT_lib lib):
         self.lib = lib
         self.thread = NULL
+        check_sdl(lib)
 
     def __dealloc__(MTThread self):
         if self.lib == Py_MT and self.thread != NULL:
@@ -161,6 +230,11 @@ cdef class MTThread(object):
                 self.thread = <PyObject *>thread
                 Py_INCREF(<PyObject *>self.thread)
                 thread.start()
+        elif self.lib == Native_MT:
+            self.thread = native_thread_create(func, arg)
+            if self.thread == NULL:
+                with gil:
+                    raise Exception('Cannot create thread.')
         return 0
 
     cdef int wait_thread(MTThread self, int *status) nogil except 2:
@@ -172,20 +246,24 @@ cdef class MTThread(object):
                 (<object>self.thread).join()
                 if status != NULL:
                     status[0] = 0
+        elif self.lib == Native_MT:
+            if self.thread != NULL:
+                native_thread_wait(<native_thread *>self.thread, status)
+                self.thread = NULL
         return 0
 
 
 cdef int_cls_method mutex_lock = <int_cls_method>MTMutex.lock
 cdef int_cls_method mutex_release = <int_cls_method>MTMutex.unlock
 
-cdef int _SDL_lockmgr_py(void ** mtx, int op) with gil:
+cdef int _lockmgr_py(void ** mtx, int op, MT_lib lib) with gil:
     cdef bytes msg
     cdef int res = 1
     cdef MTMutex mutex
 
     try:
         if op == FF_LOCK_CREATE:
-            mutex = MTMutex.__new__(MTMutex, SDL_MT)
+            mutex = MTMutex.__new__(MTMutex, lib)
             Py_INCREF(<PyObject *>mutex)
             mtx[0] = <PyObject *>mutex
             res = 0
@@ -204,7 +282,15 @@ cdef int SDL_lockmgr(void ** mtx, int op) nogil:
     elif op == FF_LOCK_RELEASE:
         return not not mutex_release(mtx[0])
     else:
-        return _SDL_lockmgr_py(mtx, op)
+        return _lockmgr_py(mtx, op, SDL_MT)
+
+cdef int Native_lockmgr(void ** mtx, int op) nogil:
+    if op == FF_LOCK_OBTAIN:
+        return not not mutex_lock(mtx[0])
+    elif op == FF_LOCK_RELEASE:
+        return not not mutex_release(mtx[0])
+    else:
+        return _lockmgr_py(mtx, op, Native_MT)
 
 cdef int Py_lockmgr(void ** mtx, int op) with gil:
     cdef int res = 1
@@ -239,6 +325,8 @@ cdef lockmgr_func get_lib_lockmgr(MT_lib lib) nogil:
         return SDL_lockmgr
     elif lib == Py_MT:
         return Py_lockmgr
+    elif lib == Native_MT:
+        return Native_lockmgr
 
 
 cdef class MTGenerator(object):
@@ -253,6 +341,8 @@ cdef class MTGenerator(object):
             with gil:
                 import time
                 time.sleep(delay / 1000.)
+        elif self.mt_src == Native_MT:
+            av_usleep(delay * 1000)
         return 0
 
     cdef lockmgr_func get_lockmgr(MTGenerator self) nogil:
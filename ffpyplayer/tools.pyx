@@ -9,7 +9,8 @@ devices, pixel formats and more.
 __all__ = (
     'initialize_sdl_aud', 'loglevels', 'codecs_enc', 'codecs_dec', 'pix_fmts',
     'formats_in', 'formats_out', 'set_log_callback', 'get_log_callback',
-    'set_loglevel', 'get_loglevel', 'get_codecs', 'get_fmts',
+    'set_loglevel', 'get_loglevel', 'set_log_buffer', 'flush_log',
+    'get_log_stats', 'set_log_filter', 'log_categories', 'get_codecs', 'get_fmts',
     'get_format_codec',
     'get_supported_framerates', 'get_supported_pixfmts', 'get_best_pix_fmt',
     'emit_library_info',
@@ -23,12 +24,27 @@ cdef extern from "stdlib.h" nogil:
     void *malloc(size_t)
     void free(void *)
 
-from ffpyplayer.threading cimport Py_MT, MTMutex, get_lib_lockmgr, SDL_MT
+cdef extern from "string.h" nogil:
+    void *memcpy(void *, const void *, size_t)
+    size_t strlen(const char *)
+
+cdef extern from "stdio.h" nogil:
+    int snprintf(char *, size_t, const char *, ...)
+
+from ffpyplayer.threading cimport Py_MT, MTMutex, MTCond, MTThread, get_lib_lockmgr, \
+    SDL_MT, Native_MT
 import ffpyplayer.threading  # for sdl init
+import atexit
 import re
 import sys
 from functools import partial
 
+DEF LOG_LINE_SIZE = 2048
+
+cdef struct LogLine:
+    int level
+    char line[LOG_LINE_SIZE]
+
 cdef int sdl_aud_initialized = 0
 def initialize_sdl_aud():
     '''Initializes sdl audio subsystem. Must be called before audio can be used.
@@ -79,7 +95,7 @@ the log.
 _loglevel_inverse = {v:k for k, v in loglevels.iteritems()}
 
 cdef object _log_callback = None
-cdef MTMutex _log_mutex= MTMutex(SDL_MT)
+cdef MTMutex _log_mutex= MTMutex(Native_MT)
 cdef int log_level = AV_LOG_WARNING
 cdef int print_prefix = 1
 
@@ -94,13 +110,189 @@ cdef void call_callback(char *line, int level) nogil:
     with gil:
         gil_call_callback(line, level)
 
+log_categories = {
+    'na': AV_CLASS_CATEGORY_NA, 'input': AV_CLASS_CATEGORY_INPUT,
+    'output': AV_CLASS_CATEGORY_OUTPUT, 'muxer': AV_CLASS_CATEGORY_MUXER,
+    'demuxer': AV_CLASS_CATEGORY_DEMUXER, 'encoder': AV_CLASS_CATEGORY_ENCODER,
+    'decoder': AV_CLASS_CATEGORY_DECODER, 'filter': AV_CLASS_CATEGORY_FILTER,
+    'bitstream_filter': AV_CLASS_CATEGORY_BITSTREAM_FILTER,
+    'swscaler': AV_CLASS_CATEGORY_SWSCALER,
+    'swresampler': AV_CLASS_CATEGORY_SWRESAMPLER,
+    'device_video_output': AV_CLASS_CATEGORY_DEVICE_VIDEO_OUTPUT,
+    'device_video_input': AV_CLASS_CATEGORY_DEVICE_VIDEO_INPUT,
+    'device_audio_output': AV_CLASS_CATEGORY_DEVICE_AUDIO_OUTPUT,
+    'device_audio_input': AV_CLASS_CATEGORY_DEVICE_AUDIO_INPUT,
+    'device_output': AV_CLASS_CATEGORY_DEVICE_OUTPUT,
+    'device_input': AV_CLASS_CATEGORY_DEVICE_INPUT}
+'''A dictionary with the categories of the FFmpeg objects that emit logs, which
+can be filtered with :func:`set_log_filter`. The keys are the names and the values
+their FFmpeg values.
+'''
+
+# the level above which the logs of each category are dropped, see set_log_filter
+cdef int category_levels[<int>AV_CLASS_CATEGORY_NB]
+cdef int filter_categories = 0
+# at most log_repeat_limit lines of the same message are emitted in
+# log_repeat_window us
+cdef int log_repeat_limit = 0
+cdef int64_t log_repeat_window = 1000000
+cdef const char *repeat_fmt = NULL
+cdef void *repeat_ptr = NULL
+cdef int repeat_level = 0
+cdef int repeat_count = 0
+cdef int64_t repeat_start = 0
+
+# when log_lines_size, lines are stored in log_lines until they are delivered in
+# a batch, by swapping it with log_lines_back. Both are protected by _log_cond,
+# and log_lines_back by _log_deliver_mutex while it's delivered
+cdef LogLine *log_lines = NULL
+cdef LogLine *log_lines_back = NULL
+cdef int log_lines_size = 0
+cdef int log_lines_count = 0
+cdef int64_t log_dropped = 0
+cdef int64_t log_suppressed = 0
+cdef MTCond _log_cond = MTCond(Native_MT)
+cdef MTMutex _log_deliver_mutex = MTMutex(Native_MT)
+cdef MTThread _log_thread = None
+cdef int log_thread_quit = 0
+cdef uint32_t log_interval = 50
+
+cdef void reset_category_levels(int *levels) nogil:
+    cdef int i
+    for i in range(<int>AV_CLASS_CATEGORY_NB):
+        levels[i] = AV_LOG_TRACE
+reset_category_levels(category_levels)
+
+cdef inline int get_category_level(void *ptr) nogil:
+    cdef AVClass *avc
+    cdef int category
+    if not filter_categories or ptr == NULL:
+        return AV_LOG_TRACE
+    avc = (<AVClass **>ptr)[0]
+    if avc == NULL:
+        return AV_LOG_TRACE
+
+    if avc.get_category != NULL:
+        category = avc.get_category(ptr)
+    else:
+        category = avc.category
+    if category < 0 or category >= <int>AV_CLASS_CATEGORY_NB:
+        return AV_LOG_TRACE
+    return category_levels[category]
+
+cdef void emit_line(char *line, int level) nogil:
+    '''Stores the line if buffering, otherwise delivers it immediately.
+    '''
+    global log_dropped, log_lines_count
+    cdef size_t n
+    if log_lines_size:
+        _log_cond.lock()
+        if log_lines_size:
+            if log_lines_count == log_lines_size:
+                log_dropped += 1
+            else:
+                n = min(strlen(line), LOG_LINE_SIZE - 1)
+                memcpy(log_lines[log_lines_count].line, line, n)
+                log_lines[log_lines_count].line[n] = 0
+                log_lines[log_lines_count].level = level
+                log_lines_count += 1
+                # wake the drain thread for the first line, and when filling up
+                if log_lines_count == 1 or log_lines_count == log_lines_size // 2:
+                    _log_cond.cond_signal()
+            _log_cond.unlock()
+            return
+        _log_cond.unlock()
+    call_callback(line, level)
+
+cdef int is_repeated(void *ptr, int level, const char *fmt) nogil:
+    '''Returns whether the message should be suppressed because it was already
+    emitted log_repeat_limit times in the current window. Messages are the same
+    if they are emitted by the same object and call, whatever their arguments.
+    '''
+    global repeat_fmt, repeat_ptr, repeat_level, repeat_count, repeat_start
+    global log_suppressed
+    cdef char line[128]
+    cdef int64_t now = av_gettime_relative()
+    cdef int suppressed, last_level
+
+    _log_cond.lock()
+    if (fmt == repeat_fmt and ptr == repeat_ptr and level == repeat_level and
+            now - repeat_start < log_repeat_window):
+        repeat_count += 1
+        if repeat_count > log_repeat_limit:
+            log_suppressed += 1
+            _log_cond.unlock()
+            return 1
+        _log_cond.unlock()
+        return 0
+
+    suppressed = repeat_count - log_repeat_limit
+    last_level = repeat_level
+    repeat_fmt = fmt
+    repeat_ptr = ptr
+    repeat_level = level
+    repeat_count = 1
+    repeat_start = now
+    _log_cond.unlock()
+
+    if suppressed > 0:
+        snprintf(line, sizeof(line), b"    Last message repeated %d times\n", suppressed)
+        emit_line(line, last_level)
+    return 0
+
 cdef void _log_callback_func(void* ptr, int level, const char* fmt, va_list vl) noexcept nogil:
-    cdef char line[2048]
-    if fmt == NULL or level > log_level:
+    cdef char line[LOG_LINE_SIZE]
+    # filter before formatting
+    if fmt == NULL or level > log_level or level > get_category_level(ptr):
+        return
+    if log_repeat_limit and is_repeated(ptr, level, fmt):
         return
 
     av_log_format_line(ptr, level, fmt, vl, line, sizeof(line), &print_prefix)
-    call_callback(line, level)
+    emit_line(line, level)
+
+cdef void deliver_batch(LogLine *lines, int count) with gil:
+    cdef int i
+    for i in range(count):
+        gil_call_callback(lines[i].line, lines[i].level)
+
+cdef int deliver_log_lines() nogil except -1:
+    '''Delivers all the buffered lines to the callback, taking the GIL once.
+    Returns the number of lines delivered.
+    '''
+    global log_lines, log_lines_back, log_lines_count
+    cdef LogLine *lines
+    cdef int count
+
+    _log_deliver_mutex.lock()
+    _log_cond.lock()
+    lines = log_lines
+    log_lines = log_lines_back
+    log_lines_back = lines
+    count = log_lines_count
+    log_lines_count = 0
+    _log_cond.unlock()
+
+    if count:
+        deliver_batch(lines, count)
+    _log_deliver_mutex.unlock()
+    return count
+
+cdef int log_drain_thread(void *arg) except? 1 with gil:
+    cdef int done = 0
+    with nogil:
+        while not done:
+            _log_cond.lock()
+            while not log_lines_count and not log_thread_quit:
+                _log_cond.cond_wait()
+            # give the lines some time to accumulate, unless filling up
+            if not log_thread_quit and log_lines_count < log_lines_size // 2:
+                _log_cond.cond_wait_timeout(log_interval)
+            done = log_thread_quit
+            _log_cond.unlock()
+
+            deliver_log_lines()
+    return 0
 
 def _logger_callback(logger_dict, message, level):
     message = message.strip()
@@ -217,6 +409,184 @@ def get_loglevel():
     return _loglevel_inverse[level]
 
 
+def set_log_buffer(int size=256, deliver='thread', double interval=.05):
+    '''Buffers the FFmpeg logs natively and delivers them to the callback set
+    with :func:`set_log_callback` in batches, rather than taking the GIL for each
+    log line from the thread that emitted it.
+
+    Any lines still buffered are delivered before the buffering is changed.
+    This function is thread safe.
+
+    :Parameters:
+
+        `size`: int
+            The number of lines buffered. If the buffer is full, new lines are
+            dropped and counted in :func:`get_log_stats`. If zero, the lines are
+            delivered immediately from the thread that emitted them, which is the
+            default if this is never called. Defaults to 256.
+        `deliver`: str
+            If ``'thread'``, a thread delivers the buffered lines once ``interval``
+            passed since the first line was buffered, or once the buffer is half
+            full. If ``'manual'``, they are only delivered when :func:`flush_log`
+            is called. Defaults to ``'thread'``.
+        `interval`: float
+            The time in seconds lines may wait to be delivered by the thread.
+            Defaults to 0.05.
+
+    >>> from ffpyplayer.tools import set_log_buffer, flush_log
+    >>> set_log_buffer(1024, deliver='manual')
+    >>> ...
+    >>> flush_log()
+    '''
+    global log_lines, log_lines_back, log_lines_size, log_lines_count
+    global _log_thread, log_thread_quit, log_interval
+    cdef LogLine *lines = NULL
+    cdef LogLine *lines_back = NULL
+    cdef LogLine *temp
+    cdef int pending, has_thread
+    cdef MTThread thread
+
+    if size < 0:
+        raise ValueError('size must be zero or positive')
+    if deliver not in ('thread', 'manual'):
+        raise ValueError('deliver must be either "thread" or "manual"')
+    if interval < 0:
+        raise ValueError('interval must be zero or positive')
+
+    if size:
+        lines = <LogLine *>malloc(size * sizeof(LogLine))
+        lines_back = <LogLine *>malloc(size * sizeof(LogLine))
+        if lines == NULL or lines_back == NULL:
+            free(lines)
+            free(lines_back)
+            raise MemoryError()
+
+    thread = _log_thread
+    _log_thread = None
+    has_thread = thread is not None
+    with nogil:
+        if has_thread:
+            _log_cond.lock()
+            log_thread_quit = 1
+            _log_cond.cond_signal()
+            _log_cond.unlock()
+            thread.wait_thread(NULL)
+
+        _log_deliver_mutex.lock()
+        _log_cond.lock()
+        # deliver whatever is still buffered, but new lines go to the new buffer
+        temp = log_lines
+        log_lines = lines
+        lines = temp
+        temp = log_lines_back
+        log_lines_back = lines_back
+        lines_back = temp
+        pending = log_lines_count
+        log_lines_count = 0
+        log_lines_size = size
+        log_thread_quit = 0
+        log_interval = <uint32_t>(interval * 1000)
+        _log_cond.unlock()
+        _log_deliver_mutex.unlock()
+
+        if pending:
+            deliver_batch(lines, pending)
+        free(lines)
+        free(lines_back)
+
+    if log_lines_size and deliver == 'thread':
+        thread = MTThread(Native_MT)
+        with nogil:
+            thread.create_thread(log_drain_thread, "log_drain", NULL)
+        _log_thread = thread
+
+
+def _stop_log_buffer():
+    if log_lines_size:
+        set_log_buffer(0)
+atexit.register(_stop_log_buffer)
+
+
+def flush_log():
+    '''Delivers the log lines buffered with :func:`set_log_buffer` to the
+    callback set with :func:`set_log_callback` from the calling thread.
+
+    :returns:
+
+        The number of lines delivered.
+    '''
+    cdef int count
+    with nogil:
+        count = deliver_log_lines()
+    return count
+
+
+def get_log_stats():
+    '''Returns a dict with statistics of the log delivery. Its keys are:
+
+    ``'dropped'``: The number of lines dropped because the buffer of
+    :func:`set_log_buffer` was full.
+
+    ``'suppressed'``: The number of lines suppressed because they repeated too
+    often, see :func:`set_log_filter`.
+
+    ``'pending'``: The number of lines currently buffered.
+    '''
+    _log_cond.lock()
+    stats = {
+        'dropped': log_dropped, 'suppressed': log_suppressed,
+        'pending': log_lines_count}
+    _log_cond.unlock()
+    return stats
+
+
+def set_log_filter(categories=None, int repeat_limit=0, double repeat_window=1.):
+    '''Drops some FFmpeg logs before they are formatted, in addition to the global
+    level set with :func:`set_loglevel`. This only applies when a callback or
+    logger is set with :func:`set_log_callback`. Each call replaces the previous
+    filter.
+
+    :Parameters:
+
+        `categories`: dict or None
+            A dict whose keys are categories, one of the keys of
+            :attr:`log_categories`, and whose values are one of the keys of
+            :attr:`loglevels`. Logs emitted by objects of that category that are
+            less important than the level are dropped. E.g.
+            ``{'decoder': 'warning'}`` to only see the decoders' warnings and errors
+            when the global level is e.g. ``'trace'``. Defaults to None.
+        `repeat_limit`: int
+            If not zero, a message emitted by the same object and source line
+            more than this many times within ``repeat_window`` is suppressed,
+            whatever its arguments. The number of lines suppressed is then logged
+            once a different message is emitted. Defaults to 0.
+        `repeat_window`: float
+            The duration in seconds in which at most ``repeat_limit`` of the same
+            message is emitted. Defaults to 1.
+    '''
+    global filter_categories, log_repeat_limit, log_repeat_window
+    cdef int levels[<int>AV_CLASS_CATEGORY_NB]
+    cdef int i
+
+    if repeat_limit < 0:
+        raise ValueError('repeat_limit must be zero or positive')
+    reset_category_levels(levels)
+    for name, level in (categories or {}).items():
+        if name not in log_categories:
+            raise ValueError('Invalid log category {}'.format(name))
+        if level not in loglevels:
+            raise ValueError('Invalid loglevel {}'.format(level))
+        levels[<int>log_categories[name]] = loglevels[level]
+
+    _log_cond.lock()
+    for i in range(<int>AV_CLASS_CATEGORY_NB):
+        category_levels[i] = levels[i]
+    filter_categories = bool(categories)
+    log_repeat_limit = repeat_limit
+    log_repeat_window = <int64_t>(repeat_window * 1000000)
+    _log_cond.unlock()
+
+
 cpdef get_codecs(
         int encode=False, int decode=False, int video=False, int audio=False,
         int data=False, int subtitle=False, int attachment=False, other=False):
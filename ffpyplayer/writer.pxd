@@ -1,5 +1,8 @@
 include 'includes/ffmpeg.pxi'
 
+from ffpyplayer.threading cimport MTCond, MTThread
+from ffpyplayer.avio cimport AVIOSink
+
 
 cdef class MediaWriter(object):
     cdef AVFormatContext *fmt_ctx
@@ -7,11 +10,16 @@ cdef class MediaWriter(object):
     cdef int n_streams
     cdef list config
     cdef AVDictionary *format_opts
-    cdef int64_t total_size
     cdef int closed
+    cdef int async_write
+    cdef _PacketMuxer muxer
+    cdef list encoders
+    # if not None, the output is written to it rather than to the filename
+    cdef AVIOSink sink
 
     cpdef close(self)
     cdef void clean_up(MediaWriter self) nogil
+    cdef int raise_async_error(MediaWriter self) except 1
 
 
 cdef struct MediaStream:
@@ -42,8 +50,75 @@ cdef struct MediaStream:
     # need to convert.
     AVFrame *av_frame
     SwsContext *sws_ctx
+    # the number of threads used to convert a frame, see SWScale
+    int scale_threads
     int count
     int64_t pts
     int sync_fmt
 
     AVDictionary *codec_opts
+
+
+cdef struct QueuedFrame:
+    AVFrame *frame
+    double pts
+    # the av_gettime_relative() time when it was queued
+    int64_t queued_time
+    QueuedFrame *next
+
+
+cdef struct QueuedPacket:
+    AVPacket *pkt
+    QueuedPacket *next
+
+
+cdef class _PacketMuxer(object):
+    cdef AVFormatContext *fmt_ctx
+    # whether packets are queued and written by the muxer thread
+    cdef int threaded
+    cdef MTCond cond
+    cdef MTThread thread
+    cdef QueuedPacket *first
+    cdef QueuedPacket *last
+    # the maximum number of packets queued before the encoders wait
+    cdef int queue_size
+    cdef int depth
+    cdef int max_depth
+    cdef int eof
+    cdef int failed
+    cdef int64_t packets
+    cdef int64_t total_size
+    cdef object error
+
+    cdef int encode_frame(_PacketMuxer self, MediaStream *s, AVFrame *frame_in,
+                          double pts) nogil except 1
+    cdef int write_packet(_PacketMuxer self, AVPacket *pkt) nogil except 1
+    cdef int run(_PacketMuxer self) nogil except 1
+    cdef int stop(_PacketMuxer self) nogil except 1
+    cdef void fail(_PacketMuxer self, object error)
+
+
+cdef class _StreamEncoder(object):
+    cdef MediaStream *s
+    cdef _PacketMuxer muxer
+    cdef MTCond cond
+    cdef MTThread thread
+    cdef QueuedFrame *first
+    cdef QueuedFrame *last
+    cdef int queue_size
+    cdef int drop_frames
+    cdef int depth
+    cdef int max_depth
+    cdef int eof
+    cdef int failed
+    cdef int64_t frames
+    cdef int64_t dropped
+    cdef int64_t latency_total
+    cdef int64_t latency_max
+    cdef object error
+
+    cdef int put_frame(_StreamEncoder self, AVFrame *frame, double pts) nogil except -1
+    cdef void free_frames(_StreamEncoder self) nogil
+    cdef int run(_StreamEncoder self) nogil except 1
+    cdef int stop(_StreamEncoder self) nogil except 1
+    cdef void fail(_StreamEncoder self, object error)
@@ -3,10 +3,11 @@ FFmpeg based media writer
 =========================
 
 A FFmpeg based python media writer. See :class:`MediaWriter` for details.
-Currently writes only video.
+Currently writes only video. :func:`remux` copies streams between files
+without re-encoding them.
 '''
 
-__all__ = ('MediaWriter', )
+__all__ = ('MediaWriter', 'remux')
 
 include "includes/inline_funcs.pxi"
 
@@ -24,9 +25,12 @@ cdef extern from "errno.h" nogil:
     int ENOENT
     int EAGAIN
 
-from ffpyplayer.pic cimport Image
+from ffpyplayer.pic cimport Image, frame_pool_get_buffer, get_sws_context, scale_frame
+from ffpyplayer.threading cimport MTCond, MTThread, Native_MT
+from ffpyplayer.avio cimport AVIOSink, is_avio_source, get_avio_sink
 
 import ffpyplayer.tools  # required to init ffmpeg
+import traceback
 from ffpyplayer.tools import encode_to_bytes, convert_to_str
 from copy import deepcopy
 from ffpyplayer.tools import get_supported_framerates, get_supported_pixfmts
@@ -49,9 +53,16 @@ cdef class MediaWriter(object):
 
     :Parameters:
 
-        `filename`: str
+        `filename`: str, file-like, or callable
             The filename of the media file to create. Will be encoded using utf8
             berfore passing to FFmpeg.
+
+            It can also be a writable file-like object or a callable, to which the
+            media is written using a :class:`~ffpyplayer.avio.AVIOSink`, in which
+            case ``fmt`` must be provided. If it cannot seek, ``mp4`` and ``mov``
+            files are written fragmented (with ``movflags`` of
+            ``frag_keyframe+empty_moov+default_base_moof``, unless ``movflags``
+            is set in ``lib_opts``), so the data can be consumed as it's written.
         `streams`: list of dicts
             A list of streams to create in the file. ``streams``
             is a list of dicts, where each dict configures the corresponding stream.
@@ -82,6 +93,12 @@ cdef class MediaWriter(object):
                 `height_out`: int
                     The height at which frames will be written to the file for this
                     stream. Defaults to ``height_in`` if not provided.
+                `scale_threads`: int
+                    The number of threads used to convert the frames passed to
+                    :meth:`write_frame` to ``pix_fmt_out``, ``width_out``, and
+                    ``height_out``. When not 1, horizontal slices of each frame are
+                    converted in parallel, see :class:`~ffpyplayer.pic.SWScale`. If
+                    zero, the number of CPUs is used. Defaults to 1.
                 `codec`: str
                     The codec used to write the frames to the file. Can be one of
                     the encoding codecs in :attr:`ffpyplayer.tools.codecs_enc`.
@@ -124,6 +141,24 @@ cdef class MediaWriter(object):
             Whether we should overwrite an existing file.
             If False, an error will be raised if the file already exists. If True,
             the file will be overwritten if it exists.
+        `async_write`: bool
+            Whether frames are encoded and written in the background. If True,
+            :meth:`write_frame` only takes a reference to the image and queues it,
+            one thread per stream converts and encodes the queued frames, and
+            another thread writes the encoded packets to the file. Errors from the
+            background threads are raised by the next call to :meth:`write_frame`
+            or by :meth:`close`. Defaults to False.
+        `queue_size`: int
+            When ``async_write``, the maximum number of frames queued for each stream
+            before :meth:`write_frame` blocks or drops the frame. Defaults to 8.
+            The encoded packets waiting to be written are also limited to
+            ``queue_size`` per stream, so when the file is written slowly the
+            encoders wait, their queues fill up, and :meth:`write_frame` blocks or
+            drops frames rather than the packets using ever more memory.
+        `drop_frames`: bool
+            When ``async_write`` and the queue of a stream is full, if True,
+            :meth:`write_frame` drops the frame and returns immediately, otherwise it
+            waits until there's room in the queue. Defaults to False.
         `**kwargs`:
             Accepts default values for all ``streams`` which will be used if these
             keywords are not provided for any stream.
@@ -132,7 +167,8 @@ cdef class MediaWriter(object):
     '''
 
     def __cinit__(self, filename, streams, fmt='', lib_opts={}, metadata={},
-                  overwrite=False, **kwargs):
+                  overwrite=False, async_write=False, int queue_size=8, drop_frames=False,
+                  **kwargs):
         cdef int res = 0, n = len(streams), r
         cdef char *format_name = NULL
         cdef char msg[256]
@@ -140,8 +176,24 @@ cdef class MediaWriter(object):
         cdef AVDictionaryEntry *dict_temp = NULL
         cdef bytes msg2
         cdef const AVCodec *codec_desc
-
-        filename = encode_to_bytes(filename)
+        cdef _StreamEncoder encoder
+        cdef char *out_filename = NULL
+
+        self.muxer = _PacketMuxer.__new__(_PacketMuxer)
+        self.encoders = []
+        self.async_write = bool(async_write)
+        if queue_size < 1:
+            raise ValueError('queue_size must be at least 1')
+
+        if is_avio_source(filename):
+            if not fmt:
+                raise ValueError('fmt must be provided when not writing to a file')
+            self.sink = get_avio_sink(filename)
+            if self.sink.attached:
+                raise ValueError('The sink has already been used')
+        else:
+            filename = encode_to_bytes(filename)
+            out_filename = filename
         streams = encode_to_bytes(deepcopy(streams))
         if fmt:
             fmt = fmt.encode('utf8')
@@ -149,7 +201,6 @@ cdef class MediaWriter(object):
         metadata = encode_to_bytes(deepcopy(metadata))
         kwargs = encode_to_bytes(deepcopy(kwargs))
 
-        self.total_size = 0
         self.closed = 0
         self.format_opts = NULL
         if fmt:
@@ -162,9 +213,13 @@ cdef class MediaWriter(object):
         self.config = conf
 
         self.fmt_ctx = NULL
-        res = avformat_alloc_output_context2(&self.fmt_ctx, NULL, format_name, filename)
+        res = avformat_alloc_output_context2(&self.fmt_ctx, NULL, format_name, out_filename)
         if res < 0 or self.fmt_ctx == NULL:
             raise Exception('Failed to create format context: ' + tcode(emsg(res, msg, sizeof(msg))))
+        if self.sink is not None and self.fmt_ctx.oformat.flags & AVFMT_NOFILE:
+            self.clean_up()
+            raise ValueError('Format %s cannot be written to a sink' % fmt.decode('utf8'))
+        self.muxer.fmt_ctx = self.fmt_ctx
         self.streams = <MediaStream *>malloc(n * sizeof(MediaStream))
         if self.streams == NULL:
             self.clean_up()
@@ -206,6 +261,10 @@ cdef class MediaWriter(object):
             s[r].width_out = config['width_out']
             s[r].height_in = config['height_in']
             s[r].height_out = config['height_out']
+            s[r].scale_threads = config.get('scale_threads', 1)
+            if s[r].scale_threads < 0:
+                self.clean_up()
+                raise ValueError('scale_threads must be zero or positive')
             s[r].num, s[r].den = config['frame_rate']
             if av_get_pix_fmt(config['pix_fmt_in']) == AV_PIX_FMT_NONE:
                 self.clean_up()
@@ -272,15 +331,15 @@ cdef class MediaWriter(object):
                 if s[r].av_frame == NULL:
                     self.clean_up()
                     raise MemoryError()
+                # only a template, the buffers of each converted frame come from
+                # the frame pool, since the encoder may keep a reference to them
                 s[r].av_frame.format = s[r].pix_fmt_out
                 s[r].av_frame.width = s[r].width_out
                 s[r].av_frame.height = s[r].height_out
-                if av_frame_get_buffer(s[r].av_frame, 32) < 0:
-                    raise Exception('Cannot allocate frame buffers.')
 
-                s[r].sws_ctx = sws_getCachedContext(NULL, s[r].width_in, s[r].height_in,\
+                s[r].sws_ctx = get_sws_context(NULL, s[r].width_in, s[r].height_in,\
                 s[r].pix_fmt_in, s[r].codec_ctx.width, s[r].codec_ctx.height,\
-                s[r].codec_ctx.pix_fmt, SWS_BICUBIC, NULL, NULL, NULL)
+                s[r].codec_ctx.pix_fmt, SWS_BICUBIC, s[r].scale_threads)
                 if s[r].sws_ctx == NULL:
                     self.clean_up()
                     raise Exception('Cannot find conversion context.')
@@ -318,7 +377,12 @@ cdef class MediaWriter(object):
             else:
                 s[r].sync_fmt = VSYNC_CFR
 
-        if not (self.fmt_ctx.oformat.flags & AVFMT_NOFILE):
+        if self.sink is not None:
+            self.sink.attach(self.fmt_ctx)
+            if not self.sink.seekable and self.fmt_ctx.oformat.name in (b'mp4', b'mov'):
+                av_dict_set(&self.format_opts, b"movflags",
+                            b"frag_keyframe+empty_moov+default_base_moof", AV_DICT_DONT_OVERWRITE)
+        elif not (self.fmt_ctx.oformat.flags & AVFMT_NOFILE):
             res = avio_check(filename, 0)
             if (not res) and not overwrite:
                 self.clean_up()
@@ -342,8 +406,22 @@ cdef class MediaWriter(object):
             av_log(NULL, AV_LOG_ERROR, '%s', msg2)
         if res < 0:
             self.clean_up()
+            if self.sink is not None:
+                self.sink.raise_error()
             raise Exception('Error writing header: ' + tcode(emsg(res, msg, sizeof(msg))))
 
+        if self.async_write:
+            self.muxer.queue_size = queue_size * n
+            self.muxer.start()
+            for r in range(n):
+                encoder = _StreamEncoder.__new__(_StreamEncoder)
+                encoder.s = &s[r]
+                encoder.muxer = self.muxer
+                encoder.queue_size = queue_size
+                encoder.drop_frames = bool(drop_frames)
+                self.encoders.append(encoder)
+                encoder.start()
+
     def __dealloc__(self):
         self.close()
 
@@ -358,13 +436,19 @@ cdef class MediaWriter(object):
             After calling this method, calling any other class method on this instance may
             result in a crash or program corruption.
         '''
-        cdef int r, res, wrote = 0
-        cdef char msg[256]
-        cdef AVPacket pkt
+        cdef int r, wrote = 0
+        cdef _StreamEncoder encoder
         if self.closed:
             return
         self.closed = 1
 
+        # the encoder threads flush their encoder before exiting
+        for encoder in self.encoders:
+            with nogil:
+                encoder.stop()
+        with nogil:
+            self.muxer.stop()
+
         with nogil:
             if self.fmt_ctx == NULL or (not self.n_streams) or self.streams[0].codec_ctx == NULL:
                 self.clean_up()
@@ -375,39 +459,13 @@ cdef class MediaWriter(object):
                 if not self.streams[r].count:
                     continue
                 wrote = 1
-
-                av_init_packet(&pkt)
-                pkt.data = NULL
-                pkt.size = 0
-
-                # flush
-                res = avcodec_send_frame(self.streams[r].codec_ctx, NULL)
-                if res < 0:
-                    with gil:
-                        raise Exception('Error sending NULL frame: ' + tcode(emsg(res, msg, sizeof(msg))))
-
-                while True:
-                    res = avcodec_receive_packet(self.streams[r].codec_ctx, &pkt)
-                    if res < 0:
-                        if res != AVERROR_EOF:
-                            with gil:
-                                raise Exception('Error getting encoded packet: ' + tcode(emsg(res, msg, sizeof(msg))))
-                        break
-
-                    if pkt.pts != AV_NOPTS_VALUE:
-                        pkt.pts = av_rescale_q(pkt.pts, self.streams[r].codec_ctx.time_base, self.streams[r].av_stream.time_base)
-                    if pkt.dts != AV_NOPTS_VALUE:
-                        pkt.dts = av_rescale_q(pkt.dts, self.streams[r].codec_ctx.time_base, self.streams[r].av_stream.time_base)
-                    pkt.stream_index = self.streams[r].av_stream.index
-                    self.total_size += pkt.size
-
-                    res = av_interleaved_write_frame(self.fmt_ctx, &pkt)
-                    if res < 0:
-                        with gil:
-                            raise Exception('Error writing packet: ' + tcode(emsg(res, msg, sizeof(msg))))
+                if not self.async_write:
+                    # flush
+                    self.muxer.encode_frame(&self.streams[r], NULL, 0)
             if wrote:
                 av_write_trailer(self.fmt_ctx)
             self.clean_up()
+        self.raise_async_error()
 
     def write_frame(MediaWriter self, Image img, double pts, int stream=0):
         '''Writes a :class:`ffpyplayer.pic.Image` frame to the specified stream.
@@ -450,15 +508,11 @@ cdef class MediaWriter(object):
 
         See :ref:`examples` for its usage.
         '''
-        cdef int res = 0, got_pkt
-        cdef int frame_cloned = 0
+        cdef int queued
         cdef AVFrame *frame_in = img.frame
-        cdef AVFrame *frame_out
+        cdef AVFrame *frame_ref
         cdef MediaStream *s
-        cdef double ipts, dpts
-        cdef int64_t rounded_pts
-        cdef AVPacket pkt
-        cdef char msg[256]
+        cdef _StreamEncoder encoder
         if stream >= self.n_streams:
             raise Exception('Invalid stream number %d' % stream)
         s = self.streams + stream
@@ -466,62 +520,77 @@ cdef class MediaWriter(object):
             frame_in.format != <AVPixelFormat>s.pix_fmt_in):
             raise Exception("Input image doesn't match stream specified parameters.")
 
+        if not self.async_write:
+            try:
+                with nogil:
+                    self.muxer.encode_frame(s, frame_in, pts)
+            except Exception:
+                # the sink's exception is more useful than FFmpeg's io error
+                if self.sink is not None:
+                    self.sink.raise_error()
+                raise
+            return self.muxer.total_size
+
+        self.raise_async_error()
+        encoder = self.encoders[stream]
+        # if the image doesn't own its buffers, this copies them
+        frame_ref = av_frame_clone(frame_in)
+        if frame_ref == NULL:
+            raise MemoryError()
         with nogil:
-            if s.av_frame != NULL:
-                frame_out = s.av_frame
-                sws_scale(s.sws_ctx, <const uint8_t *const *>frame_in.data, frame_in.linesize,
-                          0, frame_in.height, frame_out.data, frame_out.linesize)
-            else:
-                frame_out = av_frame_clone(frame_in)
-                frame_cloned = 1
-                if frame_out == NULL:
-                    with gil:
-                        raise MemoryError
-
-            rounded_pts = <int64_t>floor(pts / av_q2d(s.codec_ctx.time_base) + 0.5)
-            frame_out.pict_type = AV_PICTURE_TYPE_NONE
-            frame_out.pts = rounded_pts
-
-            av_init_packet(&pkt)
-            pkt.data = NULL
-            pkt.size = 0
-
-            res = avcodec_send_frame(s.codec_ctx, frame_out)
-            if res < 0:
-                if frame_cloned:
-                    av_frame_free(&frame_out)
-                with gil:
-                    raise Exception('Error sending frame: ' + tcode(emsg(res, msg, sizeof(msg))))
+            queued = encoder.put_frame(frame_ref, pts)
+        if not queued:
+            av_frame_free(&frame_ref)
+        self.raise_async_error()
+        return self.muxer.total_size
 
-            while True:
-                res = avcodec_receive_packet(s.codec_ctx, &pkt)
-                if res < 0:
-                    if frame_cloned:
-                        av_frame_free(&frame_out)
-                    if res != AVERROR_EOF and res != AV_EAGAIN:
-                        with gil:
-                            raise Exception('Error getting encoded packet: ' + tcode(emsg(res, msg, sizeof(msg))))
-                    break
+    def get_write_stats(self):
+        '''Returns statistics about the frames and packets written so far.
 
-                if pkt.pts != AV_NOPTS_VALUE:
-                    pkt.pts = av_rescale_q(pkt.pts, s.codec_ctx.time_base, s.av_stream.time_base)
-                if pkt.dts != AV_NOPTS_VALUE:
-                    pkt.dts = av_rescale_q(pkt.dts, s.codec_ctx.time_base, s.av_stream.time_base)
-                pkt.stream_index = s.av_stream.index
-                self.total_size += pkt.size
-
-                res = av_interleaved_write_frame(self.fmt_ctx, &pkt)
-                if res < 0:
-                    if frame_cloned:
-                        av_frame_free(&frame_out)
-                    with gil:
-                        raise Exception('Error writing packet: ' + tcode(emsg(res, msg, sizeof(msg))))
+        :returns:
 
-            s.pts += 1
-            s.count += 1
-            if frame_cloned:
-                av_frame_free(&frame_out)
-        return self.total_size
+            dict: with the keys ``total_size``, the approximate number of bytes
+            written, see :meth:`write_frame`; ``packets_queued`` and
+            ``max_packets_queued``, the current and maximum number of encoded
+            packets waiting for the muxer thread; ``packets_written``, the number of
+            packets passed to the muxer; and ``streams``, a list with a dict for each
+            stream with the keys ``frames_queued`` and ``max_frames_queued``, the
+            current and maximum number of frames waiting to be encoded;
+            ``frames_encoded``; ``frames_dropped``, the frames dropped because the
+            queue was full; and ``mean_latency`` and ``max_latency``, the time in
+            seconds between passing a frame to :meth:`write_frame` and when it has
+            been encoded. The queue and latency values are zero unless
+            ``async_write`` is True.
+        '''
+        cdef _StreamEncoder encoder
+        cdef int r
+        streams = []
+        if not self.async_write:
+            for r in range(self.n_streams):
+                streams.append({
+                    'frames_queued': 0, 'max_frames_queued': 0,
+                    'frames_encoded': self.streams[r].count, 'frames_dropped': 0,
+                    'mean_latency': 0., 'max_latency': 0.})
+
+        for encoder in self.encoders:
+            encoder.cond.lock()
+            streams.append({
+                'frames_queued': encoder.depth, 'max_frames_queued': encoder.max_depth,
+                'frames_encoded': encoder.frames, 'frames_dropped': encoder.dropped,
+                'mean_latency': encoder.latency_total / 1000000. / encoder.frames
+                if encoder.frames else 0.,
+                'max_latency': encoder.latency_max / 1000000.})
+            encoder.cond.unlock()
+
+        if self.muxer.threaded:
+            self.muxer.cond.lock()
+        stats = {
+            'total_size': self.muxer.total_size, 'packets_queued': self.muxer.depth,
+            'max_packets_queued': self.muxer.max_depth,
+            'packets_written': self.muxer.packets, 'streams': streams}
+        if self.muxer.threaded:
+            self.muxer.cond.unlock()
+        return stats
 
     def get_configuration(self):
         '''Returns the configuration parameters used to initialize all the streams for this
@@ -573,10 +642,568 @@ cdef class MediaWriter(object):
         self.n_streams = 0
 
         if self.fmt_ctx != NULL:
-            if self.fmt_ctx.pb != NULL and not (self.fmt_ctx.oformat.flags & AVFMT_NOFILE):
+            if self.fmt_ctx.flags & AVFMT_FLAG_CUSTOM_IO:
+                # the sink owns it, but data may still be buffered
+                if self.fmt_ctx.pb != NULL:
+                    avio_flush(self.fmt_ctx.pb)
+            elif self.fmt_ctx.pb != NULL and not (self.fmt_ctx.oformat.flags & AVFMT_NOFILE):
                 avio_close(self.fmt_ctx.pb)
             avformat_free_context(self.fmt_ctx)
             self.fmt_ctx = NULL
         av_dict_free(&self.format_opts)
-        self.total_size = 0
+        self.muxer.fmt_ctx = NULL
+
+    cdef int raise_async_error(MediaWriter self) except 1:
+        cdef _StreamEncoder encoder
+        if self.sink is not None:
+            self.sink.raise_error()
+        if self.muxer.error is not None:
+            raise self.muxer.error
+        for encoder in self.encoders:
+            if encoder.error is not None:
+                raise encoder.error
+        return 0
+
+
+
+def remux(src, dst, start=None, end=None, streams=None, fmt='', overwrite=False):
+    '''Copies the compressed packets of the streams of a media file into a new
+    file, without decoding or encoding them.
+
+    This can change the container format of a file or cut a clip out of it at
+    about the speed the file can be read, because frames are not re-encoded as
+    they are with :class:`MediaWriter`. The codec parameters, metadata, and
+    timestamps of the streams are copied.
+
+    :Parameters:
 
+        `src`: str
+            The filename of the media file to copy from.
+        `dst`: str
+            The filename of the media file to create.
+        `start`: float or None
+            The time in seconds, relative to the start of ``src``, from which to copy.
+            Because the packets are not re-encoded, copying starts at the last
+            keyframe at or before ``start``, and the timestamps are shifted so that
+            the output starts at zero. If None, copies from the start.
+            Defaults to None.
+        `end`: float or None
+            The time in seconds, relative to the start of ``src``, at which copying
+            stops. Packets whose decoding time is ``end`` or later are not copied.
+            If None, copies to the end. Defaults to None.
+        `streams`: list of ints or None
+            The indices of the streams in ``src`` to copy. If None, all the video,
+            audio, and subtitle streams are copied. Defaults to None.
+        `fmt`: str
+            The format of the output, as in :class:`MediaWriter`. If empty, it's
+            guessed from ``dst``. Defaults to empty string.
+        `overwrite`: bool
+            Whether to overwrite ``dst`` if it already exists, otherwise an
+            error is raised. Defaults to False.
+
+    :returns:
+
+        dict: with the keys ``packets`` and ``size``, the number and size in bytes
+        of the copied packets.
+
+    For example, to copy the video between 10 and 20 seconds to a mkv file:
+
+    .. code-block:: python
+
+        >>> from ffpyplayer.writer import remux
+        >>> remux('recording.mp4', 'clip.mkv', start=10, end=20, streams=[0])
+        {'packets': 301, 'size': 1831245}
+    '''
+    cdef AVFormatContext *in_ctx = NULL
+    cdef AVFormatContext *out_ctx = NULL
+    cdef AVStream *in_st
+    cdef AVStream *out_st
+    cdef AVPacket *pkt = NULL
+    cdef int *stream_map = NULL
+    cdef int *state = NULL
+    cdef int res = 0, i, n_mapped = 0, n_done = 0, has_end = end is not None
+    cdef unsigned nb_streams
+    cdef double start_offset = 0, end_t = end if end is not None else 0
+    cdef int64_t ts, total_size = 0, packets = 0
+    cdef char *format_name = NULL
+    cdef char msg[256]
+
+    src = encode_to_bytes(src)
+    dst = encode_to_bytes(dst)
+    if fmt:
+        fmt = fmt.encode('utf8')
+        format_name = fmt
+
+    try:
+        res = avformat_open_input(&in_ctx, src, NULL, NULL)
+        if res < 0:
+            raise Exception('Failed to open %s: ' % src + tcode(emsg(res, msg, sizeof(msg))))
+        res = avformat_find_stream_info(in_ctx, NULL)
+        if res < 0:
+            raise Exception('Failed to find stream info: ' + tcode(emsg(res, msg, sizeof(msg))))
+        if in_ctx.start_time != AV_NOPTS_VALUE:
+            start_offset = in_ctx.start_time / <double>AV_TIME_BASE
+
+        res = avformat_alloc_output_context2(&out_ctx, NULL, format_name, dst)
+        if res < 0 or out_ctx == NULL:
+            raise Exception('Failed to create format context: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+        nb_streams = in_ctx.nb_streams
+        stream_map = <int *>malloc(2 * nb_streams * sizeof(int))
+        if stream_map == NULL:
+            raise MemoryError()
+        # 0 until the first keyframe of the stream, 1 while copying, and 2 once done
+        state = stream_map + nb_streams
+        memset(state, 0, nb_streams * sizeof(int))
+
+        for i in range(nb_streams):
+            in_st = in_ctx.streams[i]
+            stream_map[i] = -1
+            if streams is None:
+                if (in_st.codecpar.codec_type != AVMEDIA_TYPE_VIDEO and
+                    in_st.codecpar.codec_type != AVMEDIA_TYPE_AUDIO and
+                    in_st.codecpar.codec_type != AVMEDIA_TYPE_SUBTITLE):
+                    continue
+            elif i not in streams:
+                continue
+
+            out_st = avformat_new_stream(out_ctx, NULL)
+            if out_st == NULL:
+                raise MemoryError()
+            res = avcodec_parameters_copy(out_st.codecpar, in_st.codecpar)
+            if res < 0:
+                raise Exception('Failed to copy codec parameters of stream %d: %s' % (i, tcode(emsg(res, msg, sizeof(msg)))))
+            # the codec tag of the source container may not be valid in the output
+            out_st.codecpar.codec_tag = 0
+            out_st.time_base = in_st.time_base
+            av_dict_copy(&out_st.metadata, in_st.metadata, 0)
+            stream_map[i] = out_st.index
+            n_mapped += 1
+
+        if not n_mapped:
+            raise Exception('No streams to copy.')
+        av_dict_copy(&out_ctx.metadata, in_ctx.metadata, 0)
+
+        if not (out_ctx.oformat.flags & AVFMT_NOFILE):
+            res = avio_check(dst, 0)
+            if (not res) and not overwrite:
+                raise Exception('File %s already exists.' % dst)
+            elif res < 0 and res != AV_ENOENT:
+                raise Exception('File error: ' + tcode(emsg(res, msg, sizeof(msg))))
+            res = avio_open2(&out_ctx.pb, dst, AVIO_FLAG_WRITE, NULL, NULL)
+            if res < 0:
+                raise Exception('File error: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+        if start is not None:
+            av_opt_set(out_ctx, b"avoid_negative_ts", b"make_zero", 0)
+        res = avformat_write_header(out_ctx, NULL)
+        if res < 0:
+            raise Exception('Error writing header: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+        if start is not None:
+            res = av_seek_frame(in_ctx, -1, <int64_t>((start + start_offset) * AV_TIME_BASE),
+                                AVSEEK_FLAG_BACKWARD)
+            if res < 0:
+                raise Exception('Failed to seek: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+        pkt = av_packet_alloc()
+        if pkt == NULL:
+            raise MemoryError()
+
+        with nogil:
+            while n_done < n_mapped:
+                res = av_read_frame(in_ctx, pkt)
+                if res < 0:
+                    if res == AVERROR_EOF:
+                        res = 0
+                    break
+
+                i = pkt.stream_index
+                if i >= <int>nb_streams or stream_map[i] < 0 or state[i] == 2:
+                    av_packet_unref(pkt)
+                    continue
+                # decoding can only start at a keyframe
+                if not state[i]:
+                    if not (pkt.flags & AV_PKT_FLAG_KEY):
+                        av_packet_unref(pkt)
+                        continue
+                    state[i] = 1
+
+                in_st = in_ctx.streams[i]
+                ts = pkt.dts if pkt.dts != AV_NOPTS_VALUE else pkt.pts
+                if (has_end and ts != AV_NOPTS_VALUE and
+                        ts * av_q2d(in_st.time_base) - start_offset >= end_t):
+                    state[i] = 2
+                    n_done += 1
+                    av_packet_unref(pkt)
+                    continue
+
+                out_st = out_ctx.streams[stream_map[i]]
+                av_packet_rescale_ts(pkt, in_st.time_base, out_st.time_base)
+                pkt.stream_index = stream_map[i]
+                pkt.pos = -1
+                total_size += pkt.size
+                packets += 1
+                res = av_interleaved_write_frame(out_ctx, pkt)
+                if res < 0:
+                    break
+
+        if res < 0:
+            raise Exception('Error copying packets: ' + tcode(emsg(res, msg, sizeof(msg))))
+        res = av_write_trailer(out_ctx)
+        if res < 0:
+            raise Exception('Error writing trailer: ' + tcode(emsg(res, msg, sizeof(msg))))
+    finally:
+        av_packet_free(&pkt)
+        free(stream_map)
+        avformat_close_input(&in_ctx)
+        if out_ctx != NULL:
+            if out_ctx.pb != NULL and not (out_ctx.oformat.flags & AVFMT_NOFILE):
+                avio_close(out_ctx.pb)
+            avformat_free_context(out_ctx)
+
+    return {'packets': packets, 'size': total_size}
+
+cdef int mux_thread_enter(void *obj_id) except? 1 with gil:
+    cdef _PacketMuxer muxer = <_PacketMuxer>obj_id
+    cdef bytes msg
+    try:
+        with nogil:
+            return muxer.run()
+    except Exception as e:
+        msg = traceback.format_exc().encode('utf8')
+        av_log(NULL, AV_LOG_ERROR, '%s', msg)
+        muxer.fail(e)
+    return 0
+
+
+cdef int encode_thread_enter(void *obj_id) except? 1 with gil:
+    cdef _StreamEncoder encoder = <_StreamEncoder>obj_id
+    cdef bytes msg
+    try:
+        with nogil:
+            return encoder.run()
+    except Exception as e:
+        msg = traceback.format_exc().encode('utf8')
+        av_log(NULL, AV_LOG_ERROR, '%s', msg)
+        encoder.fail(e)
+    return 0
+
+
+cdef class _PacketMuxer(object):
+    '''Encodes frames and writes the packets to the file, either directly or,
+    when started, by queuing them for a thread that writes them.
+    '''
+
+    def __cinit__(self):
+        self.fmt_ctx = NULL
+        self.first = self.last = NULL
+
+    def __dealloc__(self):
+        cdef QueuedPacket *item
+        while self.first != NULL:
+            item = self.first
+            self.first = item.next
+            av_packet_free(&item.pkt)
+            free(item)
+
+    def start(self):
+        self.cond = MTCond.__new__(MTCond, Native_MT)
+        self.threaded = 1
+        self.thread = MTThread.__new__(MTThread, Native_MT)
+        self.thread.create_thread(mux_thread_enter, "writer_mux", <void *>self)
+
+    cdef int stop(_PacketMuxer self) nogil except 1:
+        if self.thread is None:
+            return 0
+        self.cond.lock()
+        self.eof = 1
+        self.cond.cond_broadcast()
+        self.cond.unlock()
+        self.thread.wait_thread(NULL)
+        return 0
+
+    cdef void fail(_PacketMuxer self, object error):
+        cdef QueuedPacket *item
+        self.error = error
+        with nogil:
+            self.cond.lock()
+            self.failed = 1
+            while self.first != NULL:
+                item = self.first
+                self.first = item.next
+                av_packet_free(&item.pkt)
+                free(item)
+            self.last = NULL
+            self.depth = 0
+            # wake the encoders waiting for room in the queue
+            self.cond.cond_broadcast()
+            self.cond.unlock()
+
+    cdef int run(_PacketMuxer self) nogil except 1:
+        cdef QueuedPacket *item
+        cdef int res
+        cdef char msg[256]
+
+        while True:
+            self.cond.lock()
+            while self.first == NULL and not self.eof:
+                self.cond.cond_wait()
+            item = self.first
+            if item == NULL:
+                self.cond.unlock()
+                break
+            self.first = item.next
+            if self.first == NULL:
+                self.last = NULL
+            self.depth -= 1
+            self.packets += 1
+            # wake the encoders waiting for room in the queue
+            self.cond.cond_broadcast()
+            self.cond.unlock()
+
+            res = av_interleaved_write_frame(self.fmt_ctx, item.pkt)
+            av_packet_free(&item.pkt)
+            free(item)
+            if res < 0:
+                with gil:
+                    raise Exception('Error writing packet: ' + tcode(emsg(res, msg, sizeof(msg))))
+        return 0
+
+    cdef int write_packet(_PacketMuxer self, AVPacket *pkt) nogil except 1:
+        cdef QueuedPacket *item
+        cdef int res
+        cdef char msg[256]
+
+        if not self.threaded:
+            self.total_size += pkt.size
+            self.packets += 1
+            res = av_interleaved_write_frame(self.fmt_ctx, pkt)
+            if res < 0:
+                with gil:
+                    raise Exception('Error writing packet: ' + tcode(emsg(res, msg, sizeof(msg))))
+            return 0
+
+        item = <QueuedPacket *>malloc(sizeof(QueuedPacket))
+        if item != NULL:
+            item.pkt = av_packet_alloc()
+        if item == NULL or item.pkt == NULL:
+            av_packet_unref(pkt)
+            free(item)
+            with gil:
+                raise MemoryError()
+        av_packet_move_ref(item.pkt, pkt)
+        item.next = NULL
+
+        self.cond.lock()
+        # block the encoder until the muxer thread caught up, so a slow file
+        # backs up into the frame queues and write_frame
+        while self.depth >= self.queue_size and not self.failed:
+            self.cond.cond_wait()
+        if self.failed:
+            self.cond.unlock()
+            av_packet_free(&item.pkt)
+            free(item)
+            with gil:
+                raise Exception('Cannot write packet because the muxer failed.')
+        if self.last == NULL:
+            self.first = item
+        else:
+            self.last.next = item
+        self.last = item
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.total_size += item.pkt.size
+        # the muxer thread and other encoders wait on the same condition
+        self.cond.cond_broadcast()
+        self.cond.unlock()
+        return 0
+
+    cdef int encode_frame(_PacketMuxer self, MediaStream *s, AVFrame *frame_in,
+                          double pts) nogil except 1:
+        '''Converts and encodes the frame and writes its packets. If ``frame_in``
+        is NULL, the encoder is flushed instead.
+        '''
+        cdef int res
+        cdef AVFrame *frame_out = NULL
+        cdef AVPacket pkt
+        cdef char msg[256]
+
+        if frame_in != NULL:
+            if s.av_frame != NULL:
+                frame_out = av_frame_alloc()
+                if frame_out == NULL:
+                    with gil:
+                        raise MemoryError
+                frame_out.format = s.av_frame.format
+                frame_out.width = s.av_frame.width
+                frame_out.height = s.av_frame.height
+                res = frame_pool_get_buffer(frame_out, 32)
+                if res < 0:
+                    av_frame_free(&frame_out)
+                    with gil:
+                        raise Exception('Cannot allocate frame buffers: ' + tcode(emsg(res, msg, sizeof(msg))))
+                res = scale_frame(s.sws_ctx, frame_in, frame_out, s.scale_threads, 0)
+                if res < 0:
+                    av_frame_free(&frame_out)
+                    with gil:
+                        raise Exception('Cannot convert frame: ' + tcode(emsg(res, msg, sizeof(msg))))
+            else:
+                frame_out = av_frame_clone(frame_in)
+                if frame_out == NULL:
+                    with gil:
+                        raise MemoryError
+
+            frame_out.pict_type = AV_PICTURE_TYPE_NONE
+            frame_out.pts = <int64_t>floor(pts / av_q2d(s.codec_ctx.time_base) + 0.5)
+
+        av_init_packet(&pkt)
+        pkt.data = NULL
+        pkt.size = 0
+
+        # the encoder keeps its own reference to the frame
+        res = avcodec_send_frame(s.codec_ctx, frame_out)
+        av_frame_free(&frame_out)
+        if res < 0:
+            with gil:
+                if frame_in == NULL:
+                    raise Exception('Error sending NULL frame: ' + tcode(emsg(res, msg, sizeof(msg))))
+                raise Exception('Error sending frame: ' + tcode(emsg(res, msg, sizeof(msg))))
+
+        while True:
+            res = avcodec_receive_packet(s.codec_ctx, &pkt)
+            if res < 0:
+                if res != AVERROR_EOF and res != AV_EAGAIN:
+                    with gil:
+                        raise Exception('Error getting encoded packet: ' + tcode(emsg(res, msg, sizeof(msg))))
+                break
+
+            if pkt.pts != AV_NOPTS_VALUE:
+                pkt.pts = av_rescale_q(pkt.pts, s.codec_ctx.time_base, s.av_stream.time_base)
+            if pkt.dts != AV_NOPTS_VALUE:
+                pkt.dts = av_rescale_q(pkt.dts, s.codec_ctx.time_base, s.av_stream.time_base)
+            pkt.stream_index = s.av_stream.index
+            self.write_packet(&pkt)
+
+        if frame_in != NULL:
+            s.pts += 1
+            s.count += 1
+        return 0
+
+
+cdef class _StreamEncoder(object):
+    '''Encodes the frames queued for a stream in a thread.
+    '''
+
+    def __cinit__(self):
+        self.s = NULL
+        self.first = self.last = NULL
+
+    def __dealloc__(self):
+        self.free_frames()
+
+    def start(self):
+        self.cond = MTCond.__new__(MTCond, Native_MT)
+        self.thread = MTThread.__new__(MTThread, Native_MT)
+        self.thread.create_thread(encode_thread_enter, "writer_encode", <void *>self)
+
+    cdef void free_frames(_StreamEncoder self) nogil:
+        cdef QueuedFrame *item
+        while self.first != NULL:
+            item = self.first
+            self.first = item.next
+            av_frame_free(&item.frame)
+            free(item)
+        self.last = NULL
+        self.depth = 0
+
+    cdef int stop(_StreamEncoder self) nogil except 1:
+        if self.thread is None:
+            return 0
+        self.cond.lock()
+        self.eof = 1
+        self.cond.cond_signal()
+        self.cond.unlock()
+        self.thread.wait_thread(NULL)
+        return 0
+
+    cdef void fail(_StreamEncoder self, object error):
+        self.error = error
+        with nogil:
+            self.cond.lock()
+            self.failed = 1
+            self.free_frames()
+            # wake write_frame if it's waiting for room in the queue
+            self.cond.cond_signal()
+            self.cond.unlock()
+
+    cdef int put_frame(_StreamEncoder self, AVFrame *frame, double pts) nogil except -1:
+        '''Queues the frame, which is then owned by the encoder. Returns 0 if the
+        frame was dropped instead, in which case the caller still owns it.
+        '''
+        cdef QueuedFrame *item = <QueuedFrame *>malloc(sizeof(QueuedFrame))
+        if item == NULL:
+            with gil:
+                raise MemoryError()
+        item.frame = frame
+        item.pts = pts
+        item.next = NULL
+        item.queued_time = av_gettime_relative()
+
+        self.cond.lock()
+        while self.depth >= self.queue_size and not self.failed and not self.drop_frames:
+            self.cond.cond_wait()
+        if self.failed or self.depth >= self.queue_size:
+            if not self.failed:
+                self.dropped += 1
+            self.cond.unlock()
+            free(item)
+            return 0
+
+        if self.last == NULL:
+            self.first = item
+        else:
+            self.last.next = item
+        self.last = item
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.cond.cond_signal()
+        self.cond.unlock()
+        return 1
+
+    cdef int run(_StreamEncoder self) nogil except 1:
+        cdef QueuedFrame *item
+        cdef int64_t latency
+
+        while True:
+            self.cond.lock()
+            while self.first == NULL and not self.eof:
+                self.cond.cond_wait()
+            item = self.first
+            if item == NULL:
+                self.cond.unlock()
+                break
+            self.first = item.next
+            if self.first == NULL:
+                self.last = NULL
+            self.depth -= 1
+            # wake write_frame if it's waiting for room in the queue
+            self.cond.cond_signal()
+            self.cond.unlock()
+
+            try:
+                self.muxer.encode_frame(self.s, item.frame, item.pts)
+            finally:
+                av_frame_free(&item.frame)
+                latency = av_gettime_relative() - item.queued_time
+                free(item)
+
+            self.cond.lock()
+            self.frames += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.cond.unlock()
+
+        if self.s.count:
+            self.muxer.encode_frame(self.s, NULL, 0)
+        return 0
@@ -303,8 +303,9 @@ def get_wheel_data():
 
 
 mods = [
-    'pic', 'threading', 'tools', 'writer', 'player/clock', 'player/core',
-    'player/decoder', 'player/frame_queue', 'player/player', 'player/queue']
+    'avio', 'pic', 'threading', 'tools', 'writer', 'player/audio_buffer', 'player/clock',
+    'player/core', 'player/decoder', 'player/frame_queue', 'player/player',
+    'player/pool', 'player/queue']
 c_options['use_sdl2_mixer'] = c_options['use_sdl2_mixer']
 
 
@@ -408,8 +409,8 @@ setup(name='ffpyplayer',
       packages=['ffpyplayer', 'ffpyplayer.player', 'ffpyplayer.tests'],
       package_data={
         'ffpyplayer': [
-            'player/*.pxd', 'clib/misc.h', 'includes/*.pxi', 'includes/*.h',
-            '*.pxd', 'player/*.pyx', 'clib/misc.c', '*.pyx']},
+            'player/*.pxd', 'clib/misc.h', 'clib/mt_native.h', 'includes/*.pxi',
+            'includes/*.h', '*.pxd', 'player/*.pyx', 'clib/misc.c', '*.pyx']},
       data_files=get_wheel_data(),
       cmdclass=cmdclass, ext_modules=ext_modules,
       setup_requires=setup_requires)